@@ -50,7 +50,7 @@ EXCLUDES = ['.hgignore', '.hgtags', '.hgeol', '*.target', '*.obj', '*.pyc', '*.m
 EXCLUDES_RELEASE = ['testsuite']
 
 # Include filter for additional asset files (not on hg) to copy (glob syntax)
-ASSET_INCLUDES = ['*.npz', '*.mhpxy', '*.list', '*.thumb', '*.png', '*.json', '*.mhskel', '*.mhw', '*.mhmat', '*.mhclo', '*.proxy', 'glsl/*.txt', 'languages/*.ini', "*.bvh", "*.mhm", "*.qss", "*.mht", "*.svg", "icons/makehuman_bg.svg", "icons/makehuman.png"]
+ASSET_INCLUDES = ['*.npz', '*.npy', '*.mhpxy', '*.mhbanim', '*.list', '*.thumb', '*.png', '*.json', '*.mhskel', '*.mhw', '*.mhmat', '*.mhclo', '*.proxy', 'glsl/*.txt', 'languages/*.ini', "*.bvh", "*.mhm", "*.qss", "*.mht", "*.svg", "icons/makehuman_bg.svg", "icons/makehuman.png"]
 
 # Even if empty, create these folders (relative to export path)
 CREATE_FOLDERS = ['makehuman/data/backgrounds', 'makehuman/data/clothes', 'makehuman/data/teeth', 'makehuman/data/eyelashes', 'makehuman/data/tongue']
@@ -370,6 +370,14 @@ class MHAppExporter(object):
             sys.exit(1)
         print "\n"
 
+        ###COMPILE ANIMATIONS
+        try:
+            self.runProcess( ["python","compile_animations.py"] )
+        except subprocess.CalledProcessError:
+            print "check that compile_animations.py is working correctly"
+            sys.exit(1)
+        print "\n"
+
     def getExcludes(self):
         if self.isRelease():
             return EXCLUDES + EXCLUDES_RELEASE
@@ -43,7 +43,7 @@ __docformat__ = 'restructuredtext'
 
 import numpy as np
 
-from module3d import Object3D
+from module3d import Object3D, sum_rows, group_rows
 from progress import Progress
 import log
 
@@ -211,23 +211,16 @@ class SubdivisionObject(Object3D):
         self.evert = np.asarray(vedgelist, dtype = np.uint32)
         self.etexc = np.asarray(tedgelist, dtype = np.uint32)
 
-        # TODO document
-        self.vedge = np.zeros((nverts, self.MAX_FACES), dtype=np.uint32)
-        self.nedges = np.zeros(nverts, dtype=np.uint8)
+        # Edges connected to each base vertex: the first nedges[i] columns of
+        # row i of vedge, which is as wide as the highest vertex valence
+        self.nedges = np.bincount(self.evert[:,0,:].flat, minlength=nverts)
+        self.vedge = np.zeros((nverts, max(1, self.nedges.max())), dtype=np.uint32)
 
         progress.step()
 
-        map_ = np.argsort(self.evert[:,0,:].flat)
-        vi = self.evert[:,0,:].flat[map_]
-        ei = np.mgrid[:len(self.evert),:2][0].flat[map_].astype(np.uint32)
-        del map_
-        ix, first = np.unique(vi, return_index=True)
-        n = first[1:] - first[:-1]
-        n = np.hstack((n, np.array([len(vi) - first[-1]])))
-        self.nedges[ix] = n.astype(np.uint8)
-        for i in xrange(len(ix)):
-            self.vedge[ix[i],:n[i]] = ei[first[i]:][:n[i]]
-        del vi, ei, ix, n, first
+        ei = np.repeat(np.arange(len(self.evert), dtype=np.uint32), 2)
+        group_rows(self.evert[:,0,:], ei, self.vedge)
+        del ei
 
         progress.step()
 
@@ -237,8 +230,9 @@ class SubdivisionObject(Object3D):
         self.vnorm = np.zeros((nverts, 3), dtype=np.float32)
         self.vtang = np.zeros((nverts, 4), dtype=np.float32)
         self.color = np.zeros((nverts, 4), dtype=np.uint8) + 255
-        self.vface = np.zeros((nverts, self.MAX_FACES), dtype=np.uint32)
-        self.nfaces = np.zeros(nverts, dtype=np.uint8)
+        self.vface_offsets = np.zeros(nverts+1, dtype=np.int64)
+        self.vface_indices = np.zeros(0, dtype=np.uint32)
+        self._vface = None
 
         self.ucoor = False
         self.unorm = False
@@ -319,28 +313,32 @@ class SubdivisionObject(Object3D):
 
 
         # VERTEX MAPPING _inverse_parent_map: (parent -> subdiv)
-        # [[v0 c0 c1 c2 ... cM e0 e1 e2 ... eM]   with M == parent.MAX_FACES
-        #  [v1 c0 c1 c2 ... cM e0 e1 e2 ... eM]
+        # [[v0 c0 c1 c2 ... cM e0 e1 e2 ... eN]
+        #  [v1 c0 c1 c2 ... cM e0 e1 e2 ... eN]
         #  ...
-        #  [vn c0 c1 c2 ... cM e0 e1 e2 ... eM]]  with n == parent.getVertexCount()
+        #  [vn c0 c1 c2 ... cM e0 e1 e2 ... eN]]  with n == parent.getVertexCount()
         #
-        # Invalid columns have index value -1
+        # with M and N the highest number of faces and edges connected to a
+        # parent vertex. Invalid columns have index value -1
 
-        self._inverse_parent_map = - np.ones((self.parent.getVertexCount(), 1+2*parent.MAX_FACES), dtype=np.int32)
+        cvert = self._parent_map[self.cbase:self.ebase, :4]
+        evert = self._parent_map[self.ebase:, :2]
+        nParentVerts = self.parent.getVertexCount()
+        maxFaces = max(1, np.bincount(cvert[cvert >= 0], minlength=nParentVerts).max())
+        maxEdges = max(1, np.bincount(evert[evert >= 0], minlength=nParentVerts).max())
+
+        self._inverse_parent_map = - np.ones((nParentVerts, 1+maxFaces+maxEdges), dtype=np.int32)
         # Inverse map base verts
         self._inverse_parent_map[:, 0] = self.vtx_rmap[:]
 
         # Inverse map center verts
-        cvert = self._parent_map[self.cbase:self.ebase, :4]
         _reverse_n_to_m_map(cvert,
-                            self._inverse_parent_map[:, 1:1+parent.MAX_FACES],
+                            self._inverse_parent_map[:, 1:1+maxFaces],
                             offset=self.cbase)
 
         # Inverse map edge verts
-        evert = self._parent_map[self.ebase:, :2]
-        col_offset = 1 + parent.MAX_FACES
         _reverse_n_to_m_map(evert,
-                            self._inverse_parent_map[:, col_offset:col_offset+parent.MAX_FACES],
+                            self._inverse_parent_map[:, 1+maxFaces:],
                             offset=self.ebase)
 
         # TODO defer calculation of mapping until it is requested
@@ -423,18 +421,16 @@ class SubdivisionObject(Object3D):
         evert[...] = np.where(inedge[:,None], mvert / 2, (mvert + vc) / 4)
         del ic1, ic2, vc
 
-        nvface = parent.nfaces[self.vtx_map]
+        pfaces, nvface = parent.getVertexFaces(self.vtx_map)
 
         # comment: this code could really do with some comments
-        edgewt = np.arange(self.MAX_FACES)[None,:,None] < self.nedges[:,None,None]
+        edgewt = np.arange(self.vedge.shape[1])[None,:,None] < self.nedges[:,None,None]
         edgewt2 = edgewt * inedge[self.vedge][:,:,None]
         edgewt = edgewt / self.nedges.astype(np.float32)[:,None,None]
         nvedge = np.sum(edgewt2, axis=1)
         oevert = np.sum(mvert[self.vedge] * edgewt / 2, axis=1)
         oevert2 = np.sum(mvert[self.vedge] * edgewt2 / 2, axis=1)
-        facewt = np.arange(self.MAX_FACES)[None,:,None] < nvface[:,None,None]
-        facewt = facewt / nvface.astype(np.float32)[:,None,None]
-        ofvert = np.sum(cvert[self.face_rmap[parent.vface[self.vtx_map]]] * facewt, axis=1)
+        ofvert = sum_rows(cvert[self.face_rmap[pfaces]], nvface) / nvface.astype(np.float32)[:,None]
         opvert = pcoord
 
         valid = nvface >= 3
@@ -491,18 +487,10 @@ class SubdivisionObject(Object3D):
 
 
 def _reverse_n_to_m_map(input, output, offset=0):
-    # Using same algorithm as module3d._update_faces to construct inverse 
-    # mapping with variable number of valid columns
-    map_ = np.argsort(input.flat)
-    vi = input.flat[map_]
-    fi = np.mgrid[:input.shape[0],:input.shape[1]][0].flat[map_].astype(np.uint32)
-    del map_
-    ix, first = np.unique(vi, return_index=True)
-    n = first[1:] - first[:-1]
-    n_last = len(vi) - first[-1]
-    n = np.hstack((n, np.array([n_last])))
-    for i in xrange(len(ix)):
-        output[ix[i], :n[i]] = offset + fi[first[i]:][:n[i]]
+    # Store, for every index m referenced in input, the (offset) row numbers
+    # of input that reference it in row m of output
+    rows = np.repeat(np.arange(input.shape[0], dtype=np.uint32), input.shape[1])
+    group_rows(input, offset + rows, output)
 
 
 def createSubdivisionObject(object, staticFaceMask=None):
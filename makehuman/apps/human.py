@@ -47,6 +47,8 @@ from getpath import getSysDataPath, canonicalPath
 import log
 import material
 import animation
+import proxy
+import humanmodifier
 
 from makehuman import getBasemeshVersion, getShortVersion, getVersionStr, getVersion
 
@@ -75,6 +77,14 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         self.targetsDetailStack = {}  # All details targets applied, with their values
         self.symmetryModeEnabled = False
 
+        # Paths (with their weights) of the targets applied to the seedmesh by
+        # the last applyAllTargets, and the resulting rest coordinates
+        self._appliedTargets = {}
+        self._appliedCoords = None
+        self._appliedGeneration = None
+        self._incrementalUpdates = 0
+        self.maxIncrementalUpdates = 50     # Number of incremental target updates after which all targets are reapplied, to avoid drift
+
         self.setDefaultValues()
 
         self.bodyZones = ['l-eye','r-eye', 'jaw', 'nose', 'mouth', 'head', 'neck', 'torso', 'hip', 'pelvis', 'r-upperarm', 'l-upperarm', 'r-lowerarm', 'l-lowerarm', 'l-hand',
@@ -91,6 +101,7 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         self._modifier_dependencyMapping = dict()       # Maps a macro variable to all the modifiers that depend on it
         self._modifier_groups = dict()
         self._modifier_type_cache = dict()
+        self._macroFactorTable = None                   # Weights of all macro targets, see getMacroFactorTable()
 
         self.blockEthnicUpdates = False                 # When set to True, changes to race are not normalized automatically
 
@@ -106,6 +117,8 @@ class Human(guicommon.Object, animation.AnimatedMesh):
 
         if oldPxyMesh:
             self.removeBoundMesh(oldPxyMesh.name)
+        if oldPxy:
+            self._clearProxyVertexWeights(oldPxy)
         if self.proxy:
             # Add new mesh and vertex weight assignments
             self._updateMeshVertexWeights(self.getProxyMesh())
@@ -212,11 +225,18 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         # TODO avoid continually reposing when loading mhm file with many proxies
         if oldPxy:
             self.removeBoundMesh(oldPxy.object.getSeedMesh().name)
+            self._clearProxyVertexWeights(oldPxy)
         if newPxy:
             # Add new mesh and vertex weight assignments
             self._updateMeshVertexWeights(newPxy.object.getSeedMesh())
             self.refreshPose()
 
+    def _clearProxyVertexWeights(self, pxy):
+        """
+        Evict the cached vertex weights of a proxy that is removed.
+        """
+        proxy.clearVertexWeightsCache(pxy.getUuid())
+
     def maskFaces(self):
         """
         Set up the initial (static) face mask for the human basemesh that hides
@@ -324,6 +344,16 @@ class Human(guicommon.Object, animation.AnimatedMesh):
             proxies.append(pxy)
         return proxies
 
+    def getProxyFitting(self):
+        """
+        The proxy.ProxyFitting that fits all proxies attached to this human
+        together. It is rebuilt whenever the set of attached proxies changes.
+        """
+        proxies = [pxy for pxy in self.getProxies() if pxy.ref_vIdxs is not None]
+        if self._proxyFitting is None or self._proxyFitting.proxies != proxies:
+            self._proxyFitting = proxy.ProxyFitting(proxies)
+        return self._proxyFitting
+
     def getTypedSimpleProxies(self, ptype):
         ptype = ptype.capitalize()
         table = {
@@ -853,10 +883,32 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         elif name in self.targetsDetailStack:
             del self.targetsDetailStack[name]
 
+    def setDetails(self, details):
+        """
+        Set the weights of multiple targets at once. Unlike setDetail(), the
+        keys of the details dict are expected to be canonical paths already
+        (as returned by Modifier.getTargetWeights()).
+        """
+        for name, value in details.iteritems():
+            if value:
+                self.targetsDetailStack[name] = value
+            elif name in self.targetsDetailStack:
+                del self.targetsDetailStack[name]
+
     def getDetail(self, name):
         name = canonicalPath(name)
         return self.targetsDetailStack.get(name, 0.0)
 
+    def getMacroFactorTable(self):
+        """
+        The humanmodifier.MacroFactorTable with the targets of all macro
+        modifiers of this human. It is rebuilt when modifiers are added or
+        removed.
+        """
+        if self._macroFactorTable is None:
+            self._macroFactorTable = humanmodifier.MacroFactorTable([m for m in self.modifiers if m.isMacro()])
+        return self._macroFactorTable
+
     def updateMacroModifiers(self):
         """Update the targetsDetailStack for this human
         determined by the macromodifier target combinations."""
@@ -933,6 +985,7 @@ class Human(guicommon.Object, animation.AnimatedMesh):
             raise RuntimeError("Modifier with name %s is already attached to human." % modifier.fullName)
 
         self._modifier_type_cache = dict()
+        self._macroFactorTable = None
 
         self._modifiers[modifier.fullName] = modifier
 
@@ -1042,6 +1095,7 @@ class Human(guicommon.Object, animation.AnimatedMesh):
                     self.setDetail(t[0], None)
 
             self._modifier_type_cache = dict()
+            self._macroFactorTable = None
         except:
             log.debug('Failed to remove modifier %s from human.', modifier.fullName, exc_info=True)
             pass
@@ -1077,11 +1131,17 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         """
         return [ fg_name for fg_name in self.meshData.getFaceGroups() if fg_name.startswith('joint-') ]
 
-    def applyAllTargets(self, update=True):
+    def applyAllTargets(self, update=True, useMorphBasis=False):
         """
         This method applies all targets, in function of age and sex
 
-        **Parameters:** None.
+        **Parameters:**
+
+        useMorphBasis:
+            *bool*. Reapply all targets with the morph basis (see
+            algos3d.getMorphBasis) instead of only the changed targets. This
+            is faster when most of the targets changed, such as for a
+            randomized or a newly generated body.
         """
         progress = Progress()
 
@@ -1089,13 +1149,8 @@ class Human(guicommon.Object, animation.AnimatedMesh):
 
         # First call progress callback (which often processes events) before resetting mesh
         # so that mesh is not drawn in its reset state
-        algos3d.resetObj(self.meshData)  # Reset mesh is in rest pose
-
-        # Apply targets to seedmesh coordinates
-        itprog = Progress(len(self.targetsDetailStack))
-        for (targetPath, morphFactor) in self.targetsDetailStack.iteritems():
-            algos3d.loadTranslationTarget(self.meshData, targetPath, morphFactor, None, 0, 0)
-            itprog.step()
+        # Apply targets to seedmesh coordinates (in rest pose)
+        self._applyDetailStack(useMorphBasis)
 
         # Make sure self.getRestposeCoordinates is up-to-date directly (required for proxy fitting)
         self._updateOriginalMeshCoords(self.meshData.name, self.meshData.coord)
@@ -1135,13 +1190,75 @@ class Human(guicommon.Object, animation.AnimatedMesh):
             progress(0.5, 0.8)
             if not self.isPosed():
                 # Update seedmesh normals (if not already done so by posing)
-                self.meshData.calcNormals(1, 1)
+                # only in the region changed by the targets
+                self.meshData.calcDirtyNormals()
                 progress(0.8, 0.99)
                 if update:
                     self.meshData.update()
 
         progress(1.0)
 
+    def _applyDetailStack(self, useMorphBasis=False):
+        """
+        Set the seedmesh coordinates to the rest pose coordinates with all
+        targets of the detail stack applied.
+        If the stack was applied before, only the difference between the
+        previously applied and the current target weights is applied to the
+        previous result, so that the cost is proportional to the number of
+        changed targets. Every maxIncrementalUpdates updates all targets are
+        reapplied to the unmodified seedmesh instead, to correct accumulated
+        rounding errors. All targets are also reapplied when a buffered
+        target was reloaded or replaced since the last update, as its
+        previously applied data is no longer known.
+        If useMorphBasis is True, all targets are reapplied, with a single
+        product with the morph basis for the targets it contains, which are
+        not loaded as Target objects. Without a packed target store there
+        is no morph basis and the changed targets are applied instead.
+        """
+        basis = algos3d.getMorphBasis(self.meshData) if useMorphBasis else None
+        generation = algos3d.getTargetBufferGeneration()
+
+        if basis is not None or \
+           self._appliedCoords is None or \
+           len(self._appliedCoords) != self.meshData.getVertexCount() or \
+           self._incrementalUpdates >= self.maxIncrementalUpdates or \
+           generation != self._appliedGeneration:
+            if basis is not None:
+                weights, _ = basis.getWeights(self.targetsDetailStack)
+                self.meshData.changeCoords(self.meshData.orig_coord + basis.dot(weights))
+                applied = dict( (targetPath, weight) for targetPath, weight
+                                in self.targetsDetailStack.items() if weight and targetPath in basis )
+            else:
+                algos3d.resetObj(self.meshData)
+                applied = {}
+            self._incrementalUpdates = 0
+        else:
+            # Only restore coordinates that were changed (eg. by posing), so
+            # that markCoords records only the region that really changed
+            changed = np.flatnonzero(np.any(self.meshData.coord != self._appliedCoords, axis=1))
+            if len(changed):
+                self.meshData.changeCoords(self._appliedCoords[changed], changed)
+            applied = self._appliedTargets
+            self._incrementalUpdates += 1
+
+        # Targets are looked up by path, so that targets evicted from the
+        # target buffer since the last update are not kept in memory
+        delta = []
+        for targetPath in set(applied.keys()).union(self.targetsDetailStack.keys()):
+            oldWeight = applied.get(targetPath, 0)
+            weight = self.targetsDetailStack.get(targetPath, 0)
+            if weight != oldWeight:
+                target = algos3d.getTarget(self.meshData, targetPath)
+                target.morphFactor = weight
+                delta.append( (target, weight - oldWeight) )
+
+        algos3d.applyTargets(self.meshData, delta, 0, 0)
+
+        self._appliedTargets = dict( (targetPath, weight) for targetPath, weight
+                                     in self.targetsDetailStack.items() if weight )
+        self._appliedGeneration = algos3d.getTargetBufferGeneration()
+        self._appliedCoords = self.meshData.coord.copy()
+
     def getPartNameForGroupName(self, groupName):
         # TODO is this still used anywhere?
         for k in self.bodyZones:
@@ -1252,6 +1369,8 @@ class Human(guicommon.Object, animation.AnimatedMesh):
 
         self._clothesProxies = {}
 
+        self._proxyFitting = None
+
     def getMaterial(self):
         return super(Human, self).getMaterial()
 
@@ -1266,9 +1385,12 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         """Change user-selected skeleton.
         """
         self.callEvent('onChanging', events3d.HumanEvent(self, 'user-skeleton'))
+        if self.skeleton is not skel:
+            proxy.clearVertexWeightsCache()
         self.skeleton = skel
         if self.skeleton:
             self.skeleton.dirty = True
+        self._updateJointVertices()
         self.callEvent('onChanged', events3d.HumanEvent(self, 'user-skeleton'))
 
     def getSkeleton(self):
@@ -1287,6 +1409,7 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         Generally this skeleton is initialized once and does not change.
         """
         self.callEvent('onChanging', events3d.HumanEvent(self, 'skeleton'))
+        proxy.clearVertexWeightsCache()
         animation.AnimatedMesh.setBaseSkeleton(self, skel)
         self.updateVertexWeights(skel.getVertexWeights() if skel else None)
         self.callEvent('onChanged', events3d.HumanEvent(self, 'skeleton'))
@@ -1338,6 +1461,24 @@ class Human(guicommon.Object, animation.AnimatedMesh):
         else:
             animation.AnimatedMesh.updateVertexWeights(self, mesh.name, weights)
 
+        if mesh == self.meshData:
+            self._updateJointVertices()
+
+    def _updateJointVertices(self):
+        """
+        Ensure the basemesh vertices that determine joint positions are always
+        skinned, also when they are masked (joint helpers, or body parts
+        deleted by proxies), as skeletons are fitted to the posed mesh.
+        """
+        if not self.containsBoundMesh(self.meshData):
+            return
+        verts = [self.meshData.getVerticesForGroups(self.getJoints())]
+        for skel in [self.getBaseSkeleton(), self.skeleton]:
+            if skel:
+                verts.extend(skel.joint_pos_idxs.values())
+        verts = np.concatenate([np.asarray(v, dtype=np.uint32).reshape(-1) for v in verts])
+        self.setRequiredVertices(self.meshData.name, verts)
+
 
     def getVertexWeights(self, skel=None):
         """Get vertex weights for human body. Optionally remap them to fit a
@@ -1369,18 +1510,31 @@ class Human(guicommon.Object, animation.AnimatedMesh):
             self.skeleton.dirty = True
         super(Human, self).setActiveAnimation(anim_name)
 
-    def refreshPose(self, updateIfInRest=False):
+    def refreshPose(self, updateIfInRest=False, skinMasked=False):
         event = events3d.HumanEvent(self, 'poseRefresh')
         self.callEvent('onChanging', event)
         if self.skeleton:
             self.skeleton.dirty = True
-        super(Human, self).refreshPose(updateIfInRest)
+        super(Human, self).refreshPose(updateIfInRest, skinMasked=skinMasked)
         if self.isSubdivided():
             self.updateSubdivisionMesh()
             self.mesh.calcNormals()
             self.mesh.update()
         self.callEvent('onChanged', event)
 
+    def refreshFaceMasks(self):
+        """
+        Pose the vertices revealed by a change of the face masks of the human
+        or its proxies (eg. after removing a proxy that deleted vertices).
+        """
+        if not super(Human, self).refreshFaceMasks():
+            return False
+        if self.isSubdivided():
+            self.updateSubdivisionMesh()
+            self.mesh.calcNormals()
+            self.mesh.update()
+        return True
+
     def load(self, filename, update=True, strict=False):
         from codecs import open
 
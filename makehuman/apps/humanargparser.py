@@ -198,9 +198,9 @@ def applyModelingArguments(human, argOptions):
             except:
                 raise RuntimeError('No modifier named "%s" as specified by --modifier command. See --listmodifiers for list of acceptable options.' % mName)
 
-    # Update human
+    # Update human, most of its targets changed
     human.updateMacroModifiers()
-    human.applyAllTargets()
+    human.applyAllTargets(useMorphBasis=True)
 
     ### Skeleton
     if argOptions.get("rig", None):
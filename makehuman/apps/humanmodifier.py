@@ -47,6 +47,7 @@ import operator
 import numpy as np
 import log
 import targets
+from getpath import canonicalPath
 
 
 # Gender
@@ -177,6 +178,8 @@ class Modifier(object):
 
         self._defaultValue = 0
 
+        self._factorTable = None
+
         self.human = None
 
     def setHuman(self, human):
@@ -197,9 +200,7 @@ class Modifier(object):
         value = self.clampValue(value)
         factors = self.getFactors(value)
 
-        tWeights = getTargetWeights(self.targets, factors, value)
-        for tpath, tWeight in tWeights.items():
-            self.human.setDetail(tpath, tWeight)
+        self.human.setDetails(self.getTargetWeights(factors, value))
 
         if skipDependencies:
             return
@@ -242,19 +243,38 @@ class Modifier(object):
     def getDefaultValue(self):
         return self._defaultValue
 
+    @property
+    def factorTable(self):
+        """
+        The targets of this modifier compiled to a TargetFactorTable.
+        """
+        if self._factorTable is None or self._factorTable.targets is not self.targets:
+            self._factorTable = TargetFactorTable(self.targets)
+        return self._factorTable
+
+    def getTargetWeights(self, factors, value=1.0):
+        """
+        Weights of the targets of this modifier for the specified factor
+        values, as a dict keyed by canonical target path. Equivalent to
+        getTargetWeights(self.targets, factors, value), but evaluated with one
+        product over the compiled factor table.
+        """
+        table = self.factorTable
+        return dict(zip(table.targetPaths, table.getWeights(factors, value).tolist()))
+
     def buildLists(self):
         # Collect vertex and face indices if we didn't yet
         if self.verts is None and self.faces is None:
-            # Collect verts
+            # Collect verts and faces
             vmask = np.zeros(self.human.meshData.getVertexCount(), dtype=bool)
+            fmask = np.zeros(self.human.meshData.getFaceCount(), dtype=bool)
             for target in self.targets:
                 t = algos3d.getTarget(self.human.meshData, target[0])
                 vmask[t.verts] = True
+                fmask[t.faces] = True
             self.verts = np.argwhere(vmask)[...,0]
-            del vmask
-
-            # collect faces
-            self.faces = self.human.meshData.getFacesForVertices(self.verts)
+            self.faces = np.argwhere(fmask)[...,0]
+            del vmask, fmask
 
     def updateValue(self, value, updateNormals=1, skipUpdate=False):
         if self.verts is None and self.faces is None:
@@ -285,7 +305,7 @@ class Modifier(object):
 
         # Update vertices
         if updateNormals:
-            self.human.meshData.calcNormals(1, 1, self.verts, self.faces)
+            self.human.meshData.calcDirtyNormals()
         self.human.meshData.update()
         event = events3d.HumanEvent(self.human, self.eventType)
         event.modifier = self.fullName
@@ -462,9 +482,7 @@ class ManagedTargetModifier(Modifier):
         value = self.clampValue(value)
         factors = self.getFactors(value)
 
-        tWeights = getTargetWeights(self.targets, factors)
-        for tpath, tWeight in tWeights.items():
-            self.human.setDetail(tpath, tWeight)
+        self.human.setDetails(self.getTargetWeights(factors))
 
         if skipDependencies:
             return
@@ -609,6 +627,17 @@ class MacroModifier(ManagedTargetModifier):
         factors[self.groupName] = 1.0
         return factors
 
+    def getTargetWeights(self, factors, value=1.0):
+        """
+        Weights of the targets of this modifier, taken from the weights of
+        all macro targets of the human, which are evaluated together (see
+        MacroFactorTable).
+        """
+        table = self.human.getMacroFactorTable()
+        if not table.contains(self):
+            return super(MacroModifier, self).getTargetWeights(factors, value)
+        return table.getTargetWeights(self, factors, value)
+
     def buildLists(self):
         pass
 
@@ -641,6 +670,114 @@ class EthnicModifier(MacroModifier):
         self.human.blockEthnicUpdates = _tmp
         return oldVals
 
+class TargetFactorTable(object):
+    """
+    Compiled form of a list of (targetpath, factordependencies) tuples, as
+    found in the targets member of modifiers, for evaluating the weights of
+    all targets at once.
+    Every row of the integer table lists the factors of one target as
+    indices in a vector of factor values (see getFactorVector()), padded
+    with the index of a constant 1.0. The weight of each target is the
+    product of the gathered factor values of its row, so the weights of all
+    targets are evaluated with one NumPy product, optionally for many
+    factor vectors (eg. the macro settings of N humans) at once.
+    Target paths are canonicalized once, when the table is compiled.
+    """
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.targetPaths = [canonicalPath(tpath) for (tpath, _) in targets]
+        self.factorNames = sorted(set([factor for (_, tfactors) in targets for factor in tfactors]))
+        factorIdx = dict( (name, i) for i, name in enumerate(self.factorNames) )
+
+        nCols = max([len(tfactors) for (_, tfactors) in targets] + [1])
+        self.table = np.full((len(targets), nCols), len(self.factorNames), dtype=np.uint32)
+        for t_idx, (_, tfactors) in enumerate(targets):
+            self.table[t_idx, :len(tfactors)] = [factorIdx[factor] for factor in tfactors]
+
+    def getFactorVector(self, factors, ignoreNotfound=False):
+        """
+        Convert a dict of factor values to a factor vector for this table.
+        If factors is a list of dicts, an (n, nFactors+1) array is returned.
+        """
+        if not isinstance(factors, dict):
+            return np.asarray([self.getFactorVector(f, ignoreNotfound) for f in factors], dtype=np.float64)
+        if ignoreNotfound:
+            values = [factors.get(name, 1.0) for name in self.factorNames]
+        else:
+            values = [factors[name] for name in self.factorNames]
+        return np.asarray(values + [1.0], dtype=np.float64)
+
+    def getWeights(self, factors, value=1.0, ignoreNotfound=False):
+        """
+        Evaluate the weights of all targets (ordered as targetPaths).
+        factors is a dict of factor values, a list of such dicts, or
+        factor vectors as returned by getFactorVector(). For multiple factor
+        dicts or vectors an (n, nTargets) array is returned.
+        """
+        if not isinstance(factors, np.ndarray):
+            factors = self.getFactorVector(factors, ignoreNotfound)
+        return value * np.prod(factors[..., self.table], axis=-1)
+
+class MacroFactorTable(object):
+    """
+    The targets of a set of macro modifiers (the macro modifiers of a human)
+    compiled to one TargetFactorTable, with targets shared by several
+    modifiers included once.
+    The weights of macro targets only depend on the macro variables of the
+    human, so the weights of all of them are evaluated in one product, which
+    is reused by all macro modifiers until the macro variables change.
+    """
+
+    def __init__(self, modifiers):
+        self.modifiers = list(modifiers)
+        self._targets = dict( (m.fullName, m.targets) for m in self.modifiers )
+
+        targetIdx = dict()
+        targetList = []
+        self._indices = dict()
+        for m in self.modifiers:
+            for target in m.targets:
+                if target[0] not in targetIdx:
+                    targetIdx[target[0]] = len(targetList)
+                    targetList.append(target)
+            self._indices[m.fullName] = np.asarray([targetIdx[target[0]] for target in m.targets], dtype=np.intp)
+        self.table = TargetFactorTable(targetList)
+        self._paths = dict( (name, [self.table.targetPaths[t_idx] for t_idx in indices])
+                            for name, indices in self._indices.items() )
+
+        # Every modifier sets the factor of its own group to 1.0
+        self._groupFactors = dict( (m.groupName, 1.0) for m in self.modifiers )
+
+        self._factorVector = None
+        self._weights = None
+
+    def contains(self, modifier):
+        return self._targets.get(modifier.fullName, None) is modifier.targets
+
+    def getWeights(self, factors):
+        """
+        The weights of all macro targets (ordered as table.targetPaths) for
+        the factor values in factors. The weights are only evaluated again
+        if the factor values differ from those of the previous call, so they
+        are invalidated once per change of the macro variables.
+        """
+        allFactors = dict(self._groupFactors)
+        allFactors.update(factors)
+        factorVector = self.table.getFactorVector(allFactors)
+        if self._weights is None or not np.array_equal(factorVector, self._factorVector):
+            self._factorVector = factorVector
+            self._weights = self.table.getWeights(factorVector)
+        return self._weights
+
+    def getTargetWeights(self, modifier, factors, value=1.0):
+        """
+        Weights of the targets of the specified modifier, as a dict keyed by
+        canonical target path (see Modifier.getTargetWeights()).
+        """
+        weights = value * self.getWeights(factors)[self._indices[modifier.fullName]]
+        return dict(zip(self._paths[modifier.fullName], weights.tolist()))
+
 def getTargetWeights(targets, factors, value = 1.0, ignoreNotfound = False):
     result = dict()
     if ignoreNotfound:
@@ -10,6 +10,20 @@ for /r %%i in (*) do (
    )
 )
 
+:: Clean up the packed target store
+
+if exist data\targets-packed rmdir /s /q data\targets-packed
+
+:: Clean up compiled animation (.mhbanim) files
+
+set filetype=.mhbanim
+
+for /r %%i in (*) do (
+   if %%~xi==%filetype% (
+      del %%i
+   )
+)
+
 :: Clean up .bin files as well
 
 set filetype=.bin
@@ -6,10 +6,18 @@
 
 find . -type f -iname \*.npz -exec rm -rf {} \;
 
+# And the packed target store
+
+rm -rf data/targets-packed
+
 # And mhpxy files
 
 find . -type f -iname \*.mhpxy -exec rm -rf {} \;
 
+# And compiled animation (mhbanim) files
+
+find . -type f -iname \*.mhbanim -exec rm -rf {} \;
+
 
 # And .bin files
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2015
+
+**Licensing:**         AGPL3 (http://www.makehuman.org/doc/node/the_makehuman_application.html)
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+**Coding Standards:**  See http://www.makehuman.org/node/165
+
+Abstract
+--------
+
+Standalone script to compile all .bvh animations and .mhp poses into binary
+.mhbanim (npz) files for faster loading. The animations are retargeted to the
+default skeleton.
+"""
+
+import sys
+sys.path = ["./core", "./lib", "./shared", "./apps"] + sys.path
+import os
+import fnmatch
+import animation
+import bvh
+import skeleton
+from getpath import getSysDataPath
+import files3d
+from core import G
+
+class BaseMeshHuman(object):
+    """
+    Minimal stand-in for the selected human, exposing the unmodified basemesh
+    from which the skeleton joint positions are calculated.
+    """
+    def __init__(self, mesh):
+        self.meshData = mesh
+
+    def getRestposeCoordinates(self):
+        return self.meshData.coord[:,:3]
+
+
+class CompileApp(object):
+    def __init__(self, human):
+        self.selectedHuman = human
+
+
+def getAllFiles(rootPath, filterStrArr):
+    result = []
+    for root, dirnames, filenames in os.walk(rootPath):
+        for filterStr in filterStrArr:
+            for filename in fnmatch.filter(filenames, filterStr):
+                result.append(os.path.join(root, filename))
+    return result
+
+
+def compileAnimation(path, skel):
+    npzpath = animation.getCompiledAnimationPath(path)
+    try:
+        try:
+            if os.path.splitext(path)[1].lower() == '.mhp':
+                anim = animation.loadPoseFromMhpFile(path, skel)
+                metadata = {}
+                options = None
+            else:
+                options = bvh.getCompiledOptions()
+                bvh_file = bvh.load(path, **options)
+                anim = bvh_file.createAnimationTrack(skel)
+                metadata = bvh.getCompiledMetadata(bvh_file)
+        except:
+            print 'Could not load animation file %s.' % path
+            import traceback
+            traceback.print_exc(file=sys.stdout)
+            return False
+        animation.saveCompiledAnimation(anim, npzpath, path, skel, metadata, options)
+    except:
+        print 'Unable to save compiled animation for file %s' % path
+        import traceback
+        traceback.print_exc(file=sys.stdout)
+        if os.path.isfile(npzpath):
+            # Remove file again, in case an empty file is left
+            try:
+                os.remove(npzpath)
+            except:
+                pass
+        return False
+
+    return True
+
+
+if __name__ == '__main__':
+    basemesh = files3d.loadMesh(getSysDataPath("3dobjs/base.obj"))
+    # The skeleton joints are positioned on the unmodified basemesh
+    G.app = CompileApp(BaseMeshHuman(basemesh))
+    skel = skeleton.load(getSysDataPath("rigs/default.mhskel"), basemesh)
+    allAnimations = getAllFiles('data/poses', ['*.bvh', '*.mhp']) + \
+                    getAllFiles('data/animations', ['*.bvh', '*.mhp'])
+    for (i, path) in enumerate(allAnimations):
+        compileAnimation(path, skel)
+        print "[%.0f%% done] converted animation %s" % (100*(float(i)/float(len(allAnimations))), path)
+
+    print "All done."
@@ -38,9 +38,11 @@ TODO
 """
 
 import sys
-sys.path = [".", "./core", "./lib"] + sys.path
+sys.path = [".", "./core", "./lib", "./shared"] + sys.path
 import makehuman
 import algos3d
+import files3d
+from getpath import getSysDataPath
 import numpy as np
 import os
 import zipfile
@@ -65,8 +67,13 @@ def getFiles(root, filenames, filterStr):
 
 if __name__ == '__main__':
     obj = algos3d.Target(None, None)
+    # Faces affected by each target are precomputed on the basemesh
+    basemesh = files3d.loadMesh(getSysDataPath("3dobjs/base.obj"))
+    faceType = np.min_scalar_type(basemesh.getFaceCount())
     allFiles = getAllFiles('data', ['*.target', '*.png'])
     npzPath = 'data/targets.npz'
+    packedPath = 'data/targets-packed'
+    packedTargets = []
     with zipfile.ZipFile(npzPath, mode='w', compression=zipfile.ZIP_DEFLATED) as zip:
         npzdir = os.path.dirname(npzPath)
         allTargets = allFiles[0]
@@ -77,12 +84,26 @@ if __name__ == '__main__':
         zip.write(lpath, os.path.relpath(lpath, npzdir))
         os.remove(lpath)
 
+        # Basemesh for which target faces are stored
+        bpath = 'data/targets/targets.basemesh.npy'
+        np.save(bpath, np.array([basemesh.getVertexCount(), basemesh.getFaceCount()], dtype=np.int64))
+        zip.write(bpath, os.path.relpath(bpath, npzdir))
+        os.remove(bpath)
+
         for (i, path) in enumerate(allTargets):
             try:
+                if hasattr(obj, '_license'):
+                    del obj._license
                 obj._load_text(path)
-                iname, vname, lname = obj._save_binary(path)
+                index, vector = obj._pack()
+                faces = basemesh.getFacesForVertices(obj.verts).astype(faceType)
+                name = os.path.splitext(os.path.relpath(path, npzdir))[0].replace('\\', '/')
+                packedTargets.append( (name, index, vector, getattr(obj, '_license', None), faces) )
+                iname, vname, lname, fname = obj._save_binary(path, faces)
                 zip.write(iname, os.path.relpath(iname, npzdir))
                 zip.write(vname, os.path.relpath(vname, npzdir))
+                zip.write(fname, os.path.relpath(fname, npzdir))
+                os.remove(fname)
                 if lname:
                     zip.write(lname, os.path.relpath(lname, npzdir))
                     os.remove(lname)
@@ -93,6 +114,9 @@ if __name__ == '__main__':
                 raise e
                 print 'error converting target %s' % path
 
+    print "Writing packed targets"
+    algos3d.savePackedTargets(packedPath, packedTargets, makehuman.getAssetLicense(), basemesh)
+
     print "Writing images list"
     with open('data/images.list', 'w', encoding="utf-8") as f:
         allImages = allFiles[1]
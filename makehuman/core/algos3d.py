@@ -59,10 +59,158 @@ __docformat__ = 'restructuredtext'
 
 import os
 import numpy as np
+from collections import OrderedDict
 import log
 from getpath import getSysDataPath, canonicalPath
 
-_targetBuffer = {}
+
+class TargetBuffer(object):
+    """
+    Cache of loaded targets, keyed on canonical target path, with an optional
+    memory budget.
+    Targets loaded by getTarget() are added with add(), which makes them
+    evictable: when the targets in the buffer use more than maxBytes, the
+    least recently used evictable targets are dropped, to be reloaded from
+    the compiled targets (or target files) when requested again.
+    Targets stored with buffer[path] = target (such as warp targets, that
+    cannot be reloaded from a file) are never evicted.
+    A maxBytes of None means the buffer is unbounded.
+    Hits and misses are counted by lookup() only. The generation counter is
+    incremented whenever a target is replaced or explicitly removed (but
+    not when it is evicted), so that users of the buffer can detect that
+    the data of a target may have changed.
+    """
+
+    def __init__(self, maxBytes=None):
+        self.maxBytes = maxBytes
+        self._targets = OrderedDict()   # Ordered from least to most recently used
+        self._nbytes = {}
+        self._evictable = set()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+
+    def __getitem__(self, path):
+        target = self._targets.pop(path)
+        self._targets[path] = target
+        return target
+
+    def get(self, path, default=None):
+        try:
+            return self[path]
+        except KeyError:
+            return default
+
+    def lookup(self, path):
+        """
+        Retrieve the target with the specified path, marking it as most
+        recently used, and record a hit. Records a miss and returns None if
+        the target is not in the buffer.
+        """
+        target = self.get(path)
+        if target is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return target
+
+    def __setitem__(self, path, target):
+        self._insert(path, target)
+        self._evict()
+
+    def add(self, path, target):
+        """
+        Add a target that can be reloaded from path, and thus can be evicted
+        from the buffer.
+        """
+        self._insert(path, target)
+        self._evictable.add(path)
+        self._evict(keep=path)
+
+    def _insert(self, path, target):
+        if path in self._targets:
+            del self[path]
+        self._targets[path] = target
+        self._nbytes[path] = _targetBytes(target)
+        self.bytes += self._nbytes[path]
+
+    def __delitem__(self, path):
+        self._remove(path)
+        self.generation += 1
+
+    def invalidate(self, path):
+        """
+        Remove the target with specified path, if it is buffered, because its
+        data is out of date.
+        """
+        if path in self._targets:
+            self._remove(path)
+        self.generation += 1
+
+    def _remove(self, path):
+        del self._targets[path]
+        self.bytes -= self._nbytes.pop(path)
+        self._evictable.discard(path)
+
+    def _evict(self, keep=None):
+        if self.maxBytes is None or self.bytes <= self.maxBytes:
+            return
+        for path in self._targets.keys():
+            if self.bytes <= self.maxBytes:
+                break
+            if path in self._evictable and path != keep:
+                self._remove(path)
+                self.evictions += 1
+
+    def __contains__(self, path):
+        return path in self._targets
+
+    def __len__(self):
+        return len(self._targets)
+
+    def __iter__(self):
+        return iter(self._targets)
+
+    def keys(self):
+        return self._targets.keys()
+
+    def items(self):
+        return self._targets.items()
+
+    def clear(self):
+        self._targets.clear()
+        self._nbytes.clear()
+        self._evictable.clear()
+        self.bytes = 0
+        self.generation += 1
+
+    def setMaxBytes(self, maxBytes):
+        self.maxBytes = maxBytes
+        self._evict()
+
+    def stats(self):
+        return dict(hits = self.hits,
+                    misses = self.misses,
+                    evictions = self.evictions,
+                    targets = len(self._targets),
+                    bytes = self.bytes,
+                    maxBytes = self.maxBytes)
+
+def _targetBytes(target):
+    """
+    Memory held by the arrays of a target. Views on a memory-mapped file are
+    not counted, their pages are managed by the OS.
+    """
+    result = 0
+    for name in ['verts', '_data', 'vector', '_faces']:
+        data = getattr(target, name, None)
+        if isinstance(data, np.ndarray) and not isinstance(data, np.memmap):
+            result += data.nbytes
+    return result
+
+_targetBuffer = TargetBuffer()
 
 
 class Target(object):
@@ -74,6 +222,13 @@ class Target(object):
     npzfile = None
     npztime = None
     npzdir = None
+    packed = None
+    keepQuantized = True
+    _obj = None
+    _faces = None
+    _data = None
+    vector = None
+    scale = 1.0
 
     def __init__(self, obj, name):
         """
@@ -94,6 +249,7 @@ class Target(object):
         """
         self.name = name
         self.morphFactor = -1
+        self._obj = obj
 
         try:
             self._load(self.name)
@@ -102,15 +258,75 @@ class Target(object):
             log.error('Unable to open %s (%s)', name, e)
             return
 
-        self.faces = obj.getFacesForVertices(self.verts)
-
     def __repr__(self):
         return ( "<Target %s>" % (os.path.basename(self.name)) )
 
+    @property
+    def faces(self):
+        """
+        Indices of the faces affected by this target. Compiled targets are
+        loaded with precomputed faces, for targets loaded from a .target file
+        they are determined on first access.
+        """
+        if self._faces is None:
+            self._faces = self._obj.getFacesForVertices(self.verts)
+        return self._faces
+
+    @faces.setter
+    def faces(self, faces):
+        self._faces = faces
+
+    @property
+    def data(self):
+        """
+        Translation vectors of this target, as floats.
+        Compiled targets are kept quantized (see keepQuantized), for them
+        this returns a dequantized copy of the vector member, multiplied by
+        scale. Use getVectors() to avoid the copy.
+        """
+        if self.vector is not None:
+            return self.vector * self.scale
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self.vector = None
+        self.scale = 1.0
+
+    def getVectors(self):
+        """
+        Returns (vectors, scale), with vectors the translation vectors of this
+        target as they are stored (quantized for compiled targets) and scale
+        the factor with which they are to be multiplied.
+        """
+        if self.vector is not None:
+            return self.vector, self.scale
+        return self._data, 1.0
+
+    def _setQuantized(self, vector, scale):
+        if Target.keepQuantized:
+            self._data = None
+            self.vector = vector
+            self.scale = scale
+        else:
+            self.data = vector * scale
+
+    def _matchesBasemesh(self, nVerts, nFaces):
+        """
+        Whether precomputed faces, compiled for a basemesh with the specified
+        vertex and face count, can be used for the object of this target.
+        """
+        return self._obj is not None and \
+               self._obj.getVertexCount() == nVerts and \
+               self._obj.getFaceCount() == nFaces
+
     @property
     def license(self):
         if hasattr(self, '_license'):
             return self._license
+        elif Target.packed and Target.packed.hasLicense('targets/targets'):
+            return Target.packed.getLicense('targets/targets')
         elif Target.npzfile is not None and 'targets/targets.license' in Target.npzfile:
             license = defaultTargetLicense()
             return license.fromNumpyString(Target.npzfile['targets/targets.license'])
@@ -162,11 +378,35 @@ class Target(object):
             log.message('compiled file missing: %s', vname)
             raise RuntimeError('compiled file missing: %s' % vname)
         self.verts = Target.npzfile[iname]
-        self.data = Target.npzfile[vname] * 1e-3
+        self._setQuantized(Target.npzfile[vname], 1e-3)
+        fname = '%s.faces' % bname
+        if fname in Target.npzfile and 'targets/targets.basemesh' in Target.npzfile and \
+           self._matchesBasemesh(*Target.npzfile['targets/targets.basemesh']):
+            self._faces = Target.npzfile[fname]
         if lname in Target.npzfile:
             import makehuman
             self._license = defaultTargetLicense().fromNumpyString(Target.npzfile[lname])
 
+    def _load_binary_packed(self, name):
+        """
+        Load target from the memory-mapped packed target store. The index and
+        vector arrays are views on the store, they are not copied.
+        """
+        if os.path.isfile(name) and Target.packed.mtime < os.path.getmtime(name):
+            log.message('compiled file newer than packed store: %s', name)
+            raise RuntimeError('compiled file newer than packed store: %s' % name)
+        name = os.path.relpath(name, Target.packed.datadir).replace('\\', '/')
+        bname = os.path.splitext(name)[0]
+        if bname not in Target.packed:
+            log.message('target missing from packed store: %s', name)
+            raise RuntimeError('target missing from packed store: %s' % name)
+        self.verts, vector = Target.packed.getTarget(bname)
+        self._setQuantized(vector, 1e-3)
+        if Target.packed.basemesh is not None and self._matchesBasemesh(*Target.packed.basemesh):
+            self._faces = Target.packed.getFaces(bname)
+        if Target.packed.hasLicense(bname):
+            self._license = Target.packed.getLicense(bname)
+
     def _load_binary_files(self, name):
         """
         Load target from individual .bin file
@@ -191,6 +431,11 @@ class Target(object):
         self.data = np.load(vname) * 1e-3
 
     def _load_binary(self, name):
+        if getPackedTargets():
+            # Load target from uncompressed memory-mapped store
+            self._load_binary_packed(name)
+            return
+
         if Target.npzfile is None:
             try:
                 npzname = getSysDataPath('targets.npz')     # TODO duplicate path literal
@@ -208,25 +453,41 @@ class Target(object):
             name = os.path.relpath(name, Target.npzdir)
             self._load_binary_archive(name)
 
-    def _save_binary(self, name):
+    def _save_binary(self, name, faces=None):
+        """
+        Save the compiled target next to the file at name. Returns the paths
+        of the index, vector, license and faces files (the latter two are
+        None if there is no custom license or no faces were specified).
+        """
         log.message('compiling %s', name)
         try:
             bname, ext = os.path.splitext(name)
             iname = '%s.index.npy' % bname
             vname = '%s.vector.npy' % bname
-            index = np.ascontiguousarray(self.verts, dtype=np.uint16)
-            vector = np.ascontiguousarray(np.round(self.data * 1e3), dtype=np.int16)
+            index, vector = self._pack()
             np.save(iname, index)
             np.save(vname, vector)
+            lname = fname = None
+            if faces is not None:
+                fname = '%s.faces.npy' % bname
+                np.save(fname, faces)
             if hasattr(self, '_license'):
                 lname = '%s.license.npy' % bname
                 license = np.ascontiguousarray(self._license.toNumpyString())
                 np.save(lname, license)
-                return iname, vname, lname
-            return iname, vname, None
+            return iname, vname, lname, fname
         except StandardError, _:
             log.error('error saving %s', name)
 
+    def _pack(self):
+        """
+        Compiled representation of this target: vertex indices and the
+        translation vectors quantized to int16 (in units of 1e-3).
+        """
+        index = np.ascontiguousarray(self.verts, dtype=np.uint16)
+        vector = np.ascontiguousarray(np.round(self.data * 1e3), dtype=np.int16)
+        return index, vector
+
     def _load(self, name):
         logger = log.getLogger('mh.load')
         logger.debug('loading target %s', name)
@@ -262,7 +523,9 @@ class Target(object):
             if morphFactor:
                 # Adding the translation vector
 
-                scale = np.array(scale) * morphFactor
+                # The scale of quantized vectors is folded into the morph factor
+                vectors, vscale = self.getVectors()
+                scale = np.array(scale) * (morphFactor * vscale)
                 if animatedMesh is not None:
                     # Pose the direction in which the target is applied, for fast
                     # approximate modeling of a posed model
@@ -274,11 +537,12 @@ class Target(object):
                     if not animationTrack.isBaked():
                         animationTrack.bake(animatedMesh.getBaseSkeleton())
                     poseData = animatedMesh.getPoseState()
+                    b_idxs, wghts = vertBoneMapping.compiled(4)
                     obj.coord[dstVerts] += animation.skinMesh( \
-                                  self.data[srcVerts] * scale[None,:], 
-                                  vertBoneMapping.compiled(4)[dstVerts], poseData )
+                                  vectors[srcVerts] * scale[None,:], 
+                                  (b_idxs[dstVerts], wghts[dstVerts]), poseData )
                 else:
-                    obj.coord[dstVerts] += self.data[srcVerts] * scale[None,:]
+                    obj.coord[dstVerts] += vectors[srcVerts] * scale[None,:]
                 obj.markCoords(dstVerts, coor=True)
 
             if calcNormals:
@@ -290,6 +554,287 @@ class Target(object):
 
         return False
 
+class PackedTargets(object):
+    """
+    Uncompressed store of all compiled targets, written by compile_targets.py.
+    The arrays in the store are memory-mapped, so that targets are loaded
+    without inflating or copying anything, and so that processes using the
+    same store share its pages through the OS page cache.
+
+    The store is a folder containing:
+      - names.npy     target paths relative to the data folder, without extension
+      - offsets.npy   offset table with len(names)+1 entries
+      - index.npy     flat array with the vertex indices of all targets
+      - vector.npy    flat (n,3) int16 array with the quantized offsets (1e-3 units)
+      - faces.npy, faceoffsets.npy, basemesh.npy (optional)
+                      flat array with the faces affected by each target, its
+                      offset table, and the vertex and face count of the
+                      basemesh for which the faces were determined
+      - licenses.npz  (optional) default license (as targets/targets) and
+                      custom target licenses
+
+    The data of target i is found at index[offsets[i]:offsets[i+1]] and
+    vector[offsets[i]:offsets[i+1]].
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.datadir = os.path.dirname(path)
+        self.index = np.load(os.path.join(path, 'index.npy'), mmap_mode='r')
+        self.vector = np.load(os.path.join(path, 'vector.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        names = np.load(os.path.join(path, 'names.npy'))
+        self._lookup = dict( (str(n), i) for i, n in enumerate(names) )
+        lpath = os.path.join(path, 'licenses.npz')
+        if os.path.isfile(lpath):
+            self.licenses = np.load(lpath)
+        else:
+            self.licenses = {}
+        self.mtime = min([os.path.getmtime(os.path.join(path, f)) for f in
+                          ['names.npy', 'offsets.npy', 'index.npy', 'vector.npy']])
+        if os.path.isfile(os.path.join(path, 'basemesh.npy')):
+            self.basemesh = tuple(np.load(os.path.join(path, 'basemesh.npy')))
+            self.faces = np.load(os.path.join(path, 'faces.npy'), mmap_mode='r')
+            self.faceoffsets = np.load(os.path.join(path, 'faceoffsets.npy'))
+        else:
+            self.basemesh = None
+
+    def __contains__(self, name):
+        return name in self._lookup
+
+    def __len__(self):
+        return len(self._lookup)
+
+    def getTarget(self, name):
+        """
+        Returns (index, vector) views on the store for the target with
+        specified name.
+        """
+        i = self._lookup[name]
+        start, end = self.offsets[i], self.offsets[i+1]
+        return self.index[start:end], self.vector[start:end]
+
+    def getFaces(self, name):
+        """
+        Returns a view on the store with the precomputed faces of the target
+        with specified name.
+        """
+        i = self._lookup[name]
+        return self.faces[self.faceoffsets[i]:self.faceoffsets[i+1]]
+
+    def hasLicense(self, name):
+        return '%s.lic_str' % name in self.licenses
+
+    def getLicense(self, name):
+        return defaultTargetLicense().fromNumpyString(self.licenses['%s.lic_str' % name],
+                                                      self.licenses['%s.lic_idx' % name])
+
+def getPackedTargets():
+    """
+    The packed target store of the system data folder, or False if there is
+    no such store.
+    """
+    if Target.packed is None:
+        path = getSysDataPath('targets-packed')
+        if not os.path.isdir(path):
+            log.message('no packed targets found')
+            Target.packed = False
+        else:
+            try:
+                Target.packed = PackedTargets(path)
+            except (IOError, OSError, ValueError) as e:
+                log.warning('Unable to open packed targets %s, falling back to compiled targets (%s)', path, e)
+                Target.packed = False
+    return Target.packed
+
+def savePackedTargets(path, targets, license=None, basemesh=None):
+    """
+    Write a packed target store (see PackedTargets) to the folder at path.
+    targets is a list of (name, index, vector, license, faces) tuples, with
+    index and vector as returned by Target._pack(), license a custom license
+    or None and faces the affected faces of the target on basemesh.
+    If basemesh is None, no faces are stored.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    offsets = np.zeros(len(targets)+1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(t[1]) for t in targets])
+    np.save(os.path.join(path, 'names.npy'), np.array([t[0] for t in targets]))
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+    np.save(os.path.join(path, 'index.npy'), np.concatenate([t[1] for t in targets]))
+    np.save(os.path.join(path, 'vector.npy'), np.concatenate([t[2] for t in targets]))
+
+    if basemesh is not None:
+        faceoffsets = np.zeros(len(targets)+1, dtype=np.int64)
+        faceoffsets[1:] = np.cumsum([len(t[4]) for t in targets])
+        np.save(os.path.join(path, 'faceoffsets.npy'), faceoffsets)
+        np.save(os.path.join(path, 'faces.npy'), np.concatenate([t[4] for t in targets]))
+        np.save(os.path.join(path, 'basemesh.npy'),
+                np.array([basemesh.getVertexCount(), basemesh.getFaceCount()], dtype=np.int64))
+    elif os.path.isfile(os.path.join(path, 'basemesh.npy')):
+        os.remove(os.path.join(path, 'basemesh.npy'))
+
+    licenses = {}
+    if license:
+        targets = targets + [('targets/targets', None, None, license, None)]
+    for name, _, _, lic, _ in targets:
+        if lic:
+            licenses['%s.lic_str' % name], licenses['%s.lic_idx' % name] = lic.toNumpyString()
+    np.savez(os.path.join(path, 'licenses.npz'), **licenses)
+
+class MorphBasis(object):
+    """
+    Compiled representation of a set of targets as one sparse morph basis
+    matrix B of shape (nTargets, 3*nVerts). The coordinates of a mesh with
+    the targets applied with weight vector w are then orig_coord + w.B,
+    which is evaluated without accessing individual Target objects. A batch
+    of bodies with weights W (nBodies, nTargets) is evaluated as W.B.
+
+    B is stored in compressed sparse row format with 1x3 blocks, so that
+    row t contains the translation vectors of all vertices moved by target t
+    (the same layout as the packed target store):
+      - indptr    (nTargets+1,) row offsets
+      - indices   (nnz,) vertex (column) index of every entry
+      - data      (nnz,3) translation vectors, in units of scale
+
+    Only NumPy is required for building and evaluating the basis.
+    """
+
+    def __init__(self, targetPaths, nVerts, indptr, indices, data, scale=1.0):
+        """
+        Build a basis from the concatenated index and vector arrays of all
+        targets, with indptr the offset of the data of every target in them.
+        The arrays are used as they are, so they can be memory-mapped.
+        """
+        self.targetPaths = list(targetPaths)
+        self._columns = dict( (path, i) for i, path in enumerate(self.targetPaths) )
+        self.nVerts = nVerts
+        self.scale = scale
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        # Plain array views, memmap slicing is slow
+        self.indices = np.asarray(indices)
+        self.data = np.asarray(data)
+
+    @staticmethod
+    def fromPackedTargets(packed, nVerts):
+        """
+        Build a basis containing all targets in a PackedTargets store that
+        are up to date with their source file. If all targets are up to date
+        the basis uses the memory-mapped arrays of the store.
+        """
+        paths = []
+        keep = []
+        for name, i in sorted(packed._lookup.items(), key=lambda item: item[1]):
+            path = canonicalPath(os.path.join(packed.datadir, name + '.target'))
+            if os.path.isfile(path) and packed.mtime < os.path.getmtime(path):
+                continue
+            paths.append(path)
+            keep.append(i)
+        if len(keep) == len(packed):
+            return MorphBasis(paths, nVerts, packed.offsets, packed.index, packed.vector, 1e-3)
+        keep = np.asarray(keep, dtype=np.int64)
+        counts = packed.offsets[keep+1] - packed.offsets[keep]
+        indptr = np.zeros(len(keep)+1, dtype=np.int64)
+        indptr[1:] = np.cumsum(counts)
+        sel = np.repeat(packed.offsets[keep] - indptr[:-1], counts) + np.arange(indptr[-1])
+        return MorphBasis(paths, nVerts, indptr, packed.index[sel], packed.vector[sel], 1e-3)
+
+    def __contains__(self, targetPath):
+        return targetPath in self._columns
+
+    def __len__(self):
+        return len(self.targetPaths)
+
+    def getWeights(self, targetWeights):
+        """
+        Convert a dict of target path to morph factor (such as a detail
+        stack) to a weight vector for this basis.
+        Returns (weights, others) with others a dict with the targets that
+        are not part of this basis.
+        """
+        weights = np.zeros(len(self.targetPaths), dtype=np.float32)
+        others = {}
+        for targetPath, morphFactor in targetWeights.items():
+            try:
+                weights[self._columns[targetPath]] = morphFactor
+            except KeyError:
+                others[targetPath] = morphFactor
+        return weights, others
+
+    def dot(self, weights, chunkSize=1000000):
+        """
+        Evaluate w.B, the per-vertex translation resulting from applying all
+        targets in this basis with the specified weights. weights is a
+        (nTargets,) array, or a (n, nTargets) array to evaluate n bodies at
+        once, in which case a (n, nVerts, 3) array is returned.
+        Only the targets with a non-zero weight for any of the bodies are
+        accessed, in chunks of about chunkSize elements. For a single body
+        the weighted translations of a chunk of targets are summed per
+        vertex. For multiple bodies each chunk of targets is expanded to
+        dense rows, which are multiplied with the weights of all bodies in
+        one matrix product. This pays off when the bodies share most of
+        their targets, otherwise evaluating the bodies one by one is faster.
+        """
+        weights = np.asarray(weights, dtype=np.float32)
+        if len(weights.shape) == 1:
+            return self._dotSingle(weights, chunkSize)
+
+        result = np.zeros((len(weights), 3*self.nVerts), dtype=np.float32)
+        active = np.flatnonzero(np.any(weights != 0, axis=0))
+        step = max(1, chunkSize // (3*self.nVerts))
+        dense = np.zeros((min(step, len(active)), self.nVerts, 3), dtype=np.float32)
+        for first in xrange(0, len(active), step):
+            rows = active[first:first+step]
+            starts = self.indptr[rows]
+            counts = self.indptr[rows+1] - starts
+            entries = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+            block = dense[:len(rows)]
+            block[:] = 0
+            block[np.repeat(np.arange(len(rows)), counts), self.indices[entries]] = self.data[entries]
+            result += np.dot(weights[:,rows] * self.scale, block.reshape(len(rows), -1))
+        return result.reshape((len(weights), self.nVerts, 3))
+
+    def _dotSingle(self, weights, chunkSize):
+        """
+        dot() for a single body, in chunks of targets with about chunkSize
+        translation vectors.
+        """
+        result = np.zeros((self.nVerts, 3), dtype=np.float32)
+        active = np.flatnonzero(weights)
+        counts = self.indptr[active+1] - self.indptr[active]
+        bounds = np.searchsorted(np.cumsum(counts), np.arange(chunkSize, counts.sum(), chunkSize))
+        for rows in np.split(active, bounds):
+            if not len(rows):
+                continue
+            verts = np.concatenate([self.indices[self.indptr[t]:self.indptr[t+1]] for t in rows])
+            vectors = np.concatenate([self.data[self.indptr[t]:self.indptr[t+1]] * np.float32(weights[t] * self.scale) for t in rows])
+            for c in xrange(3):
+                result[:,c] += np.bincount(verts, vectors[:,c], minlength=self.nVerts)
+        return result
+
+_morphBasis = None
+
+def getMorphBasis(obj):
+    """
+    Retrieve the morph basis (see MorphBasis) containing all system targets,
+    for evaluating target combinations on the specified object in one sparse
+    matrix-vector product. The basis is built once from the memory-mapped
+    packed target store, so that the targets are not loaded in memory.
+    Returns None if there is no packed target store.
+    Reapplying all targets of a body with the basis is faster than applying
+    its changed targets when most targets changed (eg. when randomizing), and
+    it avoids loading targets that are not buffered yet.
+    """
+    global _morphBasis
+    if _morphBasis is None or _morphBasis.nVerts != obj.getVertexCount():
+        packed = getPackedTargets()
+        if not packed:
+            return None
+        _morphBasis = MorphBasis.fromPackedTargets(packed, obj.getVertexCount())
+        log.debug('Built morph basis with %s targets', len(_morphBasis))
+    return _morphBasis
+
 def getTarget(obj, targetPath):
     """
     This function retrieves a set of translation vectors from a morphing
@@ -321,16 +866,39 @@ def getTarget(obj, targetPath):
         *string*. The file system path to the file containing the morphing targets.
         The precise format of this string will be operating system dependant.
     """
-    targetPath = canonicalPath(targetPath)
+    # Only canonical paths are stored in the buffer
+    if targetPath not in _targetBuffer:
+        targetPath = canonicalPath(targetPath)
+
+    target = _targetBuffer.lookup(targetPath)
+    if target is None:
+        target = Target(obj, targetPath)
+        _targetBuffer.add(targetPath, target)
+    return target
 
-    try:
-        return _targetBuffer[targetPath]
-    except KeyError:
-        pass
+def setTargetBufferSize(maxBytes):
+    """
+    Set the memory budget (in bytes) of the target buffer. Least recently
+    used targets are evicted from the buffer when it exceeds this size.
+    Specify None for an unbounded buffer.
+    """
+    _targetBuffer.setMaxBytes(maxBytes)
 
-    target = Target(obj, targetPath)
-    _targetBuffer[targetPath] = target
-    return target
+def getTargetBufferStats():
+    """
+    Statistics of the target buffer: a dict with the number of hits, misses
+    and evictions of getTarget(), the number of targets and bytes resident,
+    and the budget.
+    """
+    return _targetBuffer.stats()
+
+def getTargetBufferGeneration():
+    """
+    Counter that is incremented whenever a buffered target is replaced or
+    invalidated, after which previously loaded target data may be out of
+    date. Evicting targets from the buffer does not change it.
+    """
+    return _targetBuffer.generation
 
 def refreshCachedTarget(targetPath):
     """
@@ -339,9 +907,11 @@ def refreshCachedTarget(targetPath):
     Generally this only has effect if the target was loaded from an ascii file,
     not from npz archive.
     """
+    global _morphBasis
     targetPath = canonicalPath(targetPath)
-    if targetPath in _targetBuffer:
-        del _targetBuffer[targetPath]
+    _targetBuffer.invalidate(targetPath)
+    if _morphBasis is not None and targetPath in _morphBasis:
+        _morphBasis = None
 
 def loadTranslationTarget(obj, targetPath, morphFactor, faceGroupToUpdateName=None, update=1, calcNorm=1, scale=[1.0,1.0,1.0], animatedMesh=None):
     """
@@ -406,6 +976,83 @@ def loadTranslationTarget(obj, targetPath, morphFactor, faceGroupToUpdateName=No
 
     target.apply(obj, morphFactor, update, calcNorm, faceGroupToUpdateName, scale, animatedMesh)
 
+def loadTranslationTargets(obj, targetWeights, update=1, calcNorm=1):
+    """
+    This function applies a whole set of targets, each with its own morph
+    factor, to the specified mesh object in a single vectorized pass. The
+    weighted translation vectors of all targets are accumulated per vertex,
+    after which the coordinates of the object are updated at once.
+    This is equivalent to calling loadTranslationTarget for each of the
+    targets, but avoids the per-target overhead of indexing and updating
+    the mesh.
+
+    Parameters
+    ----------
+
+    obj:
+        *3d object*. The target object to which the translations are to be applied.
+        This object is read and updated by this function.
+
+    targetWeights:
+        *dict* or *list of (string, float) tuples*. The file system paths
+        of the targets to apply, with the morph factor to apply them with.
+
+    update:
+        *int flag*. A flag to indicate whether the update method on the object should be called.
+
+    calcNorm:
+        *int flag*. A flag to indicate whether the normals are to be recalculated (1/true)
+        or not (0/false).
+    """
+    if isinstance(targetWeights, dict):
+        targetWeights = targetWeights.items()
+
+    targets = []
+    for targetPath, morphFactor in targetWeights:
+        if not morphFactor:
+            continue
+        target = getTarget(obj, targetPath)
+        target.morphFactor = morphFactor
+        targets.append( (target, morphFactor) )
+
+    applyTargets(obj, targets, update, calcNorm)
+
+def applyTargets(obj, targets, update=1, calcNorm=1):
+    """
+    Apply a list of (target, morphFactor) tuples, with target a Target
+    instance, to the specified mesh object in one vectorized pass.
+    See loadTranslationTargets.
+    Unlike Target.apply, this does not change the morphFactor attribute of
+    the targets, so it can also be used for applying the difference between
+    two sets of target weights.
+    """
+    targets = [(t, f) for (t, f) in targets if f and len(t.verts)]
+
+    if targets:
+        nVerts = obj.getVertexCount()
+        verts = np.concatenate([t.verts for t, _ in targets])
+        data = []
+        for t, f in targets:
+            # Quantized vectors are scaled along with the morph factor
+            vectors, scale = t.getVectors()
+            data.append(vectors.T * (f * scale))
+        data = np.concatenate(data, axis=1)
+
+        # Sum the weighted translations of all targets per vertex
+        offsets = np.empty((nVerts, 3), dtype=obj.coord.dtype)
+        for c in xrange(3):
+            offsets[:,c] = np.bincount(verts, data[c], minlength=nVerts)
+        obj.coord += offsets
+
+        touched = np.zeros(nVerts, dtype=bool)
+        touched[verts] = True
+        obj.markCoords(np.flatnonzero(touched), coor=True)
+
+    if calcNorm:
+        obj.calcNormals()
+    if update:
+        obj.update()
+
 def saveTranslationTarget(obj, targetPath, groupToSave=None, epsilon=0.001):
     """
     This function analyses an object to determine the differences between the current
@@ -101,8 +101,8 @@ def saveBinaryMesh(obj, path):
 
     vars_ = dict(
         coord = obj.coord,
-        vface = obj.vface,
-        nfaces = obj.nfaces,
+        vface_offsets = obj.vface_offsets,
+        vface_indices = obj.vface_indices,
         texco = obj.texco,
         fvert = obj.fvert,
         group = obj.group,
@@ -133,8 +133,11 @@ def loadBinaryMesh(obj, path):
     group = npzfile['group']
     obj.setFaces(fvert, fuvs, group, skipUpdate=True)
 
-    obj.vface[:,:] = npzfile['vface'][:,:obj.MAX_FACES]
-    obj.nfaces = npzfile['nfaces']
+    if 'vface_offsets' in npzfile.files:
+        obj.setVertexFaces(npzfile['vface_offsets'], npzfile['vface_indices'])
+    else:
+        # Compiled with padded vface table, rebuild adjacency
+        obj._update_faces()
 
     #log.debug('loadBinaryMesh: loaded arrays')
 
@@ -222,6 +222,7 @@ class MHApplication(gui3d.Application, mh.Application):
                 'invertMouseWheel': False,
                 'lowspeed': 1,
                 'preloadTargets': True,
+                'targetBufferSize': 0,
                 'cameraAutoZoom': False,
                 'language': 'english',
                 'highspeed': 5,
@@ -247,6 +248,7 @@ class MHApplication(gui3d.Application, mh.Application):
                 'sliderImages': True,
                 'guiTheme': 'makehuman',
                 'preloadTargets': False,
+                'targetBufferSize': 0,
                 'restoreWindowSize': True,
                 'windowGeometry': ''
             }
@@ -941,6 +943,10 @@ class MHApplication(gui3d.Application, mh.Application):
 
         gui.Slider.showImages(self.settings['sliderImages'])
 
+        # Memory budget (in MB) for loaded targets, 0 is unbounded
+        if self.settings['targetBufferSize']:
+            algos3d.setTargetBufferSize(self.settings['targetBufferSize'] * 1024 * 1024)
+
         with inFile("shortcuts.ini") as f:
             shortcuts = {}
             for line in f:
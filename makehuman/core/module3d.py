@@ -309,7 +309,7 @@ class Object3D(object):
         fuvs = self.fuvs[self.face_mask]
         uv_idx = np.unique(fuvs.reshape(-1))
         inverse_uv_idx = - np.ones(self.texco.shape[0], dtype=np.int32)
-        inverse_uv_idx[uv_idx] = np.arange(self.texco.shape[0], dtype=np.int32)
+        inverse_uv_idx[uv_idx] = np.arange(len(uv_idx), dtype=np.int32)
         for i in xrange(self.vertsPerPrimitive):
             fuvs[:,i] = inverse_uv_idx[fuvs[:,i]]
 
@@ -361,10 +361,8 @@ class Object3D(object):
         if ix is None:
             ix = np.s_[:]
 
-        vface = self.vface[ix]
-        norms = self.fnorm[vface]
-        norms *= np.arange(self.MAX_FACES)[None,:,None] < self.nfaces[ix][:,None,None]
-        norms = np.sum(norms, axis=1)
+        faces, counts = self.getVertexFaces(ix)
+        norms = sum_rows(self.fnorm[faces], counts)
         norms /= np.sqrt(np.sum(norms ** 2, axis=-1))[:,None]
         self.vnorm[ix] = norms
 
@@ -379,9 +377,11 @@ class Object3D(object):
             ix = np.s_[:]
             xLen = self.getVertexCount()
             f_ix = np.s_[:]
+            faces, counts = self.getVertexFaces()
         else:
             xLen = len(ix)
-            f_ix = np.unique(self.vface[ix])
+            faces, counts = self.getVertexFaces(ix)
+            f_ix = np.unique(faces)
 
         # This implementation is based on
         # http://www.terathon.com/code/tangent.html
@@ -408,7 +408,7 @@ class Object3D(object):
         s1 = w2[:,0] - w1[:,0]
         s2 = w3[:,0] - w1[:,0]
         t1 = w2[:,1] - w1[:,1]
-        t2 = w3[:,1] = w1[:,1]
+        t2 = w3[:,1] - w1[:,1]
 
         # Prevent NANs because of borked up UV coordinates  # TODO perhaps remove this
         s1[np.argwhere(np.equal(s1, 0.0))] = 0.0000001
@@ -422,12 +422,12 @@ class Object3D(object):
         sdir[f_ix] = np.column_stack( [ ( (t2 * x1) - (t1 * x2) ) * r,
                                         ( (t2 * y1) - (t1 * y2) ) * r,
                                         ( (t2 * z1) - (t1 * z2) ) * r  ] )
-        tdir[f_ix] = np.column_stack( [ ( (s1 * x2) - (s1 * x2) ) * r,
+        tdir[f_ix] = np.column_stack( [ ( (s1 * x2) - (s2 * x1) ) * r,
                                         ( (s1 * y2) - (s2 * y1) ) * r,
                                         ( (s1 * z2) - (s2 * z1) ) * r  ] )
 
-        tan[:,0] = np.sum(sdir[self.vface[ix]])
-        tan[:,1] = np.sum(tdir[self.vface[ix]])
+        tan[:,0] = sum_rows(sdir[faces], counts)
+        tan[:,1] = sum_rows(tdir[faces], counts)
 
         # Gramm-Schmidt orthogonalize
         dotP = dot_v3(self.vnorm[ix], tan[:,0] )
@@ -439,14 +439,13 @@ class Object3D(object):
         self.vtang[ix,:3] /= np.sqrt(np.sum(self.vtang[ix,:3] ** 2, axis=-1))[:,None]
 
         # Determine Handedness as w parameter
-        self.vtang[ix, 3] = 1.0
-        indx = np.argwhere(np.less(dot_v3( \
-                                     np.cross( \
-                                           self.vnorm[ix], \
-                                           tan[:,0]), \
-                                     tan[:,1]), \
-                                   0.0))
-        self.vtang[ix,3][indx] = -1.0
+        # (assigned in one go, as self.vtang[ix,3] is a copy if ix is an array)
+        self.vtang[ix, 3] = np.where(np.less(dot_v3( \
+                                               np.cross( \
+                                                     self.vnorm[ix], \
+                                                     tan[:,0]), \
+                                               tan[:,1]), \
+                                             0.0), -1.0, 1.0)
 
     def getObject(self):
         if self.__object:
@@ -493,8 +492,9 @@ class Object3D(object):
         self.vnorm = []         # Vertex normals (idx = vertex idx)
         self.vtang = []         # Vertex tangents (idx = vertex idx)
         self.color = []         # Vertex colors (idx = vertex idx)
-        self.vface = []         # References the faces that a vertex belongs to (limited to MAX_FACES) (idx = vertex idx)
-        self.nfaces = 0         # Polycount
+        self.vface_offsets = np.zeros(1, dtype=np.int64)    # Vertex to face adjacency in CSR format: the faces of vertex i are
+        self.vface_indices = np.zeros(0, dtype=np.uint32)   # vface_indices[vface_offsets[i]:vface_offsets[i+1]] (see getVertexFaces)
+        self._vface = None
 
         self.ucoor = False      # Update flags for updating to OpenGL renderbuffers
         self.unorm = False
@@ -502,6 +502,8 @@ class Object3D(object):
         self.ucolr = False
         self.utexc = False
 
+        self.dcoor = True       # Coordinates changed since normals were last calculated (see calcDirtyNormals)
+
         self.has_uv = False
 
         if hasattr(self, 'index'): del self.index
@@ -526,8 +528,9 @@ class Object3D(object):
         self.vnorm = np.zeros((nverts, 3), dtype=np.float32)
         self.vtang = np.zeros((nverts, 4), dtype=np.float32)
         self.color = np.zeros((nverts, 4), dtype=np.uint8) + 255
-        self.vface = np.zeros((nverts, self.MAX_FACES), dtype=np.uint32)
-        self.nfaces = np.zeros(nverts, dtype=np.uint8)
+        self.vface_offsets = np.zeros(nverts+1, dtype=np.int64)
+        self.vface_indices = np.zeros(0, dtype=np.uint32)
+        self._vface = None
 
         self.orig_coord = self.coord.copy() # Keep a copy of the original coordinates
 
@@ -563,11 +566,16 @@ class Object3D(object):
         if coor:
             if indices is None:
                 self.ucoor = True
+                self.dcoor = True
             else:
                 if self.ucoor is False:
                     self.ucoor = np.zeros(nverts, dtype=bool)
                 if self.ucoor is not True:
                     self.ucoor[indices] = True
+                if self.dcoor is False:
+                    self.dcoor = np.zeros(nverts, dtype=bool)
+                if self.dcoor is not True:
+                    self.dcoor[indices] = True
 
         if norm:
             if indices is None:
@@ -595,6 +603,19 @@ class Object3D(object):
             indices = np.s_[...]
         self.coord[indices] = coords
 
+    def changeNormals(self, normals, indices = None):
+        """
+        Set vertex normals directly (eg. skinned normals of a posed mesh)
+        instead of calculating them from the faces. Coordinates that are marked
+        as changed remain marked, so a later calcDirtyNormals() still
+        recalculates the normals from the faces.
+        """
+        self.markCoords(indices, norm=True)
+
+        if indices is None:
+            indices = np.s_[...]
+        self.vnorm[indices] = normals
+
     def setUVs(self, uvs):
         self.texco = np.asarray(uvs, dtype=np.float32)
         self.utexc = True
@@ -688,29 +709,63 @@ class Object3D(object):
         return self._inverse_vmap
 
     def _update_faces(self):
-        # Construct vface: arrange face indices for same v_idx in different columns
-        # Every row in the vface matrix contains a variable number of valid columns
-        # (the number of valid columns for each row is stored in the nfaces array)
-        map_ = np.argsort(self.fvert.flat)
-        vi = self.fvert.flat[map_]
+        # Construct the vertex to face adjacency in CSR format: for every
+        # vertex, the faces it is part of are stored consecutively in
+        # vface_indices, starting at vface_offsets[v_idx]
+        nverts = len(self.coord)
+        map_ = np.argsort(self.fvert.flat, kind='mergesort')
         # Map v_idx entries to row numbers of fvert (face_idx)
-        fi = np.mgrid[:self.fvert.shape[0],:self.fvert.shape[1]][0].flat[map_].astype(np.uint32)
+        self.vface_indices = (map_ // self.fvert.shape[1]).astype(np.uint32)
         del map_
-        ix, first = np.unique(vi, return_index=True)
-        n = first[1:] - first[:-1]    # entry-skip count, or the number of occurences of every idx
-        n_last = len(vi) - first[-1]  # Number of occurences of last idx
-        n = np.hstack((n, np.array([n_last])))  # Append last to complete n
-
-        # Store number of valid columns per line in vface
-        self.nfaces[ix] = n.astype(np.uint8)
-        try:
-            for i in xrange(len(ix)):
-                # Unfortunately these type of slices require a python loop
-                self.vface[ix[i],:n[i]] = fi[first[i]:][:n[i]]
-        except Exception as e:
-            import log
-            log.error("Failed to index faces of mesh %s, you are probably loading a mesh with mixed nb of verts per face (do not mix tris and quads). Or your mesh has too many faces attached to one vertex (the maximum is %s-poles). In the second case, either increase MAX_FACES for this mesh, or improve the mesh topology. Original error message: (%s) %s", self.name, self.MAX_FACES, type(e), format(str(e)))
-            raise RuntimeError('Incompatible mesh topology.')
+        self.vface_offsets = np.zeros(nverts+1, dtype=np.int64)
+        self.vface_offsets[1:] = np.cumsum(np.bincount(self.fvert.flat, minlength=nverts))
+        self._vface = None
+
+    def setVertexFaces(self, offsets, indices):
+        """
+        Set the vertex to face adjacency (as stored by _update_faces).
+        """
+        self.vface_offsets = np.asarray(offsets, dtype=np.int64)
+        self.vface_indices = np.asarray(indices, dtype=np.uint32)
+        self._vface = None
+
+    def getVertexFaces(self, indices = None):
+        """
+        Faces connected to the specified vertices (all vertices if indices is
+        None). Returns (faces, counts): the faces of all vertices concatenated,
+        and the number of faces of each vertex.
+        """
+        if indices is None:
+            return self.vface_indices, np.diff(self.vface_offsets)
+        entries, counts = csr_rows(self.vface_offsets, indices)
+        return self.vface_indices[entries], counts
+
+    @property
+    def nfaces(self):
+        """
+        Number of faces connected to each vertex. This is not limited to
+        MAX_FACES.
+        """
+        return np.diff(self.vface_offsets)
+
+    @property
+    def vface(self):
+        """
+        Compatibility accessor for the vertex to face adjacency as a padded
+        (nverts, MAX_FACES) array, of which only the first nfaces columns of
+        every row are valid. If a vertex has more than MAX_FACES faces, the
+        array is widened to fit.
+        Prefer getVertexFaces(), this array is built (and cached) on first
+        access.
+        """
+        if self._vface is None:
+            counts = np.diff(self.vface_offsets)
+            width = max(self.MAX_FACES, counts.max() if len(counts) else 0)
+            self._vface = np.zeros((len(counts), width), dtype=np.uint32)
+            rows = np.repeat(np.arange(len(counts)), counts)
+            cols = np.arange(len(self.vface_indices)) - self.vface_offsets[rows]
+            self._vface[rows, cols] = self.vface_indices
+        return self._vface
 
     def getVertexWeights(self, parentWeights):
         """
@@ -727,27 +782,27 @@ class Object3D(object):
         if not hasattr(self, 'parent') or not self.parent:
             return parentWeights
 
+        if not parentWeights.data:
+            return parentWeights.create({}, self.getVertexCount())
+
         vmap = self.inverse_parent_map
         vwmap = self.parent_map_weights
+        vmap = vmap.reshape(len(vmap), -1)
 
-        from collections import OrderedDict
-        weights = OrderedDict()
-        for bname, (verts,wghts) in parentWeights.data.items():
-            vgroup = []
-            empty = True
-            for (v,wt) in zip(verts,wghts):
-                mvs = vmap[v]
-                if isinstance(mvs, (int, np.int32)):
-                    mvs = [mvs]
-                for mv in mvs:
-                    w = vwmap[mv]
-                    if mv > -1:
-                        vgroup.append((mv, w * wt))
-                        empty = False
-            if not empty:
-                weights[bname] = vgroup
-
-        return parentWeights.create(weights, self.getVertexCount())
+        # Every parent vertex weight is copied to all child vertices the
+        # parent vertex maps to, scaled with the weight of the child vertex
+        # mapping. The inverse parent map is treated as a sparse
+        # (parent x child) matrix, with its -1 entries being empty.
+        boneNames = parentWeights.data.keys()
+        pverts = np.concatenate([verts for verts, _ in parentWeights.data.values()])
+        pwghts = np.concatenate([wghts for _, wghts in parentWeights.data.values()])
+        pbones = np.repeat(np.arange(len(boneNames)), [len(verts) for verts, _ in parentWeights.data.values()])
+
+        mvs = vmap[pverts]
+        rows, cols = np.nonzero(mvs > -1)
+        mvs = mvs[rows, cols]
+        return parentWeights.createFromArrays(mvs, pbones[rows], vwmap[mvs] * pwghts[rows],
+                                              boneNames, self.getVertexCount())
 
 
     def updateIndexBuffer(self):
@@ -1094,9 +1149,7 @@ class Object3D(object):
         vertices.
         """
         mask = np.zeros(len(self.fvert), dtype = bool)
-        valid = np.arange(self.MAX_FACES)[None,:] < self.nfaces[verts][:,None]  # Mask that filters out unused slots for faces connected to a vert
-        vface = self.vface[verts]
-        faces = vface[valid]
+        faces, _ = self.getVertexFaces(verts)
         mask[faces] = True
         return mask
 
@@ -1153,6 +1206,36 @@ class Object3D(object):
 
         if recalcFaceNormals or recalcVertexNormals and self.calculateTangents:
             self.calcVertexTangents(verticesToUpdate)
+
+        if recalcFaceNormals and recalcVertexNormals and \
+           verticesToUpdate is None and facesToUpdate is None:
+            self.dcoor = False
+
+    def calcDirtyNormals(self, maxFraction=0.5):
+        """
+        Updates the face and vertex normals (and tangents) affected by the
+        coordinates that changed since normals were last calculated for the
+        whole mesh, as recorded by markCoords().
+        Face normals are recalculated for the faces touching a changed vertex,
+        vertex normals for the vertices of those faces (the changed vertices
+        and their one-ring neighbours).
+        If more than maxFraction of the faces is affected, all normals are
+        recalculated.
+        """
+        if self.dcoor is False:
+            return
+        if self.dcoor is True:
+            self.calcNormals()
+            return
+
+        faces = self.getFacesForVertices(np.flatnonzero(self.dcoor))
+        if len(faces) > maxFraction * self.getFaceCount():
+            self.calcNormals()
+            return
+
+        verts = np.unique(self.fvert[faces])
+        self.calcNormals(1, 1, verts, faces)
+        self.dcoor = False
                 
     def calcBBox(self, ix=None, onlyVisible = True, fixedFaceMask = None):
         """
@@ -1178,6 +1261,56 @@ class Object3D(object):
     def __str__(self):
         return 'object3D Mesh named: %s, nverts: %s, nfaces: %s' % (self.name, self.getVertexCount(), self.getFaceCount())
 
+def csr_rows(offsets, rows):
+    """
+    Select rows of an array in CSR format (with the specified row offsets).
+    Returns the indices of the entries of the selected rows, concatenated,
+    and the number of entries of each row.
+    """
+    rows = np.arange(len(offsets)-1)[rows]
+    counts = offsets[rows+1] - offsets[rows]
+    firsts = np.cumsum(counts) - counts
+    entries = np.arange(firsts[-1] + counts[-1] if len(counts) else 0) + \
+              np.repeat(offsets[rows] - firsts, counts)
+    return entries, counts
+
+def sum_rows(values, counts):
+    """
+    Sum consecutive rows of values, in segments of the specified lengths.
+    Segments of length 0 result in 0.
+    """
+    result = np.zeros((len(counts),) + values.shape[1:], dtype=values.dtype)
+    nonempty = counts > 0
+    if np.any(nonempty):
+        firsts = np.cumsum(counts) - counts
+        result[nonempty] = np.add.reduceat(values, firsts[nonempty], axis=0)
+    return result
+
+def group_rows(keys, values, out):
+    """
+    Group values by key into the rows of the padded 2D array out: row k
+    receives all values with key k in its first columns, in their original
+    order. Negative keys are ignored. Each value is ranked within its group
+    using the (stable) sorted order of the keys, so that all values are
+    stored with one assignment.
+    Raises a ValueError if a row of out is too narrow for its values.
+    Returns the number of values stored in each row.
+    """
+    keys = np.asarray(keys).reshape(-1)
+    values = np.asarray(values).reshape(-1)
+    valid = keys >= 0
+    if not np.all(valid):
+        keys = keys[valid]
+        values = values[valid]
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    counts = np.bincount(keys, minlength=len(out))
+    if len(counts) and counts.max() > out.shape[1]:
+        raise ValueError('cannot group %s values in a row of width %s' % (counts.max(), out.shape[1]))
+    firsts = np.cumsum(counts) - counts
+    out[keys, np.arange(len(keys)) - firsts[keys]] = values[order]
+    return counts
+
 def dot_v3(v3_arr1, v3_arr2):
     """
     Numpy Ufunc'ed implementation of a series of dot products of two vector3 
@@ -65,7 +65,8 @@ class RandomizeAction(gui3d.Action):
                 self.human.getModifier(mName).setValue(val)
             except:
                 pass
-        self.human.applyAllTargets()
+        # Most targets change, reapply them all with the morph basis
+        self.human.applyAllTargets(useMorphBasis=True)
         self.human.symmetryModeEnabled = _tmp
 
 class RandomTaskView(gui3d.TaskView):
@@ -71,11 +71,13 @@ class AnimationLibrary(gui3d.TaskView):
 
         @self.playbackSlider.mhEvent
         def onChanging(value):
-            self.updateFrame(int(value))
+            # Skin normals for fast scrubbing, normals are recalculated when released
+            self.updateFrame(int(value), fast=True)
 
-    def updateFrame(self, frame):
+    def updateFrame(self, frame, fast=False):
+        self.human.skinNormals = fast
         self.human.setToFrame(frame)
-        self.human.refreshPose()
+        self.human.skinNormals = False
         self.frameLbl.setTextFormat(["Frame",": %s"], frame)
 
     def onShow(self, event):
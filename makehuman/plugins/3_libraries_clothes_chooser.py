@@ -118,6 +118,7 @@ class ClothesTaskView(proxychooser.ProxyChooserTaskView):
             for pxy in proxies:
                 obj = pxy.object
                 obj.changeVertexMask(None)
+            human.refreshFaceMasks()
             return
 
 
@@ -142,6 +143,8 @@ class ClothesTaskView(proxychooser.ProxyChooserTaskView):
                 vertsMask[verts] = False
 
         human.changeVertexMask(vertsMask)
+        # Pose the vertices that are no longer hidden
+        human.refreshFaceMasks()
 
     def onShow(self, event):
         super(ClothesTaskView, self).onShow(event)
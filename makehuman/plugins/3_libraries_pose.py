@@ -155,33 +155,33 @@ class PoseLibraryTaskView(gui3d.TaskView, filecache.MetadataCacher):
             self.human.setPosed(True)
 
     def loadMhp(self, filepath):
-        return animation.loadPoseFromMhpFile(filepath, self.human.getBaseSkeleton())
+        skel = self.human.getBaseSkeleton()
+        def _load():
+            return animation.loadPoseFromMhpFile(filepath, skel), {}
+        anim, _ = animation.loadAnimation(filepath, skel, _load)
+        return anim
 
     def loadBvh(self, filepath, convertFromZUp="auto"):
-        bvh_file = bvh.load(filepath, convertFromZUp)
-        self.autoScaleBVH(bvh_file)  # TODO scaling once is probably not enough, every time the height of the human changes significantly the animation needs to be rescaled
-        anim = bvh_file.createAnimationTrack(self.human.getBaseSkeleton())
+        anim, joint_lengths = bvh.loadAnimationTrack(filepath, self.human.getBaseSkeleton(), convertFromZUp)
+        self.autoScaleBVH(anim, joint_lengths)  # TODO scaling once is probably not enough, every time the height of the human changes significantly the animation needs to be rescaled
         _, _, _, license = self.getMetadata(filepath)
         anim.license = license
         return anim
 
-    def autoScaleBVH(self, bvh_file):
+    def autoScaleBVH(self, anim, joint_lengths):
         """
         Auto scale BVH translations by comparing upper leg length
         """
-        import numpy.linalg as la
         COMPARE_BONE = "upperleg02.L"
-        if COMPARE_BONE not in bvh_file.joints:
-            raise RuntimeError('Failed to auto scale BVH file %s, it does not contain a joint for "%s"' % (bvh_file.name, COMPARE_BONE))
-        bvh_joint = bvh_file.joints[COMPARE_BONE]
+        if COMPARE_BONE not in joint_lengths:
+            raise RuntimeError('Failed to auto scale BVH file %s, it does not contain a joint for "%s"' % (anim.name, COMPARE_BONE))
         bone = self.human.getBaseSkeleton().getBoneByReference(COMPARE_BONE)
         if bone is not None:
-            joint_length = la.norm(bvh_joint.children[0].position - bvh_joint.position)
-            scale_factor = bone.length / joint_length
-            log.message("Scaling BVH file %s with factor %s" % (bvh_file.name, scale_factor))
-            bvh_file.scale(scale_factor)
+            scale_factor = bone.length / joint_lengths[COMPARE_BONE]
+            log.message("Scaling BVH file %s with factor %s" % (anim.name, scale_factor))
+            anim.scaleTranslations(scale_factor)
         else:
-            log.warning("Could not find bone or bone reference with name %s in skeleton %s, cannot auto resize BVH file %s", COMPARE_BONE, self.human.getBaseSkeleton().name, bvh_file.name)
+            log.warning("Could not find bone or bone reference with name %s in skeleton %s, cannot auto resize BVH file %s", COMPARE_BONE, self.human.getBaseSkeleton().name, anim.name)
 
     def onShow(self, event):
         self.filechooser.refresh()
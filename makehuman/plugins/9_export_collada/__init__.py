@@ -38,6 +38,7 @@ TODO
 """
 
 from export import Exporter, ExportConfig
+import animation
 
 
 class DaeConfig(ExportConfig):
@@ -59,6 +60,10 @@ class DaeConfig(ExportConfig):
         self.facePoseUnits = False
         self.hiddenGeom = False
 
+        # Remove animation frames that can be linearly interpolated
+        self.reduceKeyframes = False
+        self.keyframeTolerance = animation.KEYFRAME_TOLERANCE
+
     # TODO preferably these are used (perhaps as enum) instead of the bools above
     # TODO move these to export Config super class
     @property
@@ -112,6 +117,7 @@ class ExporterCollada(Exporter):
 
         self.hiddenGeom = options.addWidget(gui.CheckBox("Helper geometry", False))
         self.facePoseUnits = options.addWidget(gui.CheckBox("Facial pose-units", False))
+        self.reduceKeyframes = options.addWidget(gui.CheckBox("Reduce keyframes", False))
 
         orients = []
         box = options.addWidget(gui.GroupBox("Orientation"))
@@ -148,6 +154,7 @@ class ExporterCollada(Exporter):
 
         cfg.facePoseUnits = self.facePoseUnits.selected
         cfg.hiddenGeom        = self.hiddenGeom.selected
+        cfg.reduceKeyframes   = self.reduceKeyframes.selected
 
         return cfg
 
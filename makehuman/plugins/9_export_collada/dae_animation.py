@@ -61,6 +61,8 @@ def writeLibraryAnimations(fp, human, skel, animations, config):
     for anim in animations[1:]:
         print 'join anims'
         joined_anim = animation.joinAnimations(joined_anim, anim)
+    if config.reduceKeyframes:
+        joined_anim = joined_anim.getReduced(config.keyframeTolerance)
 
     fp.write('\n  <library_animations>\n')
     writeAnimation(fp, skel, joined_anim, config)
@@ -95,7 +97,7 @@ def writeAnimationBone(fp, bone, anim, config):
         '        <float_array id="%s_pose_matrix-input-array" count="%d">' % (aname, anim.nFrames))
 
     # TIME POINTS
-    timepoints = np.asarray(range(anim.nFrames), dtype=np.float32) * (1.0/anim.frameRate)
+    timepoints = anim.getKeyTimes()
     fp.write(' '.join(["%g" % t for t in timepoints]))
 
     fp.write(
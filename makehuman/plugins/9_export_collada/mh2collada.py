@@ -75,6 +75,9 @@ def exportCollada(filepath, config):
 
     progress(0, 0.5, "Preparing")
 
+    if config.hiddenGeom and human.isPosed():
+        # Masked vertices are not skinned when posing
+        human.refreshPose(skinMasked=True)
     objects = human.getObjects(excludeZeroFaceObjs=not config.hiddenGeom)
     # Clone meshes with desired scale and hidden faces/vertices filtered out
     meshes = [obj.mesh.clone(config.scale, filterMaskedVerts=not config.hiddenGeom) for obj in objects]
@@ -63,6 +63,9 @@ def exportFbx(filepath, config):
     filename = os.path.basename(filepath)
     name = config.goodName(os.path.splitext(filename)[0])
 
+    if config.hiddenGeom and human.isPosed():
+        # Masked vertices are not skinned when posing
+        human.refreshPose(skinMasked=True)
     # Collect objects, scale meshes and filter out hidden faces/verts, scale rig
     objects = human.getObjects(excludeZeroFaceObjs=not config.hiddenGeom)
     meshes = [obj.mesh.clone(config.scale, filterMaskedVerts=not config.hiddenGeom) for obj in objects]
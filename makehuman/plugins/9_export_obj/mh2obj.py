@@ -54,6 +54,9 @@ def exportObj(filepath, config=None):
     name = config.goodName(os.path.splitext(filename)[0])
 
     progress(0, 0.3, "Collecting Objects")
+    if config.hiddenGeom and human.isPosed():
+        # Masked vertices are not skinned when posing
+        human.refreshPose(skinMasked=True)
     objects = human.getObjects(excludeZeroFaceObjs=not config.hiddenGeom)
     meshes = [o.mesh for o in objects]
 
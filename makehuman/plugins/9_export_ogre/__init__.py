@@ -39,6 +39,7 @@ Exporter plugin for the Ogre3d mesh format.
 
 import mh2ogre
 from export import Exporter, ExportConfig
+import animation
 
 class OgreConfig(ExportConfig):
 
@@ -47,6 +48,10 @@ class OgreConfig(ExportConfig):
         self.useRelPaths = True
         self.exportShaders = False  # TODO add support for this
 
+        # Remove animation frames that can be linearly interpolated
+        self.reduceKeyframes = False
+        self.keyframeTolerance = animation.KEYFRAME_TOLERANCE
+
     @property
     def subdivide(self):
         return self.human.isSubdivided()
@@ -69,11 +74,13 @@ class ExporterOgre(Exporter):
         import gui
         self.taskview     = taskview
         self.feetOnGround = options.addWidget(gui.CheckBox("Feet on ground", True))
+        self.reduceKeyframes = options.addWidget(gui.CheckBox("Reduce keyframes", False))
 
     def getConfig(self):
         cfg = OgreConfig()
         cfg.feetOnGround      = self.feetOnGround.selected
         cfg.scale,cfg.unit    = self.taskview.getScale()
+        cfg.reduceKeyframes   = self.reduceKeyframes.selected
 
         return cfg
 
@@ -268,6 +268,8 @@ def writeSkeletonFile(human, filepath, config):
         for anim in animations:
             # Use pose matrices, not skinning matrices
             anim.resetBaked()
+            if config.reduceKeyframes:
+                anim = anim.getReduced(config.keyframeTolerance)
             #anim = bvhanim.getAnimationTrack()
             writeAnimation(human, lines, anim, config)
         lines.append('    </animations>')
@@ -347,7 +349,6 @@ def writeAnimation(human, linebuffer, animTrack, config):
         # Note: OgreXMLConverter will optimize out unused (not moving) animation tracks
         linebuffer.append('                <track bone="%s">' % bone.name)
         linebuffer.append('                    <keyframes>')
-        frameTime = 1.0/float(animTrack.frameRate)
         for frameIdx in xrange(animTrack.nFrames):
             poseMat = animTrack.getAtFramePos(frameIdx)[bIdx]
             I[:3,:4] = poseMat[:3,:4]
@@ -356,7 +357,7 @@ def writeAnimation(human, linebuffer, animTrack, config):
             angle, axis, _ = transformations.rotation_from_matrix(poseMat)
             axis_[:3] = axis[:3]
             axis = np.asarray(axis_ * np.matrix(bone.getRestMatrix(offsetVect=config.offset)))[0]
-            linebuffer.append('                        <keyframe time="%s">' % (float(frameIdx) * frameTime))
+            linebuffer.append('                        <keyframe time="%s">' % animTrack.getFrameTime(frameIdx))
             linebuffer.append('                            <translate x="%s" y="%s" z="%s" />' % (translation[0], translation[1], translation[2]))
             # TODO account for scale
             linebuffer.append('                            <rotate angle="%s">' % angle)
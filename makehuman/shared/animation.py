@@ -40,6 +40,7 @@ Data handlers for skeletal animation.
 # TODO perhaps do not adapt camera to posed position, always use rest coordinates
 
 import math
+import os
 import numpy as np
 import log
 import makehuman
@@ -51,6 +52,15 @@ INTERPOLATION = {
     'LOG':    2
 }
 
+SKINNING = {
+    'LINEAR':          0,   # Linear blend skinning with 3x4 matrices
+    'DUAL_QUATERNION': 1    # Dual quaternion skinning
+}
+
+# Default maximum deviation of the pose matrix elements allowed when reducing
+# keyframes, used by the exporters
+KEYFRAME_TOLERANCE = 1e-3
+
 # TODO allow saving AnimationTrack to binary file
 # TODO allow saving VertexBoneWeights to binary file
 
@@ -88,6 +98,12 @@ class AnimationTrack(object):
         self.loop = True
 
         self._data_baked = None
+        self._dq_baked = None   # Baked skinning transforms as unit dual quaternions, calculated on first use
+
+        # Time (in seconds) of each stored frame after keyframe reduction,
+        # None if frames are evenly spaced at frameRate
+        self._keyTimes = None
+        self._playtime = None
         
         # Type of interpolation between animation frames
         #   0  no interpolation
@@ -111,6 +127,7 @@ class AnimationTrack(object):
 
     def resetBaked(self):
         self._data_baked = None
+        self._dq_baked = None
 
     def bake(self, skel):
         """
@@ -122,27 +139,27 @@ class AnimationTrack(object):
         if self.disableBaking:
             return
 
-        from progress import Progress
-
         log.debug('Updating baked animation %s (%s frames)', self.name, self.nFrames)
-        progress = Progress(self.nFrames)
 
-        bones = skel.getBones()
-        if len(bones) != self.nBones:
+        if skel.getBoneCount() != self.nBones:
             raise RuntimeError("Error baking animation %s: number of bones in animation data differs from bone count of skeleton %s" % (self.name, skel.name))
 
-        old_pose = skel.getPose()
-        self._data_baked = np.zeros((self.dataLen, 3, 4))
-
-        for f_idx in xrange(self.nFrames):
-            i = f_idx * self.nBones
-            skel.setPose(self._data[i:i+self.nBones])
-            for b_idx in xrange(self.nBones):
-                idx = i + b_idx
-                self._data_baked[idx,:,:] = bones[b_idx].matPoseVerts[:3,:4]
-            progress.step("Baking animation frame %s", f_idx+1)
+        # Forward kinematics for all frames at once, leaves the skeleton pose untouched
+        self._data_baked = skel.getSkinningMatrices(self._data)
+        self._dq_baked = None
 
-        skel.setPose(old_pose)
+    def _getBakedDualQuaternions(self):
+        """
+        The baked skinning matrices as dual quaternions, for dual quaternion
+        skinning. They are only calculated when first needed, and stored in
+        single precision, as most animations are skinned with linear blending.
+        Returns None if the animation is not baked.
+        """
+        if not self.isBaked():
+            return None
+        if self._dq_baked is None:
+            self._dq_baked = dualQuaternionsFromMatrices(self._data_baked).astype(np.float32)
+        return self._dq_baked
 
     def getAtTime(self, time, noBake=False):
         """
@@ -174,6 +191,29 @@ class AnimationTrack(object):
             # Logarithmic interpolation
             pass # TODO
 
+    def getDualQuaternionsAtTime(self, time):
+        """
+        Returns the baked skinning transforms at the specified time as an
+        (nBones, 2, 4) array of unit dual quaternions (real and dual part, in
+        w, x, y, z order). Returns None if the animation is not baked.
+        When time is between two stored frames the dual quaternions are
+        linearly blended (and normalized by the skinning kernel).
+        """
+        data = self._getBakedDualQuaternions()
+        if data is None:
+            return None
+
+        frameIdx, fraction = self.getFrameIndexAtTime(time)
+        idx1 = frameIdx*self.nBones
+        if fraction == 0 or self.interpolationType != 1:
+            return data[idx1:idx1+self.nBones]
+        idx2 = ((frameIdx+1) % self.nFrames) * self.nBones
+        dq1 = data[idx1:idx1+self.nBones]
+        dq2 = data[idx2:idx2+self.nBones]
+        # Take the shortest path: q and -q represent the same rotation
+        sign = np.where(np.sum(dq1[:,0] * dq2[:,0], axis=-1) < 0, np.float32(-1), np.float32(1))
+        return dq1 * (1-fraction) + dq2 * (sign * fraction)[:,None,None]
+
     def getAtFramePos(self, frame, noBake=False):
         """
         If noBake is True will always return the original non-baked data.
@@ -185,6 +225,17 @@ class AnimationTrack(object):
             return self._data[frame*self.nBones:(frame+1)*self.nBones]
         return self.data[frame*self.nBones:(frame+1)*self.nBones]
 
+    def getDualQuaternionsAtFramePos(self, frame):
+        """
+        Returns the baked skinning transforms of the specified frame as unit
+        dual quaternions, or None if the animation is not baked.
+        """
+        data = self._getBakedDualQuaternions()
+        if data is None:
+            return None
+        frame = int(frame)
+        return data[frame*self.nBones:(frame+1)*self.nBones]
+
     def getFrameIndexAtTime(self, time):
         """
         Time should be in seconds (float).
@@ -193,7 +244,13 @@ class AnimationTrack(object):
         fraction of progression towards the next frame. A fraction of 0 means
         position at an exact frame.
         """
+        if self._keyTimes is not None:
+            return self._getKeyIndexAtTime(time)
+
         frameIdx = float(self.frameRate) * time
+        if abs(frameIdx - round(frameIdx)) < 1e-6:
+            # Snap to exact frame, to avoid rounding errors (eg. in setToFrame)
+            frameIdx = round(frameIdx)
         fraction, frameIdx = math.modf(frameIdx)
 
         if self.loop:
@@ -204,8 +261,57 @@ class AnimationTrack(object):
             frameIdx = self.nFrames-1
             fraction = 0
 
+        return int(frameIdx), fraction
+
+    def _getKeyIndexAtTime(self, time):
+        """
+        getFrameIndexAtTime() for tracks with non-uniform key times.
+        """
+        playtime = self.getPlaytime()
+        if self.loop:
+            time = time % playtime
+        elif time >= self._keyTimes[-1]:
+            # Stop at last frame
+            return self.nFrames-1, 0
+
+        frameIdx = max(int(np.searchsorted(self._keyTimes, time, side='right')) - 1, 0)
+        startTime = self._keyTimes[frameIdx]
+        if frameIdx+1 < self.nFrames:
+            endTime = self._keyTimes[frameIdx+1]
+        else:
+            # Interpolate towards the first frame when looping
+            endTime = playtime
+        fraction = (time - startTime) / (endTime - startTime)
+        if fraction < 1e-6:
+            fraction = 0
+        elif fraction > 1 - 1e-6:
+            fraction = 0
+            frameIdx = (frameIdx + 1) % self.nFrames
         return frameIdx, fraction
 
+    def hasKeyTimes(self):
+        """
+        Whether the frames of this track are stored at non-uniform key times,
+        as a result of reduceKeyframes().
+        """
+        return self._keyTimes is not None
+
+    def getKeyTimes(self):
+        """
+        The time (in seconds) of each stored frame.
+        """
+        if self._keyTimes is not None:
+            return self._keyTimes
+        return np.arange(self.nFrames, dtype=np.float64) / self.frameRate
+
+    def getFrameTime(self, frame):
+        """
+        The time (in seconds) of the stored frame with specified index.
+        """
+        if self._keyTimes is not None:
+            return float(self._keyTimes[int(frame)])
+        return float(frame) / self.frameRate
+
     def isLooping(self):
         return self.loop
 
@@ -216,27 +322,148 @@ class AnimationTrack(object):
         """
         Playtime (duration) of animation in seconds.
         """
+        if self._playtime is not None:
+            return self._playtime
         return float(self.nFrames)/self.frameRate
 
+    def scaleTranslations(self, scale):
+        """
+        Scale the translation component of the (non-baked) pose data, eg. to
+        adapt the root motion of an animation to the size of the human.
+        """
+        self._data = self._data.copy()
+        self._data[:,:3,3] *= scale
+        self.resetBaked()
+
     def sparsify(self, newFrameRate):
         if newFrameRate > self.frameRate:
             raise RuntimeError("Cannot sparsify animation: new framerate %s is higher than old framerate %s." % (newFrameRate, self.frameRate))
+        if self.hasKeyTimes():
+            raise RuntimeError("Cannot sparsify animation %s: its keyframes are already reduced." % self.name)
 
         # Number of frames to drop
         dropFrames = int(float(self.frameRate)/float(newFrameRate))
         if dropFrames <= 0:
             return
-        indxs = []
-        count = 0
-        for frameI in range(0,self.dataLen,self.nBones):
-            if count == 0:
-                indxs.extend(range(frameI,frameI+self.nBones))
-            count = (count + 1) % dropFrames
-        data = self.data[indxs]
-        self.data = data
-        self.frameRate = newFrameRate
-        self.dataLen = len(self.data)
+        frames = self._data.reshape(self.nFrames, self.nBones, 3, 4)
+        self._data = frames[::dropFrames].reshape(-1, 3, 4).copy()
+        self.frameRate = float(newFrameRate)
+        self.dataLen = len(self._data)
         self.nFrames = self.dataLen/self.nBones
+        self.resetBaked()
+
+    def reduceKeyframes(self, tolerance=KEYFRAME_TOLERANCE, chunkSize=256):
+        """
+        Remove all frames that can be reconstructed, within the specified
+        tolerance, by linear interpolation between the remaining keyframes.
+        The remaining frames are stored at non-uniform key times, and the
+        track switches to linear interpolation.
+
+        tolerance   maximum allowed deviation of any element of the 3x4 pose
+                    matrices, either a single value or an array with a
+                    tolerance per bone
+        chunkSize   number of frames for which the interpolation error is
+                    evaluated at once, limits memory use for long tracks
+
+        Frames are selected by recursively splitting the longest segment at
+        the worst fitting frame (Douglas-Peucker), evaluated for all bones at
+        once. The first and last frame are always kept.
+        """
+        if self.nFrames < 3:
+            return
+
+        tolerance = np.asarray(tolerance, dtype=np.float32)
+        if tolerance.ndim == 0:
+            tolerance = np.repeat(tolerance, self.nBones)
+        elif tolerance.shape != (self.nBones,):
+            raise RuntimeError("Cannot reduce keyframes of animation %s: expected %s bone tolerances, got %s" % (self.name, self.nBones, len(tolerance)))
+
+        frames = self._data.reshape(self.nFrames, self.nBones, 12)
+        times = self.getKeyTimes()
+        keep = np.zeros(self.nFrames, dtype=bool)
+        keep[[0,-1]] = True
+
+        segments = [(0, self.nFrames-1)]
+        while segments:
+            start, end = segments.pop()
+            if end - start < 2:
+                continue
+            startFrame = frames[start]
+            delta = frames[end] - startFrame
+            duration = times[end] - times[start]
+            worst = -1
+            worstError = 0
+            for cStart in xrange(start+1, end, chunkSize):
+                cEnd = min(cStart + chunkSize, end)
+                fraction = ((times[cStart:cEnd] - times[start]) / duration).astype(np.float32)
+                interpolated = startFrame + fraction[:,None,None] * delta
+                # Deviation beyond the tolerance of the worst bone of each frame
+                error = (np.abs(frames[cStart:cEnd] - interpolated).max(axis=2) - tolerance).max(axis=1)
+                idx = int(np.argmax(error))
+                if error[idx] > worstError:
+                    worst = cStart + idx
+                    worstError = error[idx]
+            if worst >= 0:
+                keep[worst] = True
+                segments.append((start, worst))
+                segments.append((worst, end))
+
+        log.debug('Reduced animation %s from %s to %s frames', self.name, self.nFrames, np.count_nonzero(keep))
+        self._playtime = self.getPlaytime()
+        self._keyTimes = times[keep]
+        self._data = frames[keep].reshape(-1, 3, 4)
+        self.dataLen = len(self._data)
+        self.nFrames = len(self._keyTimes)
+        self.interpolationType = 1
+        self.resetBaked()
+
+    def getReduced(self, tolerance=KEYFRAME_TOLERANCE):
+        """
+        Return a copy of this track (non-baked) with its keyframes reduced
+        within the specified tolerance, see reduceKeyframes(). This track is
+        left unchanged.
+        """
+        result = AnimationTrack(self.name, self._data.copy(), self.nFrames, self.frameRate)
+        result.description = self.description
+        result.license = self.license
+        result.loop = self.loop
+        result.interpolationType = self.interpolationType
+        result.disableBaking = self.disableBaking
+        result._keyTimes = self._keyTimes
+        result._playtime = self._playtime
+        result.reduceKeyframes(tolerance)
+        return result
+
+    def getResampled(self, frameRate=None):
+        """
+        Return a copy of this track (non-baked) with frames evenly spaced at
+        the specified frame rate (the frame rate of this track by default),
+        linearly interpolated between the stored frames. Useful for exporting
+        a track with reduced keyframes to formats that require a fixed frame
+        rate.
+        """
+        if frameRate is None:
+            frameRate = self.frameRate
+        frameRate = float(frameRate)
+        nFrames = max(int(round(self.getPlaytime() * frameRate)), 1)
+        frames = self._data.reshape(self.nFrames, self.nBones, 3, 4)
+        keyTimes = self.getKeyTimes()
+        times = np.arange(nFrames, dtype=np.float64) / frameRate
+
+        idx = np.clip(np.searchsorted(keyTimes, times, side='right') - 1, 0, self.nFrames-1)
+        nextIdx = np.minimum(idx + 1, self.nFrames-1)
+        span = keyTimes[nextIdx] - keyTimes[idx]
+        fraction = np.where(span > 0, (times - keyTimes[idx]) / np.where(span > 0, span, 1), 0)
+        fraction = fraction.astype(np.float32)[:,None,None,None]
+        data = frames[idx] * (1 - fraction) + frames[nextIdx] * fraction
+
+        result = AnimationTrack(self.name, data.reshape(-1, 3, 4), nFrames, frameRate)
+        result.description = self.description
+        result.license = self.license
+        result.loop = self.loop
+        result.interpolationType = self.interpolationType
+        result.disableBaking = self.disableBaking
+        return result
 
 class Pose(AnimationTrack):
     """
@@ -255,6 +482,12 @@ class Pose(AnimationTrack):
     def sparsify(self, newFrameRate):
         raise NotImplementedError("sparsify() does not exist for poses")
 
+    def reduceKeyframes(self, tolerance=KEYFRAME_TOLERANCE, chunkSize=256):
+        raise NotImplementedError("reduceKeyframes() does not exist for poses")
+
+    def getReduced(self, tolerance=KEYFRAME_TOLERANCE):
+        return self
+
     def getData(self):
         """
         Structured pose data
@@ -284,6 +517,12 @@ class PoseUnit(AnimationTrack):
     def sparsify(self, newFrameRate):
         raise NotImplementedError("sparsify() does not exist for poseunits")
 
+    def reduceKeyframes(self, tolerance=KEYFRAME_TOLERANCE, chunkSize=256):
+        raise NotImplementedError("reduceKeyframes() does not exist for poseunits")
+
+    def getReduced(self, tolerance=KEYFRAME_TOLERANCE):
+        return self
+
     def getPoseNames(self):
         return self._poseNames
 
@@ -397,6 +636,10 @@ def joinAnimations(anim1, anim2):
     Data such as framerate is taken from the first animation, the framerate of
     both animations is expected to be identical.
     """
+    if anim1.hasKeyTimes():
+        anim1 = anim1.getResampled()
+    if anim2.hasKeyTimes():
+        anim2 = anim2.getResampled(anim1.frameRate)
     if anim1.nBones != anim2.nBones:
         raise RuntimeError("Cannot join animations %s and %s, they don't have the same bone count." % (anim1.nBones, anim2.nBones))
     if anim1.data.shape[1] != anim2.data.shape[1] or anim1.data.shape[2] != anim2.data.shape[2]:
@@ -415,6 +658,46 @@ def joinAnimations(anim1, anim2):
 
     return AnimationTrack(name, poseData, nFrames, framerate)
 
+class VertexMapping(object):
+    """
+    Sparse mapping from the vertices of a mesh to the vertices of a mesh of
+    which each vertex is a weighted combination of vertices of the first,
+    such as a proxy.
+    refVerts and refWeights are (n, k) arrays with, for each of the n
+    vertices of the target mesh, the indices and weights of the k vertices
+    it references (eg. proxy.ref_vIdxs and proxy.weights).
+    The references are stored as flat entries sorted by referenced vertex,
+    references with a weight of zero or less are left out.
+    """
+
+    def __init__(self, refVerts, refWeights):
+        refVerts = np.asarray(refVerts)
+        refWeights = np.asarray(refWeights, dtype=np.float32)
+        self.vertexCount = len(refVerts)
+
+        sourceVerts = refVerts.ravel()
+        targetVerts = np.repeat(np.arange(self.vertexCount, dtype=np.uint32), refVerts.shape[1])
+        weights = refWeights.ravel()
+        keep = np.flatnonzero(weights > 0)
+        order = keep[np.argsort(sourceVerts[keep], kind='mergesort')]
+
+        self.sourceVerts = sourceVerts[order]
+        self.targetVerts = targetVerts[order]
+        self.weights = weights[order]
+
+    def lookup(self, verts):
+        """
+        The indices of the entries referencing the specified source vertices,
+        grouped per vertex in the order of verts, and the number of entries
+        for each vertex.
+        """
+        start = np.searchsorted(self.sourceVerts, verts, 'left')
+        counts = np.searchsorted(self.sourceVerts, verts, 'right') - start
+        ends = np.cumsum(counts)
+        entries = np.arange(ends[-1] if len(ends) else 0) + np.repeat(start - (ends - counts), counts)
+        return entries, counts
+
+
 class VertexBoneWeights(object):
     """
     Weighted vertex to bone assignments.
@@ -499,6 +782,96 @@ class VertexBoneWeights(object):
             rootBone = self.rootBone
         return type(self)(data, vertexCount, rootBone)
 
+    def createFromArrays(self, verts, bones, values, boneNames, vertexCount, rootBone=None):
+        """
+        Create new VertexBoneWeights object from a list of (unnormalized)
+        weights, given as three arrays with for each weight the vertex index,
+        the index of the bone in boneNames and the weight value. Multiple
+        weights for the same vertex and bone are summed.
+        The weights are normalized and unweighted vertices are assigned to the
+        root bone, the same as when building weights from a dict of (vertex,
+        weight) lists, without looping over the individual weights.
+        """
+        WEIGHT_THRESHOLD = 1e-4  # Threshold for including bone weight
+        if rootBone is None:
+            rootBone = self.rootBone
+
+        boneNames = list(boneNames)
+        verts = np.asarray(verts, dtype=np.int64)
+        bones = np.asarray(bones, dtype=np.int64)
+
+        # Merge doubles
+        keys, inverse = np.unique(bones * vertexCount + verts, return_inverse=True)
+        values = np.bincount(inverse, weights=values)
+        verts = keys % vertexCount
+        bones = keys // vertexCount
+
+        # Normalize weights, and filter out weights under the threshold
+        wtot = np.bincount(verts, weights=values, minlength=vertexCount)
+        values = values / wtot[verts]
+        keep = values > WEIGHT_THRESHOLD
+        verts = verts[keep]
+        bones = bones[keep]
+        values = values[keep]
+
+        # Assign unweighted vertices to root bone with weight 1
+        unweighted = np.flatnonzero(wtot == 0)
+        if len(unweighted) > 0:
+            if rootBone not in boneNames:
+                boneNames.append(rootBone)
+            rootIdx = boneNames.index(rootBone)
+            verts = np.concatenate([verts, unweighted])
+            bones = np.concatenate([bones, np.repeat(rootIdx, len(unweighted))])
+            values = np.concatenate([values, np.ones(len(unweighted))])
+
+        # Group by bone, sorted by vertex index
+        order = np.lexsort((verts, bones))
+        verts = verts[order].astype(np.uint32)
+        bones = bones[order]
+        values = values[order].astype(np.float32)
+        bounds = np.searchsorted(bones, np.arange(len(boneNames)+1))
+
+        from collections import OrderedDict
+        result = OrderedDict()
+        for bIdx, bname in enumerate(boneNames):
+            start, end = bounds[bIdx], bounds[bIdx+1]
+            if end > start:
+                result[bname] = (verts[start:end], values[start:end])
+        return self.create(result, vertexCount, rootBone)
+
+    def transfer(self, mapping, vertexCount=None, threshold=1e-4):
+        """
+        Map these weights to a mesh of which each vertex is a weighted
+        combination of vertices of the mesh these weights belong to, such as
+        a proxy.
+        mapping is a VertexMapping from the vertices of this mesh to those
+        of the target mesh. The weighted vertices of each bone are looked up
+        in it, so only the entries referencing them are visited.
+        Contributions of a single referenced vertex that do not exceed
+        threshold are ignored.
+        Returns a new VertexBoneWeights object with vertexCount vertices
+        (the vertex count of the target mesh by default), see
+        createFromArrays().
+        """
+        if vertexCount is None:
+            vertexCount = mapping.vertexCount
+
+        boneNames = self._data.keys()
+        verts = [np.zeros(0, dtype=np.uint32)]
+        bones = [np.zeros(0, dtype=np.int64)]
+        values = [np.zeros(0, dtype=np.float32)]
+        for bIdx, bname in enumerate(boneNames):
+            bVerts, bWghts = self._data[bname]
+            entries, counts = mapping.lookup(bVerts)
+            contrib = mapping.weights[entries] * np.repeat(bWghts, counts)
+            keep = contrib > threshold
+            verts.append(mapping.targetVerts[entries[keep]])
+            bones.append(np.repeat(bIdx, np.count_nonzero(keep)))
+            values.append(contrib[keep])
+
+        return self.createFromArrays(np.concatenate(verts), np.concatenate(bones),
+                                     np.concatenate(values), boneNames, vertexCount)
+
     @property
     def data(self):
         return self._data
@@ -566,10 +939,10 @@ class VertexBoneWeights(object):
 
         first_entry = vertexWeightsDict.keys()[0] if len(vertexWeightsDict) > 0 else None
         if len(vertexWeightsDict) > 0 and \
-           len(vertexWeightsDict[first_entry]) == 2 and \
            isinstance(vertexWeightsDict[first_entry], tuple) and \
-           isinstance(vertexWeightsDict[first_entry][1], np.ndarray) and \
-           isinstance(vertexWeightsDict[first_entry][2], np.ndarray):
+           len(vertexWeightsDict[first_entry]) == 2 and \
+           isinstance(vertexWeightsDict[first_entry][0], np.ndarray) and \
+           isinstance(vertexWeightsDict[first_entry][1], np.ndarray):
             # Input dict is already in the expected format, presume it does not
             # need to be built again
             if vertexCount is not None:
@@ -647,96 +1020,57 @@ class VertexBoneWeights(object):
     def _compileVertexWeights(self, vertBoneMapping, skel, nWeights, vertexCount=None):
         """
         Compile vertex weights data to a more performant per-vertex format.
+        Returns a tuple of two (vertexCount, nWeights) arrays: the bone
+        indices and the weights of the nWeights most significant bones of each
+        vertex, sorted by descending weight. Vertices with more weights are
+        re-normalized, unused slots have bone index 0 and weight 0.
         """
-        if vertexCount is None:
-            vertexCount = 0
-            for bname, mapping in vertBoneMapping.items():
-                verts,weights = mapping
-                vertexCount = max(max(verts), vertexCount)
-            if vertexCount:
-                vertexCount += 1
-
-        # TODO use simple array columns instead of structured arrays (they are array of structs, not struct of arrays)
-        if nWeights == 3:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32), 
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32)]
-        elif nWeights == 4:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32), ('b_idx4', np.uint32),
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32), ('wght4', np.float32)]
-        elif nWeights == 6:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32), 
-                     ('b_idx4', np.uint32), ('b_idx5', np.uint32), ('b_idx6', np.uint32), 
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32), 
-                     ('wght4', np.float32), ('wght5', np.float32), ('wght6', np.float32)]
-        elif nWeights == 5:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32),
-                     ('b_idx4', np.uint32), ('b_idx5', np.uint32),
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32),
-                     ('wght4', np.float32), ('wght5', np.float32)]
-        elif nWeights == 13:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), ('b_idx3', np.uint32), 
-                     ('b_idx4', np.uint32), ('b_idx5', np.uint32), ('b_idx6', np.uint32), 
-                     ('b_idx7', np.uint32), ('b_idx8', np.uint32), ('b_idx9', np.uint32), 
-                     ('b_idx10', np.uint32), ('b_idx11', np.uint32), ('b_idx12', np.uint32), 
-                     ('b_idx13', np.uint32),
-                     ('wght1', np.float32), ('wght2', np.float32), ('wght3', np.float32), 
-                     ('wght4', np.float32), ('wght5', np.float32), ('wght6', np.float32), 
-                     ('wght7', np.float32), ('wght8', np.float32), ('wght9', np.float32), 
-                     ('wght10', np.float32), ('wght11', np.float32), ('wght12', np.float32), 
-                     ('wght13', np.float32)]
-        elif nWeights == 2:
-            dtype = [('b_idx1', np.uint32), ('b_idx2', np.uint32), 
-                     ('wght1', np.float32), ('wght2', np.float32)]
+        b_lookup = dict([(b.name,b_idx) for b_idx,b in enumerate(skel.getBones())])
+        verts = []
+        weights = []
+        bones = []
+        for bname, (vs, ws) in vertBoneMapping.items():
+            if bname not in b_lookup:
+                log.warning("Bone %s not found in skeleton", bname)
+                continue
+            # For now, assume there are no doubles
+            verts.append(np.asarray(vs, dtype=np.uint32))
+            weights.append(np.asarray(ws, dtype=np.float32))
+            bones.append(np.repeat(np.uint32(b_lookup[bname]), len(vs)))
+        if verts:
+            verts = np.concatenate(verts)
+            weights = np.concatenate(weights)
+            bones = np.concatenate(bones)
         else:
-            dtype = [('b_idx1', np.uint32), ('wght1', np.float32)]
-        compiled_vertweights = np.zeros(vertexCount, dtype=dtype)
+            verts = np.zeros(0, dtype=np.uint32)
+            weights = np.zeros(0, dtype=np.float32)
+            bones = np.zeros(0, dtype=np.uint32)
 
-        # Convert weights from indexed by bone to indexed by vertex index
-        _ws = dict()
-        b_lookup = dict([(b.name,b_idx) for b_idx,b in enumerate(skel.getBones())])
-        for bname, mapping in vertBoneMapping.items():
-            try:
-                b_idx = b_lookup[bname]
-                verts,weights = mapping
-                for v_idx, wght in zip(verts, weights):
-                    if v_idx not in _ws:
-                        _ws[v_idx] = []
-
-                    # TODO not needed for now (no remapping yet), and perhaps doubles should be removed upon merge, not when compiling
-                    # also in case of proxy remapping doubles need to be prevented
-                    '''
-                    b_idxs = [bidx for (_,bidx) in _ws[v_idx]]
-                    if b_idx in b_idxs:
-                        # Merge doubles (this needs to happen even if the _build_vertex_weights_data()
-                        # step already performs double removal, in the case where
-                        # weights were remapped to another rig and bones merged)
-                        _i = b_idxs.index(b_idx)
-                        _ws[v_idx][_i] = (_ws[v_idx][_i][0] + wght, b_idx)
-                    else:
-                        _ws[v_idx].append( (wght, b_idx) )
-                    '''
-                    _ws[v_idx].append( (wght, b_idx) )  # For now, assume there are no doubles
-            except KeyError as e:
-                log.warning("Bone %s not found in skeleton: %s" % (bname, e))
-        for v_idx in _ws:
-            # Sort by weight and keep only nWeights most significant weights
-            if len(_ws[v_idx]) > nWeights:
-                #log.debug("Vertex %s has too many weights (%s): %s" % (v_idx, len(_ws[v_idx]), str(sorted(_ws[v_idx], reverse=True))))
-                _ws[v_idx] = sorted(_ws[v_idx], reverse=True)[:nWeights]
-                # Re-normalize weights
-                weightvals = np.asarray( [e[0] for e in _ws[v_idx]], dtype=np.float32)
-                weightvals /= np.sum(weightvals)
-                for i in xrange(nWeights):
-                    _ws[v_idx][i] = (weightvals[i], _ws[v_idx][i][1])
-            else:
-                _ws[v_idx] = sorted(_ws[v_idx], reverse=True)
+        if vertexCount is None:
+            vertexCount = int(verts.max()) + 1 if len(verts) else 0
+
+        # Sort per vertex by descending weight (and bone index for equal weights)
+        order = np.lexsort((-bones.astype(np.int64), -weights, verts))
+        verts = verts[order]
+        weights = weights[order]
+        bones = bones[order]
+        del order
+
+        # Rank of each weight within its vertex, keep only the nWeights most significant
+        counts = np.bincount(verts, minlength=vertexCount)
+        rank = np.arange(len(verts)) - (np.cumsum(counts) - counts)[verts]
+        keep = rank < nWeights
 
-        for v_idx, wghts in _ws.items():
-            for i, (w, bidx) in enumerate(wghts):
-                compiled_vertweights[v_idx]['wght%s' % (i+1)] = w
-                compiled_vertweights[v_idx]['b_idx%s' % (i+1)] = bidx
+        b_idxs = np.zeros((vertexCount, nWeights), dtype=np.uint32)
+        wghts = np.zeros((vertexCount, nWeights), dtype=np.float32)
+        b_idxs[verts[keep], rank[keep]] = bones[keep]
+        wghts[verts[keep], rank[keep]] = weights[keep]
 
-        return compiled_vertweights
+        # Re-normalize weights of vertices that had too many weights
+        truncated = counts > nWeights
+        wghts[truncated] /= np.sum(wghts[truncated], axis=-1)[:,None]
+
+        return b_idxs, wghts
 
 class AnimatedMesh(object):
     """
@@ -751,6 +1085,9 @@ class AnimatedMesh(object):
         self.__meshes = []
         self.__vertexToBoneMaps = []
         self.__originalMeshCoords = []
+        self.__originalMeshNormals = []     # Rest pose vertex normals, calculated when needed
+        self.__activeVertices = []  # Per bound mesh: cached (face mask, active vertex indices, active weights)
+        self.__requiredVertices = []  # Per bound mesh: vertices that are always skinned, even if masked
         self.addBoundMesh(mesh, vertexToBoneMapping)
 
         self._posed = True
@@ -760,6 +1097,8 @@ class AnimatedMesh(object):
 
         self.__inPlace = False  # Animate in place (ignore translation component of animation)
         self.onlyAnimateVisible = False  # Only animate visible meshes (note: enabling this can have undesired consequences!)
+        self.skinNormals = False  # Skin rest normals instead of recalculating them from the posed faces (faster, for animation playback)
+        self.__skinningMethod = SKINNING['LINEAR']
 
     def setBaseSkeleton(self, skel):
         self.__skeleton = skel
@@ -821,6 +1160,24 @@ class AnimatedMesh(object):
     def setAnimateInPlace(self, enable):
         self.__inPlace = enable
 
+    def setSkinningMethod(self, method):
+        """
+        Set the skinning method used for posing the bound meshes, one of the
+        values of SKINNING. Dual quaternion skinning avoids the volume loss
+        (candy-wrapper effect) of linear blend skinning around twisting
+        joints, at a slightly higher cost. It requires baked animations.
+        """
+        if isinstance(method, basestring):
+            method = SKINNING[method.upper()]
+        if method not in SKINNING.values():
+            raise ValueError("Unknown skinning method %s" % method)
+        if method != self.__skinningMethod:
+            self.__skinningMethod = method
+            self.refreshPose()
+
+    def getSkinningMethod(self):
+        return self.__skinningMethod
+
     def getBaseSkeleton(self):
         return self.__skeleton
 
@@ -840,12 +1197,16 @@ class AnimatedMesh(object):
         originalMeshCoords[:,:3] = mesh.coord[:,:3]
         originalMeshCoords[:,3] = 1.0
         self.__originalMeshCoords.append(originalMeshCoords)
+        self.__originalMeshNormals.append(None)
         self.__vertexToBoneMaps.append(vertexToBoneMapping)
         self.__meshes.append(mesh)
+        self.__activeVertices.append(None)
+        self.__requiredVertices.append(None)
 
     def updateVertexWeights(self, meshName, vertexToBoneMapping):
         rIdx = self._getBoundMeshIndex(meshName)
         self.__vertexToBoneMaps[rIdx] = vertexToBoneMapping
+        self.__activeVertices[rIdx] = None
 
     def removeBoundMesh(self, name):
         try:
@@ -858,7 +1219,10 @@ class AnimatedMesh(object):
                 pass    # Don't fail if the mesh was already detached/destroyed
             del self.__meshes[rIdx]
             del self.__originalMeshCoords[rIdx]
+            del self.__originalMeshNormals[rIdx]
             del self.__vertexToBoneMaps[rIdx]
+            del self.__activeVertices[rIdx]
+            del self.__requiredVertices[rIdx]
         except:
             log.warning('Cannot remove bound mesh %s, no such mesh bound.', name)
 
@@ -881,6 +1245,79 @@ class AnimatedMesh(object):
     def getBoundMeshes(self):
         return [mesh.name for mesh in self.__meshes]
 
+    def setRequiredVertices(self, name, indices):
+        """
+        Specify vertices of the bound mesh with specified name that should
+        always be skinned, even when they are not used by any visible face
+        (eg. joint helper vertices used for determining posed joint positions).
+        """
+        rIdx = self._getBoundMeshIndex(name)
+        if indices is not None:
+            indices = np.unique(np.asarray(indices, dtype=np.uint32))
+        old = self.__requiredVertices[rIdx]
+        if old is None and indices is None or \
+           old is not None and indices is not None and np.array_equal(old, indices):
+            return
+        self.__requiredVertices[rIdx] = indices
+        self.__activeVertices[rIdx] = None
+        if self.isPosed():
+            self.refreshPose(syncSkeleton=False)
+
+    def getActiveVertices(self, name):
+        """
+        Indices of the vertices of the bound mesh with specified name that are
+        skinned when posing, or None if all vertices are skinned.
+        """
+        rIdx = self._getBoundMeshIndex(name)
+        return self._getActiveVertices(rIdx)[0]
+
+    def _getActiveVertices(self, idx, compiledWeights=None):
+        """
+        Returns the indices of the vertices of the bound mesh at idx that are
+        used by unmasked (visible) faces or by faces adjacent to them, or are
+        required (setRequiredVertices), together with their compiled weights
+        if compiledWeights is specified. The adjacent faces are included so
+        that the normals of the vertices at the border of the visible region
+        are calculated from posed faces.
+        Vertices that are only used by masked faces (eg. the basemesh faces
+        deleted by a proxy) are not skinned.
+        Indices are None if all vertices are active.
+        The result is cached and updated when the face mask of the mesh
+        changes.
+        """
+        mesh = self.__meshes[idx]
+        cached = self.__activeVertices[idx]
+        if cached is None or not np.array_equal(cached[0], mesh.face_mask):
+            faceMask = np.array(mesh.face_mask, dtype=bool)
+            vertMask = mesh.getVertexMaskForFaceMask(faceMask)
+            vertMask = mesh.getVertexMaskForFaceMask(mesh.getFaceMaskForVertices(np.flatnonzero(vertMask)))
+            if self.__requiredVertices[idx] is not None:
+                vertMask[self.__requiredVertices[idx]] = True
+            if np.all(vertMask):
+                verts = None
+            else:
+                verts = np.flatnonzero(vertMask).astype(np.uint32)
+                log.debug("Skinning %s of %s vertices of %s", len(verts), len(vertMask), mesh.name)
+            cached = [faceMask, verts, None, None]
+            self.__activeVertices[idx] = cached
+
+        verts = cached[1]
+        if compiledWeights is None or verts is None:
+            return verts, compiledWeights
+        if cached[2] is not compiledWeights:
+            # Weights of the active vertices only
+            cached[2] = compiledWeights
+            cached[3] = tuple(w[verts] for w in compiledWeights)
+        return verts, cached[3]
+
+    def _isFaceMaskChanged(self, idx):
+        """
+        Whether the face mask of the bound mesh at idx changed since its
+        active vertices were last determined.
+        """
+        cached = self.__activeVertices[idx]
+        return cached is None or not np.array_equal(cached[0], self.__meshes[idx].face_mask)
+
     def _getBoundMeshIndex(self, meshName):
         for idx, mesh in enumerate(self.__meshes):
             if mesh.name == meshName:
@@ -904,7 +1341,7 @@ class AnimatedMesh(object):
         if not self.__currentAnim:
             return
         frameNb = int(frameNb)
-        self.__playTime = float(frameNb)/self.__currentAnim.frameRate
+        self.__playTime = self.__currentAnim.getFrameTime(frameNb)
         if update:
             self._pose()
 
@@ -954,12 +1391,108 @@ class AnimatedMesh(object):
             poseState[:,:3,3] = np.zeros((poseState.shape[0],3), dtype=np.float32)
         return poseState
 
-    def _pose(self, syncSkeleton=True):
+    def getDualQuaternionPoseState(self):
+        """
+        Get the baked skinning transforms of the active animation at the
+        current play time as unit dual quaternions, or None if the active
+        animation is not baked.
+        """
+        dqState = self.__currentAnim.getDualQuaternionsAtTime(self.__playTime)
+        if dqState is not None and self.__inPlace:
+            # Remove translation: the dual part of a pure rotation is zero
+            dqState = dqState.copy()
+            dqState[:,1] = 0
+        return dqState
+
+    def skinFrames(self, meshName, frameIndices=None, out=None, writer=None, chunkSize=64):
+        """
+        Skin the bound mesh with specified name for a range of frames of the
+        active animation at once, for exporting animated vertex caches (eg.
+        MDD, PC2 or NPY point caches). The mesh itself, the play time and the
+        pose of the skeleton are not changed.
+
+        frameIndices    frame numbers to skin, all frames of the active
+                        animation if None
+        out             np.array((len(frameIndices), nverts, 3)) to write
+                        the result to, allocated if not specified (and no
+                        writer is specified)
+        writer          optional callable writer(frameOffset, coords) that is
+                        called for each chunk of chunkSize frames, with coords
+                        a (nChunkFrames, nverts, 3) array that is only valid
+                        during the call, and frameOffset the position of its
+                        first frame in frameIndices
+
+        The active animation is baked if needed, all vertices are skinned with
+        the skinning method and in-place setting of this animated mesh.
+        Returns out (None if only a writer was specified).
+        """
+        if not self.__currentAnim or not self.getBaseSkeleton():
+            raise RuntimeError("Cannot skin frames of %s, no animation or skeleton set" % meshName)
+        anim = self.__currentAnim
+        if not anim.isBaked():
+            anim.bake(self.getBaseSkeleton())
+        if not anim.isBaked():
+            raise RuntimeError("Cannot skin frames of %s, animation %s cannot be baked" % (meshName, anim.name))
+
+        rIdx = self._getBoundMeshIndex(meshName)
+        vmap = self.__vertexToBoneMaps[rIdx]
+        if vmap is None:
+            raise RuntimeError("No weights assigned to bound mesh %s" % meshName)
+        if not vmap.isCompiled(6):
+            vmap.compileData(self.getBaseSkeleton(), 6)
+        weights = vmap.compiled(6)
+        coords = self.__originalMeshCoords[rIdx]
+
+        if frameIndices is None:
+            frameIndices = np.arange(anim.nFrames)
+        nFrames = len(frameIndices)
+        if out is None and writer is None:
+            out = np.empty((nFrames, len(coords), 3), dtype=np.float32)
+        if out is None:
+            buf = np.empty((min(chunkSize, nFrames), len(coords), 3), dtype=np.float32)
+
+        # Skinning transforms of all frames, as (nFrames, nBones, ...) arrays
+        if self.__skinningMethod == SKINNING['DUAL_QUATERNION']:
+            skin = skinMeshDualQuaternion
+            states = anim._getBakedDualQuaternions().reshape((anim.nFrames, anim.nBones, 2, 4))
+        else:
+            skin = skinMesh
+            states = anim.data.reshape((anim.nFrames, anim.nBones, 3, 4))
+        frameIndices = np.asarray(frameIndices, dtype=np.intp)
+
+        for start in xrange(0, nFrames, chunkSize):
+            end = min(start + chunkSize, nFrames)
+            if out is None:
+                chunk = buf[:end-start]
+            else:
+                chunk = out[start:end]
+
+            # Skin all frames of the chunk at once
+            chunkStates = states[frameIndices[start:end]]
+            if self.__inPlace:
+                # Remove translation (the dual part of a pure rotation is zero)
+                if skin is skinMeshDualQuaternion:
+                    chunkStates[:,:,1] = 0
+                else:
+                    chunkStates[:,:,:3,3] = 0
+            skin(coords, weights, chunkStates, out=chunk)
+
+            if writer is not None:
+                writer(start, chunk)
+
+        return out
+
+    def _pose(self, syncSkeleton=True, skinMasked=False, meshIndices=None):
         """
         If syncSkeleton is True, even when baked animations are used, that do not require
         applying motion to the skeleton to calculate the skinning matrices, the pose
         state of the skeleton is updated. Thus setting this to True is slower and
         is advised for static poses only.
+        If skinMasked is True, all vertices are skinned, also those only used
+        by masked faces. Otherwise those are only skinned for meshes of which
+        the face mask changed since they were last skinned.
+        If meshIndices is specified, only the bound meshes at those indices
+        are skinned.
         """
         if self.isPosed():
             if not self.getBaseSkeleton():
@@ -970,9 +1503,16 @@ class AnimatedMesh(object):
                 self.__currentAnim.bake(self.getBaseSkeleton())
 
             poseState = self.getPoseState()
+            if self.__skinningMethod == SKINNING['DUAL_QUATERNION']:
+                dqState = self.getDualQuaternionPoseState()
+            else:
+                dqState = None
 
             # Else we pass poseVerts matrices immediately from animation track for performance improvement (cached or baked)
             for idx,mesh in enumerate(self.__meshes):
+                if meshIndices is not None and idx not in meshIndices:
+                    continue
+
                 # TODO make onlyAnimateVisible work by excluding some meshes from the filter that should always be animated
                 if self.onlyAnimateVisible and not mesh.visibility:
                     continue
@@ -991,8 +1531,28 @@ class AnimatedMesh(object):
                             log.debug("Compiling vertex bone weights for %s", mesh.name)
                             self.__vertexToBoneMaps[idx].compileData(self.getBaseSkeleton(), 6)
 
-                        # New fast skinnig approach
-                        posedCoords = skinMesh(self.__originalMeshCoords[idx], self.__vertexToBoneMaps[idx].compiled(6), poseState)
+                        # New fast skinnig approach, only skin active (unmasked) vertices
+                        weights = self.__vertexToBoneMaps[idx].compiled(6)
+                        if skinMasked or self._isFaceMaskChanged(idx):
+                            # Masked vertices still have the coordinates of
+                            # an older pose, skin all vertices
+                            self._getActiveVertices(idx)
+                            verts = None
+                        else:
+                            verts, weights = self._getActiveVertices(idx, weights)
+                        if self.skinNormals:
+                            self._skinMeshInPlace(idx, verts, weights, poseState, dqState)
+                            continue
+                        if verts is None:
+                            coords = self.__originalMeshCoords[idx]
+                        else:
+                            coords = self.__originalMeshCoords[idx][verts]
+                        if dqState is not None:
+                            posedCoords = skinMeshDualQuaternion(coords, weights, dqState)
+                        else:
+                            posedCoords = skinMesh(coords, weights, poseState)
+                        self._updateMeshVerts(mesh, posedCoords, verts)
+                        continue
                 except Exception as e:
                     log.error("Error skinning mesh %s", mesh.name, exc_info=True)
                     raise e
@@ -1008,16 +1568,69 @@ class AnimatedMesh(object):
             for idx,mesh in enumerate(self.__meshes):
                 self._updateMeshVerts(mesh, self.__originalMeshCoords[idx])
 
-    def _updateMeshVerts(self, mesh, verts):
-        # TODO this is way too slow for realtime animation, but good for posing. For animation, update the r_ verts directly, as well as the r_vnorm members
+    def _updateMeshVerts(self, mesh, verts, indices=None):
+        # Note: this is too slow for realtime animation, but good for posing. For animation, enable skinNormals (see _skinMeshInPlace)
         # TODO use this mapping to directly update the opengl data for animation
         # Remap vertex weights to the unwelded vertices of the object (mesh.coord to mesh.r_coord)
         #originalToUnweldedMap = mesh.inverse_vmap
 
-        mesh.changeCoords(verts[:,:3])
-        mesh.calcNormals()  # TODO this is too slow for animation
+        # Only mark the coordinates that changed, so that normals are only
+        # recalculated for the changed region (eg. after modeling in rest pose)
+        # If indices is specified, verts are the new coordinates of only those
+        # vertices, and normals are only recalculated around them
+        if indices is None:
+            changed = np.flatnonzero(np.any(mesh.coord != verts[:,:3], axis=1))
+            mesh.changeCoords(verts[changed,:3], changed)
+        else:
+            changed = np.flatnonzero(np.any(mesh.coord[indices] != verts[:,:3], axis=1))
+            mesh.changeCoords(verts[changed,:3], indices[changed])
+        mesh.calcDirtyNormals()
+        mesh.update()
+
+    def _skinMeshInPlace(self, idx, verts, weights, poseState, dqState=None):
+        """
+        Fast path for animation playback: skin the bound mesh at idx directly
+        into its coordinates, and skin its rest pose normals with the rotation
+        part of the same transforms instead of recalculating the normals from
+        the posed faces. Face normals and tangents are not updated.
+        """
+        mesh = self.__meshes[idx]
+        restCoords = self.__originalMeshCoords[idx]
+        restNormals = self._getRestNormals(idx)
+        if dqState is not None:
+            skin, state = skinMeshDualQuaternion, dqState
+        else:
+            skin, state = skinMesh, poseState
+
+        if verts is None:
+            skin(restCoords, weights, state, out=mesh.coord)
+            normals = skin(restNormals, weights, state)
+        else:
+            mesh.coord[verts] = skin(restCoords[verts], weights, state)
+            normals = skin(restNormals[verts], weights, state)
+        normals /= np.maximum(np.sqrt(np.sum(normals**2, axis=-1)), 1e-12)[:,None]
+
+        mesh.markCoords(verts, coor=True)
+        mesh.changeNormals(normals, verts)
         mesh.update()
 
+    def _getRestNormals(self, idx):
+        """
+        Vertex normals of the bound mesh at idx in rest pose, calculated from
+        the rest coordinates the first time they are needed.
+        """
+        if self.__originalMeshNormals[idx] is None:
+            import module3d
+            mesh = self.__meshes[idx]
+            coord = self.__originalMeshCoords[idx][:,:3]
+            fvert = coord[mesh.fvert]
+            fnorm = np.cross(fvert[:,0] - fvert[:,1], fvert[:,1] - fvert[:,2])
+            faces, counts = mesh.getVertexFaces()
+            normals = module3d.sum_rows(fnorm[faces], counts)
+            normals /= np.maximum(np.sqrt(np.sum(normals**2, axis=-1)), 1e-12)[:,None]
+            self.__originalMeshNormals[idx] = normals.astype(np.float32)
+        return self.__originalMeshNormals[idx]
+
     def refreshStaticMeshes(self, refresh_pose=True):
         """
         Invoke this method after the static (rest pose) meshes were changed.
@@ -1026,29 +1639,56 @@ class AnimatedMesh(object):
         """
         for mIdx, mesh in enumerate(self.__meshes):
             self.__originalMeshCoords[mIdx][:,:3] = mesh.coord[:,:3]
+            self.__originalMeshNormals[mIdx] = None
         if refresh_pose:
             self.refreshPose(updateIfInRest=False)
 
+    def refreshFaceMasks(self):
+        """
+        Invoke this method after the face masks of the bound meshes were
+        changed. If posed, the meshes of which the face mask changed since
+        they were last skinned are skinned again, so that vertices that were
+        masked before are posed too.
+        Returns True if any mesh was skinned.
+        """
+        if not self.isPosed():
+            return False
+        changed = [idx for idx in xrange(len(self.__meshes)) if self._isFaceMaskChanged(idx)]
+        if not changed:
+            return False
+        self._pose(syncSkeleton=False, meshIndices=changed)
+        return True
+
     def _updateOriginalMeshCoords(self, name, coord):
         rIdx = self._getBoundMeshIndex(name)
         self.__originalMeshCoords[rIdx][:,:3] = coord[:,:3]
+        self.__originalMeshNormals[rIdx] = None
 
-    def refreshPose(self, updateIfInRest=False, syncSkeleton=True):
+    def refreshPose(self, updateIfInRest=False, syncSkeleton=True, skinMasked=False):
+        """
+        Re-apply the current pose. If skinMasked is True, also the vertices
+        that are only used by masked faces are posed (eg. before exporting
+        hidden geometry).
+        """
         if not self.getBaseSkeleton():
             self.resetToRestPose()
         if updateIfInRest or self.isPosed():
-            self._pose(syncSkeleton=syncSkeleton)
+            self._pose(syncSkeleton=syncSkeleton, skinMasked=skinMasked)
         elif syncSkeleton and self.getBaseSkeleton():
             # Do not do the skinning (which is trivial), but nonetheless ensure that the skeleton's
             # pose state is restored to rest
             self.getBaseSkeleton().setToRestPose()
 
-def skinMesh(coords, compiledVertWeights, poseData):
+SKINNING_CHUNK_SIZE = 4096   # Number of vertices skinned at once by skinMesh()
+
+def skinMesh(coords, compiledVertWeights, poseData, out=None, chunkSize=SKINNING_CHUNK_SIZE):
     """
     More efficient way of linear blend skinning or smooth skinning.
     As proposed in http://graphics.ucsd.edu/courses/cse169_w05/3-Skin.htm we use
     a vertex-major loop.
-    We also use a fixed number of weights per vertex.
+    We also use a fixed number of weights per vertex: compiledVertWeights is
+    a (bone indices, weights) tuple of (nverts, nWeights) arrays, as returned
+    by VertexBoneWeights.compiled(). Any number of weights is supported.
     Uses accumulated matrix skinning (http://http.developer.nvidia.com/GPUGems/gpugems_ch04.html)
 
     Care should be taken to supply coords with the right dimensions. This method
@@ -1058,9 +1698,17 @@ def skinMesh(coords, compiledVertWeights, poseData):
     rotations only (for directions such as normals, tangents and targets).
     If coords is nx3 size, this method will perform faster as only 3x3 matrix
     multiplies are performed, otherwise 3x4 matrices are multiplied.
-    """
-    # TODO allow skinning only the visible (not statically hidden) vertices, for performance reasons (eg if an alt. topology is set, do we animate both basemesh and topology?)
 
+    poseData can also be a stack of poses (nFrames, nBones, 3, 4), to skin
+    multiple frames at once, in which case the result is an (nFrames, nverts, 3)
+    array.
+
+    Vertices are skinned in chunks of chunkSize vertices (divided by the number
+    of frames), which bounds the memory used for temporary
+    (chunkSize, nWeights, 3, c) matrices.
+    The result is written to out, an (nverts, 3) array, if specified.
+    Returns the skinned coordinates (out).
+    """
     if coords.shape[1] == 4:
         # Vertices contain homogenous coordinate (1 if translation affects position,
         # 0 if vertex should not be affected by translation (only direction) )
@@ -1069,65 +1717,120 @@ def skinMesh(coords, compiledVertWeights, poseData):
         # Translations do not affect vertices (faster as this requires only 3x3 matrix multiplies)
         c = 3
 
-    W = compiledVertWeights
-    P = poseData
-    if len(compiledVertWeights.dtype) == 4*2:
-        # nWeights = 4
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c] + \
-                W['wght4'][:,None,None] * P[W['b_idx4']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 2:
-        # nWeights = 1
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 6*2:
-        # nWeights = 13
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c] + \
-                W['wght4'][:,None,None] * P[W['b_idx4']][:,:3,:c] + \
-                W['wght5'][:,None,None] * P[W['b_idx5']][:,:3,:c] + \
-                W['wght6'][:,None,None] * P[W['b_idx6']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 5*2:
-        # nWeights = 5
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c] + \
-                W['wght4'][:,None,None] * P[W['b_idx4']][:,:3,:c] + \
-                W['wght5'][:,None,None] * P[W['b_idx5']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 13*2:
-        # nWeights = 13
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c] + \
-                W['wght4'][:,None,None] * P[W['b_idx4']][:,:3,:c] + \
-                W['wght5'][:,None,None] * P[W['b_idx5']][:,:3,:c] + \
-                W['wght6'][:,None,None] * P[W['b_idx6']][:,:3,:c] + \
-                W['wght7'][:,None,None] * P[W['b_idx7']][:,:3,:c] + \
-                W['wght8'][:,None,None] * P[W['b_idx8']][:,:3,:c] + \
-                W['wght9'][:,None,None] * P[W['b_idx9']][:,:3,:c] + \
-                W['wght10'][:,None,None] * P[W['b_idx10']][:,:3,:c] + \
-                W['wght11'][:,None,None] * P[W['b_idx11']][:,:3,:c] + \
-                W['wght12'][:,None,None] * P[W['b_idx12']][:,:3,:c] + \
-                W['wght13'][:,None,None] * P[W['b_idx13']][:,:3,:c]
-    elif len(compiledVertWeights.dtype) == 2*2:
-        # nWeights = 2
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c]
+    b_idxs, wghts = compiledVertWeights
+    nVerts = len(coords)
+    frameShape = poseData.shape[:-3]
+    if out is None:
+        out = np.empty(frameShape + (nVerts, 3), dtype=np.result_type(coords.dtype, poseData.dtype, wghts.dtype))
+    P = np.ascontiguousarray(poseData[...,:3,:c])
+    chunkSize = max(1, chunkSize // max(1, int(np.prod(frameShape))))
+
+    for start in xrange(0, nVerts, chunkSize):
+        end = min(start + chunkSize, nVerts)
+        # Accumulate the weighted pose matrices of all bones of each vertex
+        accum = np.einsum('ik,...ikjl -> ...ijl', wghts[start:end], P[...,b_idxs[start:end],:,:])
+        # Using einstein summation for matrix * vertex multiply
+        out[...,start:end,:] = np.einsum('...ijk,ik -> ...ij', accum, coords[start:end,:c])
+
+    return out
+
+def skinMeshDualQuaternion(coords, compiledVertWeights, dqData, out=None, chunkSize=SKINNING_CHUNK_SIZE):
+    """
+    Dual quaternion skinning, as proposed by Kavan et al. in "Geometric
+    Skinning with Approximate Dual Quaternion Blending" (2008).
+    The per-bone unit dual quaternions in dqData (nBones, 2, 4), as returned by
+    dualQuaternionsFromMatrices(), are linearly blended per vertex and
+    normalized, which results in a rigid transformation per vertex. This avoids
+    the volume loss of linear blend skinning (the candy-wrapper effect) at
+    twisting joints.
+
+    Arguments are the same as for skinMesh(). If coords is nx4, the homogenous
+    coordinate scales the translation of the vertex (0 for directions), nx3
+    coords are only rotated. As with skinMesh(), dqData can be a stack of
+    poses (nFrames, nBones, 2, 4) to skin multiple frames at once.
+    Returns the skinned coordinates (out).
+    """
+    b_idxs, wghts = compiledVertWeights
+    nVerts = len(coords)
+    stacked = dqData.ndim == 4
+    if not stacked:
+        dqData = dqData[None]
+    nFrames = len(dqData)
+    if out is None:
+        out = np.empty((nFrames, nVerts, 3), dtype=np.result_type(coords.dtype, dqData.dtype, wghts.dtype))
+        result = out if stacked else out[0]
     else:
-        # nWeights = 3
-        accum = W['wght1'][:,None,None] * P[W['b_idx1']][:,:3,:c] + \
-                W['wght2'][:,None,None] * P[W['b_idx2']][:,:3,:c] + \
-                W['wght3'][:,None,None] * P[W['b_idx3']][:,:3,:c]
+        result = out
+        if not stacked:
+            out = out[None]
+    # Frames are stored innermost, so that the bones of a chunk of vertices
+    # are gathered for all frames at once
+    Q = np.ascontiguousarray(dqData.reshape((nFrames, -1, 8)).transpose(1, 0, 2))
+    homogenous = coords.shape[1] == 4
+    chunkSize = max(1, chunkSize // nFrames)
+
+    for start in xrange(0, nVerts, chunkSize):
+        end = min(start + chunkSize, nVerts)
+        dq = Q[b_idxs[start:end]]   # (n, nWeights, nFrames, 8)
+        # Antipodality: flip the weights of quaternions that lie in the other
+        # hemisphere than the one of the most significant bone
+        w = wghts[start:end,:,None]
+        w = np.where(np.einsum('ikfj,ifj -> ikf', dq[...,:4], dq[:,0,:,:4]) < 0, -w, w)
+        b = np.einsum('ikf,ikfj -> ifj', w, dq)
+        b /= np.sqrt(np.sum(b[...,:4]**2, axis=-1))[...,None]
+
+        r_w = b[...,0:1]
+        r_v = b[...,1:4]
+        d_w = b[...,4:5]
+        d_v = b[...,5:8]
+        p = coords[start:end,None,:3]
+        # Rotate: p + 2 r_v x (r_v x p + r_w p)
+        res = p + 2 * np.cross(r_v, np.cross(r_v, p) + r_w * p)
+        # Translate: 2 (r_w d_v - d_w r_v + r_v x d_v)
+        t = 2 * (r_w * d_v - d_w * r_v + np.cross(r_v, d_v))
+        if homogenous:
+            t *= coords[start:end,None,3:4]
+            res += t
+        out[:,start:end] = res.transpose(1, 0, 2)
 
-    # Note: np.sum(M * vs, axis=-1) is a matrix multiplication of mat M with
-    # a series of vertices vs
-    # Good resource: http://jameshensman.wordpress.com/2010/06/14/multiple-matrix-multiplication-in-numpy
-    #return np.sum(accum[:,:3,:4] * coords[:,None,:], axis=-1)
+    return result
 
-    # Using einstein summation for matrix * vertex multiply, appears to be
-    # slightly faster
-    return np.einsum('ijk,ikl -> ij', accum[:,:3,:c], coords[:,:c,None])
+def dualQuaternionsFromMatrices(mats):
+    """
+    Convert rigid 3x4 (or 4x4) transformation matrices (n, 3, 4) to unit dual
+    quaternions, returned as an (n, 2, 4) array with the real (rotation) and
+    dual (translation) part in w, x, y, z order.
+    """
+    m = np.asarray(mats, dtype=np.float64)[:,:3,:4]
+    n = len(m)
+    m00, m01, m02 = m[:,0,0], m[:,0,1], m[:,0,2]
+    m10, m11, m12 = m[:,1,0], m[:,1,1], m[:,1,2]
+    m20, m21, m22 = m[:,2,0], m[:,2,1], m[:,2,2]
+    trace = m00 + m11 + m22
+
+    # Rotation part, choosing the numerically most stable formula per matrix
+    q = np.empty((n, 4), dtype=np.float64)
+    c0 = trace > 0
+    c1 = ~c0 & (m00 > m11) & (m00 > m22)
+    c2 = ~c0 & ~c1 & (m11 > m22)
+    c3 = ~c0 & ~c1 & ~c2
+    s = 2 * np.sqrt(np.maximum(1 + trace[c0], 0))
+    q[c0] = np.column_stack([0.25 * s, (m21-m12)[c0] / s, (m02-m20)[c0] / s, (m10-m01)[c0] / s])
+    s = 2 * np.sqrt(np.maximum(1 + (m00-m11-m22)[c1], 0))
+    q[c1] = np.column_stack([(m21-m12)[c1] / s, 0.25 * s, (m01+m10)[c1] / s, (m02+m20)[c1] / s])
+    s = 2 * np.sqrt(np.maximum(1 + (m11-m00-m22)[c2], 0))
+    q[c2] = np.column_stack([(m02-m20)[c2] / s, (m01+m10)[c2] / s, 0.25 * s, (m12+m21)[c2] / s])
+    s = 2 * np.sqrt(np.maximum(1 + (m22-m00-m11)[c3], 0))
+    q[c3] = np.column_stack([(m10-m01)[c3] / s, (m02+m20)[c3] / s, (m12+m21)[c3] / s, 0.25 * s])
+    q /= np.sqrt(np.sum(q**2, axis=-1))[:,None]
+
+    # Dual part: 0.5 * (0, t) * q
+    t = m[:,:3,3]
+    result = np.empty((n, 2, 4), dtype=np.float64)
+    result[:,0] = q
+    result[:,1,0] = -0.5 * np.sum(t * q[:,1:], axis=-1)
+    result[:,1,1:] = 0.5 * (q[:,0:1] * t + np.cross(t, q[:,1:]))
+    return result
 
 def emptyTrack(nFrames, nBones=1):
     """
@@ -1165,6 +1868,130 @@ def animationRelativeToPose(animation, restpose):
     # TODO create animation track copy that is relative to restpose
     pass
 
+def getSkeletonIdentity(skel):
+    """
+    A hash identifying the structure of a skeleton that animation data is
+    retargeted to: the bone names in breadth-first order and their reference
+    bones. Joint positions do not influence (unbaked) animation data.
+    """
+    import hashlib
+    h = hashlib.md5()
+    for bone in skel.getBones():
+        h.update(bone.name.encode('utf-8'))
+        h.update('|'.join(bone.reference_bones).encode('utf-8'))
+        h.update('\n')
+    return h.hexdigest()
+
+def getCompiledAnimationPath(filepath):
+    return os.path.splitext(filepath)[0] + '.mhbanim'
+
+def _getLoadOptionsIdentity(options):
+    """
+    String identifying the options an animation was loaded with, as stored in
+    compiled animation files.
+    """
+    if not options:
+        return ''
+    return '|'.join('%s=%r' % (key, options[key]) for key in sorted(options.keys()))
+
+def saveCompiledAnimation(anim, path, sourcePath, skel, metadata=None, options=None):
+    """
+    Save an animation track, retargeted to skel and loaded from the file
+    sourcePath, to a compiled binary (npz) animation file. The file records
+    the modification time of the source file, the identity of the skeleton
+    and the load options that influence the result (eg. the coordinate
+    system conversion of BVH files) so that it can be validated when loading.
+    Optional metadata is stored as a dict of (numeric or string) values.
+    """
+    if metadata is None:
+        metadata = {}
+    data = dict(('meta_%s' % key, value) for key, value in metadata.items() if value is not None)
+    data['poseData'] = np.asarray(anim._data, dtype=np.float32)
+    data['nFrames'] = anim.nFrames
+    data['frameRate'] = anim.frameRate
+    data['name'] = anim.name
+    data['isPose'] = isinstance(anim, Pose)
+    if anim.hasKeyTimes():
+        data['keyTimes'] = anim.getKeyTimes()
+        data['playtime'] = anim.getPlaytime()
+    data['source'] = os.path.basename(sourcePath)
+    data['sourceMtime'] = os.path.getmtime(sourcePath)
+    data['skeleton'] = getSkeletonIdentity(skel)
+    data['options'] = _getLoadOptionsIdentity(options)
+    f = open(path, 'wb')
+    try:
+        np.savez(f, **data)
+    finally:
+        f.close()
+
+def loadCompiledAnimation(path, sourcePath, skel, options=None):
+    """
+    Load a compiled animation file saved with saveCompiledAnimation().
+    Raises a RuntimeError if it is out of date with the source file, was
+    compiled for a skeleton with a different structure or was compiled with
+    different load options.
+    Returns the animation track and the stored metadata.
+    """
+    data = np.load(path)
+    if unicode(data['source']) != os.path.basename(sourcePath):
+        raise RuntimeError('compiled animation %s belongs to a different source file (%s)' % (path, data['source']))
+    if os.path.isfile(sourcePath) and os.path.getmtime(sourcePath) > float(data['sourceMtime']):
+        raise RuntimeError('compiled animation file out of date: %s' % path)
+    if str(data['skeleton']) != getSkeletonIdentity(skel):
+        raise RuntimeError('compiled animation %s was compiled for a different skeleton' % path)
+    if 'options' not in data.files or unicode(data['options']) != _getLoadOptionsIdentity(options):
+        raise RuntimeError('compiled animation %s was compiled with different load options' % path)
+
+    name = unicode(data['name'])
+    if bool(data['isPose']):
+        anim = Pose(name, data['poseData'])
+    else:
+        anim = AnimationTrack(name, data['poseData'], int(data['nFrames']), float(data['frameRate']))
+        if 'keyTimes' in data.files:
+            anim._keyTimes = data['keyTimes']
+            anim._playtime = float(data['playtime'])
+            anim.interpolationType = 1
+    metadata = dict((key[5:], data[key][()]) for key in data.files if key.startswith('meta_'))
+    return anim, metadata
+
+def loadAnimation(filepath, skel, loadFunc, options=None):
+    """
+    Load an animation or pose from source file filepath, retargeted to skel,
+    using its compiled binary version if that is up to date. Otherwise the
+    animation is loaded with loadFunc(), which should return the animation
+    track and a metadata dict, and a compiled file is written to the user
+    data path (compile_animations.py compiles the system animations).
+    options is a dict with the load options passed to loadFunc that affect
+    the resulting animation, a compiled file is only used if it was made with
+    the same options.
+    Returns the animation track and the metadata.
+    """
+    import getpath
+
+    npzpath = getCompiledAnimationPath(filepath)
+    try:
+        if not os.path.isfile(npzpath):
+            raise RuntimeError('compiled animation file missing: %s' % npzpath)
+        return loadCompiledAnimation(npzpath, filepath, skel, options)
+    except Exception as e:
+        showTrace = not isinstance(e, RuntimeError)
+        log.debug("Problem loading compiled animation: %s", e, exc_info=showTrace)
+
+    anim, metadata = loadFunc()
+    if getpath.isSubPath(npzpath, getpath.getPath()):
+        # Only write compiled animations to user data path
+        try:
+            log.message('Compiling binary animation file %s', npzpath)
+            saveCompiledAnimation(anim, npzpath, filepath, skel, metadata, options)
+        except StandardError:
+            log.notice('unable to save compiled animation: %s', npzpath, exc_info=True)
+            if os.path.isfile(npzpath):
+                try:
+                    os.remove(npzpath)
+                except Exception as e:
+                    log.warning("Could not remove empty file %s that was left behind (%s).", npzpath, e)
+    return anim, metadata
+
 def loadPoseFromMhpFile(filepath, skel):
     """
     Load a MHP pose file that contains a static pose. Posing data is defined
@@ -43,6 +43,7 @@ import skeleton
 import animation
 import log
 
+import itertools
 import numpy as np
 import transformations as tm
 
@@ -275,11 +276,14 @@ class BVH():
         """
         return self.bvhJoints
 
-    def fromFile(self, filepath):
+    def fromFile(self, filepath, startFrame=0, endFrame=None, stride=1):
         """
         Parse a BVH skeletal animation file.
         Loads both the skeleton hierarchy and the animation track from the 
         specified BVH file.
+        Optionally only the frames from startFrame up to (not including)
+        endFrame are loaded, taking only every stride-th frame. The frame time
+        is adapted to the stride, so the animation keeps its playback speed.
         """
         import os
         self.name = os.path.splitext(os.path.basename(filepath))[0]
@@ -314,16 +318,39 @@ class BVH():
         self.__expectKeyword('MOTION', fp)
 
         words = self.__expectKeyword('Frames:', fp)
-        self.frameCount = int(words[1])
+        fileFrameCount = int(words[1])
         words = self.__expectKeyword('Frame', fp) # Time:
-        self.frameTime = float(words[2])
-
-        for i in range(self.frameCount):
-            line = fp.readline()
-            words = line.split()
-            data = [float(word) for word in words]
-            for joint in self.getJointsBVHOrder():
-                data = self.__processChannelData(joint, data)
+        self.frameTime = float(words[2]) * stride
+
+        # Parse the selected frames of the motion data into a (nFrames,
+        # nChannels) array, in chunks of frames so that only the text of one
+        # chunk is held in memory at a time
+        CHUNK_FRAMES = 64
+        if endFrame is None or endFrame > fileFrameCount:
+            endFrame = fileFrameCount
+        self.frameCount = len(xrange(startFrame, endFrame, stride))
+        if self.frameCount == 0:
+            raise RuntimeError('No frames selected from BVH file %s (%s frames, start %s, end %s, stride %s)' % (filepath, fileFrameCount, startFrame, endFrame, stride))
+        nChannels = sum([len(joint.channels) for joint in self.getJointsBVHOrder()])
+        data = np.empty((self.frameCount, nChannels), dtype=np.float32)
+        lines = itertools.islice(fp, startFrame, endFrame, stride)
+        nValues = 0
+        for start in xrange(0, self.frameCount, CHUNK_FRAMES):
+            chunk = list(itertools.islice(lines, CHUNK_FRAMES))
+            values = ' '.join(chunk).split()
+            nValues += len(values)
+            if len(values) != len(chunk) * nChannels or len(chunk) < min(CHUNK_FRAMES, self.frameCount - start):
+                fp.close()
+                raise RuntimeError('Expected %s values of frame data (%s frames of %s channels) in BVH file %s, found %s' % (self.frameCount * nChannels, self.frameCount, nChannels, filepath, nValues))
+            data[start:start+len(chunk)] = np.array(values, dtype=np.float32).reshape((len(chunk), nChannels))
+        fp.close()
+
+        # Distribute the channel data among the joints
+        offset = 0
+        for joint in self.getJointsBVHOrder():
+            nJointChannels = len(joint.channels)
+            joint.frames = data[:,offset:offset+nJointChannels].reshape(-1)
+            offset += nJointChannels
 
         self.__cacheGetJoints()
 
@@ -331,6 +358,15 @@ class BVH():
         for joint in self.getJoints():
             joint.calculateFrames()     # TODO we don't need to calculate pose matrices for end effectors
 
+    def getJointLengths(self):
+        """
+        The rest length of all joints that have children (the distance to
+        their first child), as a dict indexed by joint name.
+        """
+        import numpy.linalg as la
+        return dict([(joint.name, float(la.norm(joint.children[0].position - joint.position))) \
+                     for joint in self.getJoints() if joint.hasChildren()])
+
     def _autoGuessCoordinateSystem(self):
         """
         Guesses whether this BVH rig uses a Y-up or Z-up axis system, using the
@@ -425,6 +461,9 @@ class BVH():
         nonEndJoints = [ joint for joint in self.getJoints() if not joint.isEndConnector() ]
 
         if animationTrack:
+            if animationTrack.hasKeyTimes():
+                # BVH stores frames at a fixed frame rate
+                animationTrack = animationTrack.getResampled()
             self.frameCount = animationTrack.nFrames
             self.frameTime = 1.0/animationTrack.frameRate
 
@@ -568,17 +607,6 @@ class BVH():
             else:
                 raise RuntimeError('Expected %s found %s' % ('JOINT, End Site or }', words[0]))
 
-    def __processChannelData(self, joint, data):
-        """
-        Distribute animation channel data for one frame or motion sample, 
-        loaded from a BVH file, among the joints of the skeleton structure.
-        """
-        nChannels = len(joint.channels)
-        joint.frames.extend(data[:nChannels])
-        data = data[nChannels:]
-
-        return data
-
     def __calcPosition(self, joint, offset):
         """
         Calculate this joint's position using offset (from parent) defined in
@@ -714,15 +742,7 @@ class BVHJoint():
             # TODO allow partial rotation channels too?
             pass
         elif len(rotAngles) >= 3:
-            for frameIdx in range(nFrames):
-                self.matrixPoses[frameIdx,:3,:3] = tm.euler_matrix(rotAngles[2][frameIdx], rotAngles[1][frameIdx], rotAngles[0][frameIdx], axes=rotOrder)[:3,:3]
-
-            # TODO eliminate loop with numpy?
-            '''
-            for rotAngle in rotAngles:  
-                self.matrixPoses[:] = tm.euler_matrix(rotAngle[2], rotAngle[1], rotAngle[0], axes=rotOrder))
-            # unfortunately tm.euler_matrix is not a np ufunc
-            '''
+            self.matrixPoses[:,:3,:3] = eulerMatrices(rotAngles[2], rotAngles[1], rotAngles[0], axes=rotOrder)
 
         # Add translations to pose matrices
         # Allow partial transformation channels too
@@ -763,7 +783,88 @@ class BVHJoint():
         return not self.hasChildren()
 
 
-def load(filename, convertFromZUp="auto", allowTranslation="onlyroot"):
+def eulerMatrices(ai, aj, ak, axes='sxyz'):
+    """
+    Vectorized version of transformations.euler_matrix(): returns the
+    (n, 3, 3) rotation matrices for arrays of n euler angles.
+    """
+    firstaxis, parity, repetition, frame = tm._AXES2TUPLE[axes.lower()]
+
+    i = firstaxis
+    j = tm._NEXT_AXIS[i+parity]
+    k = tm._NEXT_AXIS[i-parity+1]
+
+    ai = np.asarray(ai, dtype=np.float64)
+    aj = np.asarray(aj, dtype=np.float64)
+    ak = np.asarray(ak, dtype=np.float64)
+    if frame:
+        ai, ak = ak, ai
+    if parity:
+        ai, aj, ak = -ai, -aj, -ak
+
+    si, sj, sk = np.sin(ai), np.sin(aj), np.sin(ak)
+    ci, cj, ck = np.cos(ai), np.cos(aj), np.cos(ak)
+    cc, cs = ci*ck, ci*sk
+    sc, ss = si*ck, si*sk
+
+    M = np.empty((len(ai), 3, 3), dtype=np.float64)
+    if repetition:
+        M[:, i, i] = cj
+        M[:, i, j] = sj*si
+        M[:, i, k] = sj*ci
+        M[:, j, i] = sj*sk
+        M[:, j, j] = -cj*ss+cc
+        M[:, j, k] = -cj*cs-sc
+        M[:, k, i] = -sj*ck
+        M[:, k, j] = cj*sc+cs
+        M[:, k, k] = cj*cc-ss
+    else:
+        M[:, i, i] = cj*ck
+        M[:, i, j] = sj*sc-cs
+        M[:, i, k] = sj*cc+ss
+        M[:, j, i] = cj*sk
+        M[:, j, j] = sj*ss+cc
+        M[:, j, k] = sj*cs-sc
+        M[:, k, i] = -sj
+        M[:, k, j] = cj*si
+        M[:, k, k] = cj*ci
+    return M
+
+def getCompiledMetadata(bvh_file):
+    """
+    Metadata stored with compiled BVH animations, allowing to auto scale them
+    without parsing the BVH file.
+    """
+    joint_lengths = bvh_file.getJointLengths()
+    return {'jointNames': np.asarray(joint_lengths.keys()),
+            'jointLengths': np.asarray(joint_lengths.values(), dtype=np.float32)}
+
+def getCompiledOptions(convertFromZUp="auto", allowTranslation="onlyroot"):
+    """
+    Load options that are stored with, and validated against, compiled BVH
+    animations.
+    """
+    return {'convertFromZUp': convertFromZUp,
+            'allowTranslation': allowTranslation}
+
+def loadAnimationTrack(filepath, skel, convertFromZUp="auto", allowTranslation="onlyroot"):
+    """
+    Load the animation from a BVH file, retargeted to skeleton skel, from its
+    compiled binary version if it is up to date and was compiled with the same
+    options (see load()).
+    Returns the (unscaled) animation track and a dict with the rest lengths of
+    the BVH joints (see BVH.getJointLengths()).
+    """
+    def _load():
+        bvh_file = load(filepath, convertFromZUp, allowTranslation)
+        return bvh_file.createAnimationTrack(skel), getCompiledMetadata(bvh_file)
+
+    options = getCompiledOptions(convertFromZUp, allowTranslation)
+    anim, metadata = animation.loadAnimation(filepath, skel, _load, options)
+    joint_lengths = dict(zip([unicode(n) for n in metadata['jointNames']], metadata['jointLengths']))
+    return anim, joint_lengths
+
+def load(filename, convertFromZUp="auto", allowTranslation="onlyroot", startFrame=0, endFrame=None, stride=1):
     """
     convertFromZUp      determine whether to convert the joint structure from
                         Z-up coordinates to MH's Y-up coordinate system, or
@@ -771,11 +872,15 @@ def load(filename, convertFromZUp="auto", allowTranslation="onlyroot"):
                         (allowed values: "auto", True, False)
     allowTranslation    determine which should receive translation animation 
                         (allowed values: "onlyroot", "all", "none")
+    startFrame, endFrame, stride
+                        load only the frames from startFrame up to endFrame
+                        (exclusive, None for the last frame), taking every
+                        stride-th frame
     """
     result = BVH()
     result.convertFromZUp = convertFromZUp
     result.allowTranslation = allowTranslation
-    result.fromFile(filename)
+    result.fromFile(filename, startFrame, endFrame, stride)
     return result
 
 def createFromSkeleton(skel, animationTrack=None, dummyJoints=True):
@@ -39,12 +39,13 @@ TODO
 
 import os
 import math
+import weakref
 import numpy as np
 from core import G
 import getpath
 import log
-from collections import OrderedDict
 import makehuman
+import animation
 
 import material
 import json
@@ -92,8 +93,8 @@ class Proxy:
 
         self.ref_vIdxs = None       # (Vidx1,Vidx2,Vidx3) list with references to human vertex indices, indexed by proxy vert
         self.weights = None         # (w1,w2,w3) list, with weights per human vertex (mapped by ref_vIdxs), indexed by proxy vert
-        self.vertWeights = {}       # (proxy-vert, weight) list for each parent vert (reverse mapping of self.weights, indexed by human vertex)
         self.offsets = None         # (x,y,z) list of vertex offsets, indexed by proxy vert
+        self._vertexMapping = None  # Sparse mapping of human vertices to proxy verts, built from ref_vIdxs and weights on first use
 
         self.vertexBoneWeights = None   # Explicitly defined custom vertex-to-bone weights, connecting the proxy mesh to the reference skeleton (optional)
                                         # Not to be confused with the vertex weights assigned for mapping the proxy mesh geometry to the base mesh
@@ -184,17 +185,7 @@ class Proxy:
         self.weights = np.asarray([v._weights for v in refVerts], dtype=np.float32)
         self.ref_vIdxs = np.asarray([v._verts for v in refVerts], dtype=np.uint32)
         self.offsets = np.asarray([v._offset for v in refVerts], dtype=np.float32)
-
-
-    def _reloadReverseMapping(self):
-        """
-        Reconstruct reverse vertex (and weights) mapping
-        """
-        self.vertWeights = {}
-        for pxy_vIdx in xrange(self.ref_vIdxs.shape[0]):
-            _addProxyVertWeight(self.vertWeights, self.ref_vIdxs[pxy_vIdx, 0], pxy_vIdx, self.weights[pxy_vIdx, 0])
-            _addProxyVertWeight(self.vertWeights, self.ref_vIdxs[pxy_vIdx, 1], pxy_vIdx, self.weights[pxy_vIdx, 1])
-            _addProxyVertWeight(self.vertWeights, self.ref_vIdxs[pxy_vIdx, 2], pxy_vIdx, self.weights[pxy_vIdx, 2])
+        self._vertexMapping = None
 
 
     def getCoords(self, fit_to_posed=False):
@@ -202,6 +193,12 @@ class Proxy:
             hcoord = self.human.meshData.coord
         else:
             hcoord = self.human.getRestposeCoordinates()
+
+        # Proxies attached to the human are fitted together, in one pass
+        fitting = self.human.getProxyFitting()
+        if fitting.contains(self):
+            return fitting.getCoords(self, hcoord)
+
         matrix = self.tmatrix.getMatrix(hcoord)
 
         ref_vIdxs = self.ref_vIdxs
@@ -230,6 +227,16 @@ class Proxy:
         else:
             return self.name
 
+    def getVertexMapping(self):
+        """
+        The mapping of human vertices to the vertices of this proxy, as a
+        sparse animation.VertexMapping. It is built once, from ref_vIdxs and
+        weights, and used to transfer the vertex weights of the human.
+        """
+        if self._vertexMapping is None:
+            self._vertexMapping = animation.VertexMapping(self.ref_vIdxs, self.weights)
+        return self._vertexMapping
+
     def hasCustomVertexWeights(self):
         """
         Determines whether this proxy explicitly defines its own set of vertex
@@ -245,7 +252,8 @@ class Proxy:
         """
         Map armature weights mapped to the human to the proxy mesh through the
         proxy mapping.
-        humanWeights is expected to be an animation.VertexBoneWeights object.
+        humanWeights is expected to be an animation.VertexBoneWeights object,
+        with the weights of skel (of the base skeleton if skel is None).
 
         Only when this proxy has custom weights:
         Optionally remaps the weights to fit a user-selected skeleton when a
@@ -262,34 +270,44 @@ class Proxy:
         # the bones of the reference skeleton, to those of the current skeleton.
         # The current skeleton is retrieved from the human object linked to this
         # proxy.
+        # The human weights are the weights of skel (the base skeleton if no
+        # skel is specified), so the result is cached per proxy for the
+        # skeleton and the version of its weights. The skeleton is referenced
+        # weakly, so the cache does not keep it alive.
+        if skel is None:
+            skel = self.human.getBaseSkeleton()
+        uuid = self.getUuid()
+
+        cached = _vertexWeightsCache.get(uuid, None)
+        if cached is not None and skel is not None and \
+           cached[0]() is skel and cached[1] == skel.weightsVersion:
+            return cached[2]
+
         if self.hasCustomVertexWeights():
-            # TODO we could introduce caching of weights here as long as the skeleton is not changed
-            if skel is None:
-                return self.human.getBaseSkeleton().getVertexWeights(self.vertexBoneWeights, force_remap=True)
-            else:
-                return skel.getVertexWeights(self.vertexBoneWeights, force_remap=True)
+            weights = skel.getVertexWeights(self.vertexBoneWeights, force_remap=True)
+        else:
+            # Remap weights through proxy mapping
+            weights = humanWeights.transfer(self.getVertexMapping())
 
-        # Remap weights through proxy mapping
-        WEIGHT_THRESHOLD = 1e-4  # Threshold for including bone weight
-        weights = OrderedDict()
+        if skel is not None:
+            _vertexWeightsCache[uuid] = (weakref.ref(skel), skel.weightsVersion, weights)
+        return weights
 
-        for bname, (indxs, wghts) in humanWeights.data.items():
-            vgroup = []
-            empty = True
-            for (v,wt) in zip(indxs, wghts):
-                try:
-                    vlist = self.vertWeights[v]
-                except KeyError:
-                    vlist = []
-                for (pv, w) in vlist:
-                    pw = w*wt
-                    if (pw > WEIGHT_THRESHOLD):
-                        vgroup.append((pv, pw))
-                        empty = False
-            if not empty:
-                weights[bname] = vgroup
-        
-        return humanWeights.create(weights)#, vertexCount)
+
+# Vertex weights mapped to proxies by Proxy.getVertexWeights(), one entry per
+# proxy UUID: (skeleton weakref, skeleton weights version, weights)
+_vertexWeightsCache = {}
+
+def clearVertexWeightsCache(uuid=None):
+    """
+    Evict the cached proxy vertex weights of the proxy with specified UUID,
+    or of all proxies if no UUID is given. Should be called when a proxy is
+    replaced or removed.
+    """
+    if uuid is None:
+        _vertexWeightsCache.clear()
+    else:
+        _vertexWeightsCache.pop(uuid, None)
 
 
 doRefVerts = 1
@@ -467,9 +485,9 @@ def loadTextProxy(human, filepath, type="Clothes"):
             refVert = ProxyRefVert(human)
             refVerts.append(refVert)
             if len(words) == 1:
-                refVert.fromSingle(words, vnum, proxy.vertWeights)
+                refVert.fromSingle(words, vnum)
             else:
-                refVert.fromTriple(words, vnum, proxy.vertWeights)
+                refVert.fromTriple(words, vnum)
             vnum += 1
 
         elif status == doWeights:
@@ -614,9 +632,6 @@ def loadBinaryProxy(path, human, type):
     if "deleteVerts" in npzfile:
         proxy.deleteVerts = npzfile['deleteVerts']
 
-    # Reconstruct reverse vertex (and weights) mapping
-    proxy._reloadReverseMapping()
-
     proxy.tmatrix = TMatrix()
 
     proxy.uvLayers = {}
@@ -654,16 +669,15 @@ class ProxyRefVert:
     def __init__(self, human):
         self.human = human
 
-    def fromSingle(self, words, vnum, vertWeights):
+    def fromSingle(self, words, vnum):
         # TODO store the number of reference verts in proxy so that we can efficiently save and load them.
         v0 = int(words[0])
         self._verts = (v0,0,1)
         self._weights = (1.0,0.0,0.0)
         self._offset = np.zeros(3, float)
-        _addProxyVertWeight(vertWeights, v0, vnum, 1)
         return self
 
-    def fromTriple(self, words, vnum, vertWeights):
+    def fromTriple(self, words, vnum):
         v0 = int(words[0])
         v1 = int(words[1])
         v2 = int(words[2])
@@ -681,9 +695,6 @@ class ProxyRefVert:
         self._weights = (w0,w1,w2)
         self._offset = np.array((d0,d1,d2), float)
 
-        _addProxyVertWeight(vertWeights, v0, vnum, w0)
-        _addProxyVertWeight(vertWeights, v1, vnum, w1)
-        _addProxyVertWeight(vertWeights, v2, vnum, w2)
         return self
 
     def getWeights(self):
@@ -696,13 +707,6 @@ class ProxyRefVert:
             np.dot(matrix, self._offset)
             )
 
-def _addProxyVertWeight(vertWeights, v, pv, w):
-    try:
-        vertWeights[v].append((pv, w))
-    except KeyError:
-        vertWeights[v] = [(pv,w)]
-    return
-
 #
 #   class TMatrix:
 #   Transformation matrix. Replaces previous scale
@@ -791,6 +795,95 @@ class TMatrix:
         return mat[:3,:3]
 
 
+class ProxyFitting(object):
+    """
+    Fits a set of proxies to the basemesh together. The vertex mappings of
+    all proxies are concatenated into one table, so that the proxy
+    coordinates of all of them are calculated with a single gather from the
+    basemesh coordinates and one weighted sum.
+    The result is kept until the basemesh coordinates change, so fitting the
+    other proxies of the set afterwards comes at no additional cost.
+    """
+
+    def __init__(self, proxies):
+        self.proxies = list(proxies)
+        self._index = dict((id(pxy), pIdx) for pIdx, pxy in enumerate(self.proxies))
+
+        counts = [len(pxy.ref_vIdxs) for pxy in self.proxies]
+        self._offsets = np.cumsum([0] + counts)
+        if self.proxies:
+            self.ref_vIdxs = np.vstack([pxy.ref_vIdxs for pxy in self.proxies]).astype(np.intp)
+            self.weights = np.vstack([pxy.weights for pxy in self.proxies])
+            self.offsets = np.vstack([pxy.offsets for pxy in self.proxies])
+        else:
+            self.ref_vIdxs = np.zeros((0,3), dtype=np.intp)
+            self.weights = np.zeros((0,3), dtype=np.float32)
+            self.offsets = np.zeros((0,3), dtype=np.float32)
+
+        # Scale matrices (most common) are evaluated for all proxies at once,
+        # shear matrices per proxy
+        self._scaleProxies = []
+        self._shearProxies = []
+        scaleVerts = []
+        scaleDen = []
+        for pIdx, pxy in enumerate(self.proxies):
+            if pxy.tmatrix.scaleData:
+                self._scaleProxies.append(pIdx)
+                scaleVerts.append([(vn1, vn2) for (vn1, vn2, den) in pxy.tmatrix.scaleData])
+                scaleDen.append([den for (vn1, vn2, den) in pxy.tmatrix.scaleData])
+            elif pxy.tmatrix.shearData or pxy.tmatrix.lShearData or pxy.tmatrix.rShearData:
+                self._shearProxies.append(pIdx)
+        self._scaleProxies = np.asarray(self._scaleProxies, dtype=np.intp)
+        self._scaleVerts = np.asarray(scaleVerts, dtype=np.uint32).reshape(-1,3,2)
+        self._scaleDen = np.asarray(scaleDen, dtype=float).reshape(-1,3)
+
+        self._hcoord = None
+        self._coord = None
+
+    def contains(self, pxy):
+        return id(pxy) in self._index
+
+    def getMatrices(self, hcoord):
+        """
+        The offset transformation matrix of every proxy, as an array of
+        3x3 matrices.
+        """
+        matrices = np.zeros((len(self.proxies),3,3), dtype=float)
+        matrices[:] = Unit3
+        if len(self._scaleProxies):
+            axis = np.arange(3)
+            co = hcoord[self._scaleVerts]    # (nScaleProxies, 3 axes, 2 verts, xyz)
+            num = np.abs(co[:,axis,0,axis] - co[:,axis,1,axis])
+            matrices[self._scaleProxies[:,None],axis,axis] = num / self._scaleDen
+        for pIdx in self._shearProxies:
+            matrices[pIdx] = self.proxies[pIdx].tmatrix.getMatrix(hcoord)
+        return matrices
+
+    def fit(self, hcoord):
+        """
+        Fit all proxies to the basemesh coordinates hcoord. Returns the
+        coordinates of all proxy vertices, in the order of the proxies.
+        """
+        if self._coord is not None and np.array_equal(self._hcoord, hcoord):
+            return self._coord
+
+        self._hcoord = np.array(hcoord, dtype=np.float32)
+        coord = np.einsum('ij,ijk->ik', self.weights, self._hcoord.take(self.ref_vIdxs, axis=0))
+        for pIdx, matrix in enumerate(self.getMatrices(hcoord)):
+            start, end = self._offsets[pIdx], self._offsets[pIdx+1]
+            coord[start:end] += np.dot(self.offsets[start:end], matrix.T)
+
+        self._coord = coord
+        return coord
+
+    def getCoords(self, pxy, hcoord):
+        """
+        The coordinates of proxy pxy fitted to basemesh coordinates hcoord.
+        """
+        pIdx = self._index[id(pxy)]
+        return self.fit(hcoord)[self._offsets[pIdx]:self._offsets[pIdx+1]].copy()
+
+
 def vertsToNumpy(verts):
     result = np.asarray(verts)
     return np.asarray([result[:,0], result[:,1], result[:,2]], dtype=np.float32)
@@ -82,6 +82,7 @@ class Skeleton(object):
         self.planes = {}    # Named planes defined between joints, used for calculating bone roll angle
         self.plane_map_strategy = 3  # The remapping strategy used by addReferencePlanes() for remapping orientation planes from a reference skeleton
 
+        self.weightsVersion = 0     # Modification counter of the vertex weights and their references, for caching remapped weights
         self.vertexWeights = None  # Source vertex weights, defined on the basemesh, for this skeleton
         self.has_custom_weights = False  # True if this skeleton has its own .mhw file
 
@@ -188,6 +189,15 @@ class Skeleton(object):
         weights = self.getVertexWeights(ref_weights)
         weights.toFile(os.path.join(os.path.dirname(filename), weights_file))
 
+    @property
+    def vertexWeights(self):
+        return self._vertexWeights
+
+    @vertexWeights.setter
+    def vertexWeights(self, weights):
+        self._vertexWeights = weights
+        self.weightsVersion += 1
+
     def getVertexWeights(self, referenceWeights=None, force_remap=False):
         """
         Get the vertex weights of this skeleton. If this is called for the first
@@ -200,23 +210,24 @@ class Skeleton(object):
         vertexweights through this method.
         Returns the vertex weights for this skeleton.
         """
-        from collections import OrderedDict
         if referenceWeights is None:
             return self.vertexWeights
         if not force_remap and self.vertexWeights is not None:
             return self.vertexWeights
 
-        # Remap vertex weights from reference bones
-        weights = OrderedDict()
+        # Remap vertex weights from reference bones, collected as arrays with
+        # the vertex index, bone index and weight of every weight
+        verts = []
+        bones = []
+        values = []
 
-        for bone in self.getBones():
+        for bIdx, bone in enumerate(self.getBones()):
             b_weights = []
             if len(bone.weight_reference_bones) > 0:
                 add_count = 0
                 for rbname in bone.weight_reference_bones:
                     if rbname in referenceWeights.data:
-                        vrts,wghs = referenceWeights.data[rbname]
-                        b_weights.extend( zip(vrts,wghs) )
+                        b_weights.append(referenceWeights.data[rbname])
                         add_count += 1
                     else:
                         if not makehuman.isRelease():
@@ -239,8 +250,7 @@ class Skeleton(object):
                 # Try to map by bone name
                 if bone.name in referenceWeights.data:
                     # Implicitly map bone by name to reference skeleton weights
-                    vrts,wghs = referenceWeights.data[bone.name]
-                    b_weights = zip(vrts,wghs)
+                    b_weights.append(referenceWeights.data[bone.name])
                 else:
                     if not makehuman.isRelease():
                         # This warning is emitted when no matching bones in the reference skeleton can be found, and
@@ -251,10 +261,17 @@ class Skeleton(object):
                         # weights.
                         log.warning("No explicit weight reference bone mapping for bone %s, and cannot implicitly map by name. This bone will not have any weights.", bone.name)
 
-            if len(b_weights) > 0:
-                weights[bone.name] = b_weights
-
-        vertWeights = referenceWeights.create(weights, vertexCount=referenceWeights.vertexCount, rootBone=self.roots[0].name)
+            for vrts, wghs in b_weights:
+                verts.append(vrts)
+                bones.append(np.repeat(bIdx, len(vrts)))
+                values.append(wghs)
+
+        if verts:
+            verts, bones, values = np.concatenate(verts), np.concatenate(bones), np.concatenate(values)
+        vertWeights = referenceWeights.createFromArrays(verts, bones, values,
+                                                        [bone.name for bone in self.getBones()],
+                                                        referenceWeights.vertexCount,
+                                                        rootBone=self.roots[0].name)
         if self.vertexWeights is None:
             self.vertexWeights = vertWeights
         return vertWeights
@@ -334,6 +351,8 @@ class Skeleton(object):
                         bone._weight_reference_bones = list(set(bone._weight_reference_bones))
                 reverse_ref_map = _update_reverse_ref_map(self)  # Make sure that another parent bone cannot be weighted to these again
 
+        self.weightsVersion += 1
+
     def addReferencePlanes(self, referenceSkel):
         """
         Add bone rotation reference planes to map from a reference rig to
@@ -588,6 +607,69 @@ class Skeleton(object):
         # TODO avoid this loop, eg by storing a pre-allocated poseMats np array in skeleton and keeping a reference to a sub-array in each bone. It would allow batch processing of all pose matrices in one np call
         self.update()
 
+    def getSkinningMatrices(self, poseData, chunkSize=1024):
+        """
+        Batched forward kinematics: calculate the skinning matrices (the
+        matPoseVerts of each bone) for many poses at once, without changing
+        the pose of this skeleton.
+
+        poseData    np.array((nFrames*nBones, 3, 4) or (nFrames*nBones, 4, 4))
+            pose matrices in the format accepted by setPose(), ordered per
+            frame - per bone (breadth-first)
+
+        Global pose matrices are evaluated for all frames at once with one
+        pass per level of the bone hierarchy, and multiplied with the inverse
+        bind (rest) matrices. Frames are processed in chunks of chunkSize
+        frames to bound the memory used for temporary 4x4 matrices.
+
+        returns     np.array((nFrames*nBones, 3, 4), dtype=float64)
+        """
+        bones = self.getBones()
+        nBones = len(bones)
+        nFrames = len(poseData) / nBones
+        if nFrames * nBones != len(poseData):
+            raise RuntimeError("The specified pose data does not have the proper length. Is %s, expected a multiple of %s (nBones)." % (len(poseData), nBones))
+
+        restGlobal = np.asarray([bone.matRestGlobal for bone in bones], dtype=np.float64)
+        restRelative = np.asarray([bone.matRestRelative for bone in bones], dtype=np.float64)
+        invRest = la.inv(restGlobal)
+
+        # Bone indices per hierarchy level, breadth-first order guarantees
+        # that parents are evaluated before their children
+        depths = np.zeros(nBones, dtype=np.int32)
+        parents = np.zeros(nBones, dtype=np.int32)
+        for bIdx, bone in enumerate(bones):
+            if bone.parent:
+                parents[bIdx] = bone.parent.index
+                depths[bIdx] = depths[bone.parent.index] + 1
+        levels = [np.flatnonzero(depths == d) for d in xrange(depths.max()+1)]
+
+        poseData = poseData.reshape((nFrames, nBones) + poseData.shape[1:])
+        result = np.empty((nFrames, nBones, 3, 4), dtype=np.float64)
+        for start in xrange(0, nFrames, chunkSize):
+            end = min(start + chunkSize, nFrames)
+            poses = poseData[start:end]
+
+            # Pose rotations relative to the local bone rest axis (see setPose)
+            matPose = np.zeros((end-start, nBones, 4, 4), dtype=np.float64)
+            matPose[...,:3,:3] = poses[...,:3,:3]
+            matPose[...,3,3] = 1
+            matPose = np.matmul(np.matmul(invRest, matPose), restGlobal)
+            if poses.shape[-1] == 4:
+                # Translations described in bone-local axis directions
+                matPose[...,:3,3] = np.einsum('bij,fbj -> fbi', invRest[:,:3,:3], poses[...,:3,3])
+            else:
+                matPose[...,:3,3] = 0
+
+            # Global pose matrices, one hierarchy level at a time
+            matPoseGlobal = np.matmul(restRelative, matPose)
+            for level in levels[1:]:
+                matPoseGlobal[:,level] = np.matmul(matPoseGlobal[:,parents[level]], matPoseGlobal[:,level])
+
+            result[start:end] = np.matmul(matPoseGlobal, invRest)[...,:3,:4]
+
+        return result.reshape((nFrames*nBones, 3, 4))
+
     def isInRestPose(self):
         for bone in self.getBones():
             if not bone.isInRestPose():
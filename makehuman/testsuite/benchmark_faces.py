@@ -0,0 +1,157 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2015
+
+**Licensing:**         AGPL3 (http://www.makehuman.org/doc/node/the_makehuman_application.html)
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+**Coding Standards:**  See http://www.makehuman.org/node/165
+
+Abstract
+--------
+
+Benchmark of the construction of the vertex to face adjacency (vface) and of
+the vertex to edge and inverse vertex maps of subdivided meshes, on the
+basemesh, a proxy and a subdivided basemesh. Compares the vectorized
+construction with the per-vertex loops used before.
+Also times clone(filterMaskedVerts=True), as done by the exporters, which
+rebuilds the adjacency of the cloned mesh.
+
+Run from the makehuman folder:
+
+    python testsuite/benchmark_faces.py
+"""
+
+import sys
+sys.path = [".", "./core", "./lib", "./apps", "./shared"] + sys.path
+import time
+import numpy as np
+import files3d
+import guicommon
+import catmull_clark_subdivision
+from module3d import group_rows
+from getpath import getSysDataPath
+
+REPEAT = 5
+
+def vfaceReference(fvert, nverts, maxFaces):
+    """
+    Construction of the padded (nverts, maxFaces) vface array as done before,
+    with a python loop over all vertices.
+    """
+    vface = np.zeros((nverts, maxFaces), dtype=np.uint32)
+    nfaces = np.zeros(nverts, dtype=np.uint8)
+    map_ = np.argsort(fvert.flat)
+    vi = fvert.flat[map_]
+    fi = np.mgrid[:fvert.shape[0],:fvert.shape[1]][0].flat[map_].astype(np.uint32)
+    del map_
+    ix, first = np.unique(vi, return_index=True)
+    n = first[1:] - first[:-1]
+    n = np.hstack((n, np.array([len(vi) - first[-1]])))
+    nfaces[ix] = n.astype(np.uint8)
+    for i in xrange(len(ix)):
+        vface[ix[i],:n[i]] = fi[first[i]:][:n[i]]
+    return vface, nfaces
+
+def vfaceVectorized(mesh):
+    mesh._update_faces()
+    return mesh.vface, mesh.nfaces
+
+def reverseMapReference(input, output):
+    """
+    Inverse (n to m) vertex map of the subdivision module as done before.
+    """
+    map_ = np.argsort(input.flat)
+    vi = input.flat[map_]
+    fi = np.mgrid[:input.shape[0],:input.shape[1]][0].flat[map_].astype(np.uint32)
+    del map_
+    ix, first = np.unique(vi, return_index=True)
+    n = first[1:] - first[:-1]
+    n = np.hstack((n, np.array([len(vi) - first[-1]])))
+    for i in xrange(len(ix)):
+        output[ix[i], :n[i]] = fi[first[i]:][:n[i]]
+
+def reverseMapVectorized(input, output):
+    rows = np.repeat(np.arange(input.shape[0], dtype=np.uint32), input.shape[1])
+    group_rows(input, rows, output)
+
+def timeit(func, *args, **kwargs):
+    func(*args, **kwargs)
+    t = time.time()
+    for _ in xrange(REPEAT):
+        func(*args, **kwargs)
+    return 1000 * (time.time() - t) / REPEAT
+
+def sortedRows(vface, counts):
+    """
+    Rows of vface with their valid columns sorted, for comparison.
+    """
+    valid = np.arange(vface.shape[1])[None,:] < counts[:,None]
+    return np.sort(np.where(valid, vface, np.iinfo(np.uint32).max), axis=1)
+
+def benchmark(name, mesh):
+    nverts = mesh.getVertexCount()
+    ref, refCounts = vfaceReference(mesh.fvert, nverts, mesh.MAX_FACES)
+    new, newCounts = vfaceVectorized(mesh)
+    same = np.all(refCounts == newCounts) and \
+           np.all(sortedRows(ref, refCounts) == sortedRows(new[:,:ref.shape[1]], newCounts))
+    tRef = timeit(vfaceReference, mesh.fvert, nverts, mesh.MAX_FACES)
+    tNew = timeit(vfaceVectorized, mesh)
+    print "%-12s %7d verts  vface: loop %7.2f ms   vectorized %7.2f ms   (%.1fx, identical: %s)" % \
+          (name, nverts, tRef, tNew, tRef / tNew, same)
+
+def benchmarkClone(name, mesh):
+    print "%-12s %7d verts  clone(filterMaskedVerts=True) %7.2f ms" % \
+          (name, mesh.getVertexCount(), timeit(mesh.clone, filterMaskedVerts=True))
+
+def benchmarkSubdivision(name, mesh):
+    subdivided = catmull_clark_subdivision.createSubdivisionObject(mesh)
+    cvert = subdivided._parent_map[subdivided.cbase:subdivided.ebase, :4]
+    width = np.bincount(cvert[cvert >= 0], minlength=mesh.getVertexCount()).max()
+    out = - np.ones((mesh.getVertexCount(), width), dtype=np.int32)
+    tRef = timeit(reverseMapReference, cvert, out)
+    tNew = timeit(reverseMapVectorized, cvert, out)
+    print "%-12s %7d verts  inverse map: loop %7.2f ms   vectorized %7.2f ms   (%.1fx)" % \
+          (name, mesh.getVertexCount(), tRef, tNew, tRef / tNew)
+    print "%-12s %7d verts  createSubdivisionObject %7.2f ms" % \
+          (name, mesh.getVertexCount(), timeit(catmull_clark_subdivision.createSubdivisionObject, mesh))
+    return subdivided
+
+if __name__ == '__main__':
+    basemesh = files3d.loadMesh(getSysDataPath("3dobjs/base.obj"))
+    obj = guicommon.Object(basemesh)  # Subdivision requires the mesh to belong to an object
+    proxy = files3d.loadMesh(getSysDataPath("eyes/high-poly/high-poly.obj"))
+
+    subdivided = benchmarkSubdivision("basemesh", basemesh)
+    catmull_clark_subdivision.updateSubdivisionObject(subdivided)
+
+    benchmark("basemesh", basemesh)
+    benchmark("proxy", proxy)
+    benchmark("subdivided", subdivided)
+
+    benchmarkClone("basemesh", basemesh)
+    benchmarkClone("proxy", proxy)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2015
+
+**Licensing:**         AGPL3 (http://www.makehuman.org/doc/node/the_makehuman_application.html)
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+**Coding Standards:**  See http://www.makehuman.org/node/165
+
+Abstract
+Abstract
+--------
+
+Benchmark of reapplying all targets of randomized bodies, as done by the
+random modifier plugin and the commandline model generation, with the
+morph basis (algos3d.getMorphBasis) and by applying the targets one by one,
+both with the targets already buffered and with an empty target buffer.
+Also times evaluating a batch of variations of a body (the same targets with
+different weights) with one MorphBasis.dot() call.
+Requires the packed target store (compile_targets.py).
+
+Run from the makehuman folder:
+
+    python testsuite/benchmark_morphbasis.py
+"""
+
+import sys
+sys.path = [".", "./core", "./lib", "./apps", "./shared"] + sys.path
+import time
+import numpy as np
+import files3d
+import algos3d
+from getpath import getSysDataPath
+
+N_TARGETS = 300     # Approximate number of targets with a non-zero weight in a randomized body
+N_BODIES = 20
+BATCH = 10
+
+def randomBodies(basis, rs):
+    """
+    Weight vectors of N_BODIES bodies, each with N_TARGETS random targets.
+    """
+    weights = np.zeros((N_BODIES, len(basis)), dtype=np.float32)
+    for body in weights:
+        body[rs.choice(len(basis), N_TARGETS, replace=False)] = rs.rand(N_TARGETS)
+    return weights
+
+def variations(bodies, rs):
+    """
+    BATCH variations of every body, with random weights for its targets.
+    """
+    result = np.repeat(bodies[:,None], BATCH, axis=1)
+    result *= rs.rand(*result.shape).astype(np.float32)
+    return result
+
+def applyTargets(mesh, basis, weights):
+    algos3d.resetObj(mesh)
+    targets = [(algos3d.getTarget(mesh, basis.targetPaths[t]), weights[t]) for t in np.flatnonzero(weights)]
+    algos3d.applyTargets(mesh, targets, 0, 0)
+    return mesh.coord.copy()
+
+def applyBasis(mesh, basis, weights):
+    mesh.changeCoords(mesh.orig_coord + basis.dot(weights))
+    return mesh.coord.copy()
+
+def timeBodies(func, bodies, clearBuffer=False):
+    t = 0
+    for weights in bodies:
+        if clearBuffer:
+            algos3d._targetBuffer.clear()
+        t0 = time.time()
+        func(weights)
+        t += time.time() - t0
+    return 1000 * t / len(bodies)
+
+if __name__ == '__main__':
+    basemesh = files3d.loadMesh(getSysDataPath("3dobjs/base.obj"))
+    basis = algos3d.getMorphBasis(basemesh)
+    if basis is None:
+        print "No packed target store, run compile_targets.py first"
+        sys.exit(1)
+
+    rs = np.random.RandomState(0)
+    bodies = randomBodies(basis, rs)
+    batches = variations(bodies[:N_BODIES/BATCH], rs)
+    err = max([np.max(np.abs(applyTargets(basemesh, basis, w) - applyBasis(basemesh, basis, w))) for w in bodies])
+
+    tCold = timeBodies(lambda w: applyTargets(basemesh, basis, w), bodies, clearBuffer=True)
+    tWarm = timeBodies(lambda w: applyTargets(basemesh, basis, w), bodies)
+    tBasis = timeBodies(lambda w: applyBasis(basemesh, basis, w), bodies)
+    tSingle = timeBodies(lambda w: basis.dot(w), batches.reshape(-1, len(basis)))
+    tBatch = timeBodies(lambda w: basis.dot(w), batches) / BATCH
+
+    print "%d bodies with %d of %d targets (max diff %.1e)" % (N_BODIES, N_TARGETS, len(basis), err)
+    print "  per target, empty buffer   %7.2f ms/body" % tCold
+    print "  per target, buffered       %7.2f ms/body" % tWarm
+    print "  morph basis                %7.2f ms/body   (%.2fx, %.2fx)" % (tBasis, tCold / tBasis, tWarm / tBasis)
+    print "%d variations of %d bodies" % (BATCH, len(batches))
+    print "  morph basis                %7.2f ms/body" % tSingle
+    print "  morph basis, batch of %-3d  %7.2f ms/body   (%.2fx)" % (BATCH, tBatch, tSingle / tBatch)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+
+"""
+**Project Name:**      MakeHuman
+
+**Product Home Page:** http://www.makehuman.org/
+
+**Code Home Page:**    https://bitbucket.org/MakeHuman/makehuman/
+
+**Authors:**           Jonas Hauquier
+
+**Copyright(c):**      MakeHuman Team 2001-2015
+
+**Licensing:**         AGPL3 (http://www.makehuman.org/doc/node/the_makehuman_application.html)
+
+    This file is part of MakeHuman (www.makehuman.org).
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU Affero General Public License as
+    published by the Free Software Foundation, either version 3 of the
+    License, or (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Affero General Public License for more details.
+
+    You should have received a copy of the GNU Affero General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+**Coding Standards:**  See http://www.makehuman.org/node/165
+
+Abstract
+--------
+
+Benchmark of linear blend skinning (animation.skinMesh) on the basemesh and
+on a heavily dressed character, comparing the chunked k-weight kernel with
+accumulating full-size per-weight matrix temporaries (the previous approach).
+
+Run from the makehuman folder:
+
+    python testsuite/benchmark_skinning.py
+"""
+
+import sys
+sys.path = [".", "./core", "./lib", "./shared"] + sys.path
+import json
+import time
+import numpy as np
+import files3d
+import animation
+from getpath import getSysDataPath
+
+# Vertex counts of the clothing proxies of a heavily dressed character
+# (clothing is not shipped with the source tree, so these are synthetic)
+DRESSED_PROXIES = [14000, 12000, 9500, 8000, 6000, 4500, 3000, 2500]
+N_WEIGHTS = [4, 6, 13]
+REPEAT = 10
+
+def skinMeshReference(coords, compiledVertWeights, poseData):
+    """
+    Skinning as done before the chunked kernel: one (nverts, 3, c) matrix
+    temporary per weight, accumulated over the whole mesh at once.
+    """
+    c = coords.shape[1]
+    b_idxs, wghts = compiledVertWeights
+    P = poseData
+    accum = wghts[:,0,None,None] * P[b_idxs[:,0]][:,:3,:c]
+    for i in xrange(1, b_idxs.shape[1]):
+        accum += wghts[:,i,None,None] * P[b_idxs[:,i]][:,:3,:c]
+    return np.einsum('ijk,ikl -> ij', accum[:,:3,:c], coords[:,:c,None])
+
+def randomWeights(nVerts, nBones, nWeights, rs):
+    """
+    Random compiled vertex weights, with between 1 and nWeights bones per
+    vertex.
+    """
+    b_idxs = rs.randint(0, nBones, (nVerts, nWeights)).astype(np.uint32)
+    wghts = rs.rand(nVerts, nWeights).astype(np.float32)
+    wghts *= np.arange(nWeights)[None,:] < rs.randint(1, nWeights+1, nVerts)[:,None]
+    wghts /= np.sum(wghts, axis=1)[:,None]
+    return b_idxs, wghts
+
+def timeit(func, *args, **kwargs):
+    func(*args, **kwargs)
+    t = time.time()
+    for _ in xrange(REPEAT):
+        func(*args, **kwargs)
+    return 1000 * (time.time() - t) / REPEAT
+
+def benchmark(name, meshes, nBones, nWeights, rs):
+    poseData = rs.rand(nBones, 3, 4).astype(np.float32)
+    data = []
+    for nVerts in meshes:
+        coords = np.ones((nVerts, 4), dtype=np.float32)
+        coords[:,:3] = rs.rand(nVerts, 3)
+        data.append( (coords, randomWeights(nVerts, nBones, nWeights, rs), np.empty((nVerts, 3), dtype=np.float32)) )
+
+    def reference():
+        return [skinMeshReference(coords, weights, poseData) for coords, weights, _ in data]
+
+    def kernel():
+        return [animation.skinMesh(coords, weights, poseData, out) for coords, weights, out in data]
+
+    err = max([np.max(np.abs(r - k)) for r, k in zip(reference(), kernel())])
+    tRef = timeit(reference)
+    tNew = timeit(kernel)
+    print "%-10s %7d verts  %2d weights   reference %7.2f ms   skinMesh %7.2f ms   (%.2fx, max diff %.1e)" % \
+          (name, sum(meshes), nWeights, tRef, tNew, tRef / tNew, err)
+
+if __name__ == '__main__':
+    rs = np.random.RandomState(0)
+    basemesh = files3d.loadMesh(getSysDataPath("3dobjs/base.obj"))
+    nBones = len(json.load(open(getSysDataPath("rigs/default.mhskel"), 'rb'))["bones"])
+
+    for nWeights in N_WEIGHTS:
+        benchmark("basemesh", [basemesh.getVertexCount()], nBones, nWeights, rs)
+        benchmark("dressed", [basemesh.getVertexCount()] + DRESSED_PROXIES, nBones, nWeights, rs)